@@ -1,20 +1,31 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response, stream_with_context
 import requests
 import json
 import os
 import re
+import threading
 import time
 from typing import Dict, Any
-from memory_service import MemoryService
+from memory_service import create_memory_service
 from mcp_service import mcp_service
 from github_mcp_service import GitHubMCPService
+from yandex_client import create_client, COMPLETION_URL, AGENTS_URL
+from llm_errors import LLMUnavailableError
+from completion_cache import CompletionCache
+from parallel_runner import ParallelRunner
+from diversity_stats import diversity_stats
+from model_router import ModelRouter
+from tokenizer_service import TokenizerService
+from summary_tree import SummaryTree
+from summarizer import ExtractiveSummarizer, clean_summary, split_by_tokens
+from dialog_store import DialogStateStore, DialogSessionCache
+from semantic_memory import SemanticMemory
 import uuid
+from functools import partial, wraps
 from datetime import datetime
 
 app = Flask(__name__)
 
-# Инициализация сервиса внешней памяти (День 9)
-memory = MemoryService("agent_memory.db")
 # Загрузка конфигурации
 def load_config():
     if os.path.exists('config.json'):
@@ -25,6 +36,43 @@ def load_config():
 
 config = load_config()
 
+# Инициализация сервиса внешней памяти (День 9)
+# Долгоживущие соединения с SQLite в режиме WAL закрываются при остановке воркера
+memory = create_memory_service(config, "agent_memory.db")
+
+# Кэш детерминированных ответов LLM (SQLite рядом с agent_memory.db)
+completion_cache = CompletionCache(
+    db_path=os.path.join(os.path.dirname(os.path.abspath(memory.db_path)), "llm_cache.db"),
+    max_memory_entries=config.get('cache_memory_entries', 512),
+    max_entries=config.get('cache_max_entries', 10000),
+    ttl_seconds=config.get('cache_ttl_seconds', 86400),
+    enabled=config.get('cache_enabled', True)
+)
+
+# Общий пул keep-alive соединений к Yandex Cloud для всех вызовов LLM
+yandex_client = create_client(config, cache=completion_cache)
+
+# Подсчет токенов: через Yandex Tokenizer API (tokenizer_backend = 'yandex')
+# или локальной моделью; результаты мемоизируются
+tokenizer = TokenizerService.from_config(
+    config, remote=partial(yandex_client.tokenize, f"gpt://{config['catalog_id']}/yandexgpt/latest")
+)
+
+# Локальное summary истории диалога, когда модель суммаризации недоступна
+extractive_summarizer = ExtractiveSummarizer()
+
+
+def yandex_embedding(text, kind):
+    """Эмбеддинг Yandex Cloud: kind 'doc' - запись памяти, 'query' - запрос пользователя"""
+    return yandex_client.embed(f"emb://{config['catalog_id']}/text-search-{kind}/latest", text)
+
+
+# Векторный поиск по долговременной памяти (embedding_backend = 'yandex' или локальные эмбеддинги)
+semantic_memory = SemanticMemory.from_config(config, memory, embed=yandex_embedding)
+
+# Общий ограниченный пул потоков для параллельных вызовов LLM
+parallel_runner = ParallelRunner(max_workers=config.get('llm_max_workers', 8))
+
 # Инициализация GitHub MCP сервиса (День 10)
 # GitHub токен можно установить через переменную окружения GITHUB_TOKEN
 # или добавить в config.json
@@ -36,20 +84,34 @@ else:
     print("   Установите переменную окружения GITHUB_TOKEN или добавьте github_token в config.json")
     github_mcp_service = None
 
-# Текущая сессия - попытка загрузить последнюю или создать новую
+# Текущая сессия хранится в базе, а не в переменной процесса:
+# переключение или очистку в одном воркере gunicorn видят все остальные
 def get_or_create_session():
-    """Получает последнюю сессию из БД или создает новую"""
+    """Получает текущую сессию из БД, иначе последнюю или создает новую"""
+    session_id = memory.get_current_session()
+    if session_id:
+        return session_id
+
     sessions = memory.list_sessions(limit=1)
     if sessions:
         # Используем последнюю сессию
-        return sessions[0]['session_id']
+        session_id = sessions[0]['session_id']
     else:
         # Создаем новую сессию
         session_id = str(uuid.uuid4())
         memory.create_session(session_id, f'Сессия {datetime.now().strftime("%Y-%m-%d %H:%M")}')
-        return session_id
+    memory.set_current_session(session_id)
+    return session_id
+
 
-current_session_id = get_or_create_session()
+def start_new_session(title=None):
+    """Создает новую сессию и делает ее текущей"""
+    session_id = str(uuid.uuid4())
+    memory.create_session(session_id, title or f'Сессия {datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    memory.set_current_session(session_id)
+    return session_id
+
+get_or_create_session()
 
 
 
@@ -66,33 +128,230 @@ class DialogHistoryManager:
     """
     Менеджер истории диалога с механизмом компрессии.
     Автоматически создает summary каждые N сообщений.
+
+    Summary каждой компрессии добавляется в SummaryTree: прежние summary
+    объединяются в summary более высокого уровня, поэтому контекст
+    ограничен по размеру, но факты из начала диалога не теряются.
+
+    Режим trigger='messages' сжимает историю каждые compression_threshold
+    сообщений и оставляет 3 последних. Режим trigger='tokens' сжимает,
+    когда история для API превышает бюджет токенов (token_budget или
+    context_fraction окна модели model_key), и оставляет последние
+    сообщения в пределах keep_recent_tokens - размер запроса предсказуем
+    независимо от длины сообщений. Если и после сжатия история не ниже
+    порога (summary и недавние сообщения сами занимают бюджет), следующая
+    компрессия ждет еще keep_recent_tokens новых токенов, а не запускается
+    на каждом сообщении.
+
+    В фоновом режиме summary создается в отдельном потоке заранее - за
+    prefetch сообщений (или с prefetch_ratio бюджета) до порога, а сжатый
+    контекст подменяется атомарно, когда готов. Запрос пользователя не
+    ждет модель суммаризации.
+
+    С хранилищем store (DialogStateStore) состояние сессии session_id
+    живет в SQLite: перед каждой операцией менеджер сверяет версию и при
+    необходимости перечитывает состояние, после изменения - сохраняет его.
+    Так несколько воркеров gunicorn ведут один и тот же диалог, а сжатый
+    контекст переживает перезапуск.
     """
-    def __init__(self, compression_threshold=10, use_compression=True):
+    # Сколько последних сообщений оставлять без сжатия в режиме 'messages'
+    KEEP_RECENT_MESSAGES = 3
+
+    # Поля, которые сохраняются в store (_generation - чтобы фоновая
+    # компрессия в другом воркере поняла, что история уже сжата или очищена)
+    STATE_FIELDS = ('messages', 'message_tokens', 'compressed_messages', 'compression_count',
+                    'total_tokens_saved', 'full_tokens', 'context_tokens', 'compressed_tokens',
+                    'summary_nodes', 'summary_backends', '_generation')
+
+    def __init__(self, compression_threshold=10, use_compression=True,
+                 background=False, prefetch=2, summary_fanout=4, summary_budget_tokens=800,
+                 trigger='messages', token_budget=None, context_fraction=0.5,
+                 model_key='yandexgpt', prefetch_ratio=0.8, keep_recent_tokens=None,
+                 summarizer='auto', store=None, session_id=None):
         """
         Args:
             compression_threshold: Количество сообщений до компрессии
             use_compression: Включить/выключить механизм компрессии
+            background: Сжимать историю в фоновом потоке
+            prefetch: За сколько сообщений до порога начинать фоновую компрессию
+            summary_fanout: Сколько summary одного уровня объединять в одно
+            summary_budget_tokens: Максимальный размер всех summary контекста (токенов)
+            trigger: 'messages' - по числу сообщений, 'tokens' - по бюджету токенов
+            token_budget: Бюджет токенов истории (None - context_fraction окна модели)
+            context_fraction: Доля окна контекста model_key, отводимая под историю
+            model_key: Модель из YANDEX_MODELS, под окно которой считается бюджет
+            prefetch_ratio: С какой доли бюджета начинать фоновую компрессию
+            keep_recent_tokens: Сколько токенов последних сообщений оставлять
+                                без сжатия (None - четверть бюджета)
+            summarizer: 'remote' - модель суммаризации, 'local' - экстрактивное
+                        summary без LLM, 'auto' - модель, а при ее ошибке, медленных
+                        ответах или разомкнутом предохранителе - локальное summary
+            store: DialogStateStore для общего между воркерами состояния (None - только в памяти)
+            session_id: Сессия, состояние которой хранится в store
         """
         self.messages = []  # Полная история сообщений
+        self.message_tokens = []  # Токены каждого сообщения self.messages (считаются один раз)
         self.compressed_messages = []  # Сжатая история (summary + недавние сообщения)
         self.compression_threshold = compression_threshold
         self.use_compression = use_compression
+        self.background = background
+        self.prefetch = prefetch
+        self.trigger = trigger
+        self.token_budget = token_budget
+        self.context_fraction = context_fraction
+        self.model_key = model_key
+        self.prefetch_ratio = prefetch_ratio
+        self.keep_recent_tokens = keep_recent_tokens
+        self.summarizer = summarizer
+        self.summary_backends = {'remote': 0, 'local': 0}  # Сколько summary создано каждым бэкендом
         self.compression_count = 0  # Количество выполненных компрессий
         self.total_tokens_saved = 0  # Общее количество сэкономленных токенов
 
-    def add_message(self, role, text):
+        # Текущие суммы токенов: статистика не пересчитывает всю историю
+        self.full_tokens = 0  # Токены self.messages
+        self.context_tokens = 0  # Токены system message со сжатым контекстом
+        self.compressed_tokens = 0  # Токены истории для API сразу после последней компрессии
+
+        # Иерархия summary сжатой части истории (от старых к новым)
+        self.summary_tree = SummaryTree(
+            self._merge_summaries, tokenizer.count,
+            fanout=summary_fanout, budget_tokens=summary_budget_tokens
+        )
+        self.summary_nodes = []
+
+        self.compression_pending = False  # Идет фоновая компрессия
+        self._compressed_since_add = False  # Контекст подменен после прошлого add_message
+        self._generation = 0  # Меняется при каждой подмене и очистке истории
+        self._compression_done = threading.Event()
+        self._compression_done.set()
+        self._lock = threading.RLock()
+
+        self.store = store
+        self.session_id = session_id
+        self._version = 0  # Версия состояния в store, с которой совпадает память
+        if self.store is not None:
+            self._refresh()
+
+    def export_state(self):
+        """Состояние истории для сохранения (словарь, сериализуемый в JSON)"""
+        with self._lock:
+            return {field: getattr(self, field) for field in self.STATE_FIELDS}
+
+    def _refresh(self):
+        """Перечитать состояние из store, если его изменил другой воркер (вызывается под self._lock)"""
+        if self.store is None or self.store.version(self.session_id) == self._version:
+            return
+        loaded = self.store.load(self.session_id)
+        if loaded is None:
+            # Состояние удалено вместе с сессией
+            self._reset_state()
+            self._version = 0
+            return
+        self._version, state = loaded
+        for field in self.STATE_FIELDS:
+            if field in state:  # состояние, сохраненное до появления поля, его не содержит
+                setattr(self, field, state[field])
+
+    def _update(self, change):
+        """
+        Изменить состояние функцией change (вызывается под self._lock).
+        С store состояние перед изменением перечитывается, а после - сохраняется;
+        если другой воркер успел сохранить свою версию, change повторяется на ней.
+        change возвращает False, если ничего не изменил
+        """
+        while True:
+            self._refresh()
+            result = change()
+            if self.store is None or result is False:
+                return result
+            version = self.store.save(self.session_id, self.export_state(), self._version)
+            if version is not None:
+                self._version = version
+                return result
+
+    def add_message(self, role, text, tokens=None):
         """
         Добавить новое сообщение в историю.
-        Возвращает True, если была выполнена компрессия, иначе False.
+        tokens - уже известное число токенов текста (иначе считается здесь).
+        Возвращает True, если история была сжата (в фоновом режиме - если
+        сжатый контекст подменен с момента прошлого вызова), иначе False.
         """
+        if tokens is None:
+            tokens = estimate_tokens(text)
         message = {"role": role, "text": text}
-        self.messages.append(message)
 
-        # Проверяем, нужно ли выполнить компрессию
-        if self.use_compression and len(self.messages) >= self.compression_threshold:
+        def append():
+            self.messages.append(message)
+            self.message_tokens.append(tokens)
+            self.full_tokens += tokens
+
+        with self._lock:
+            self._update(append)
+
+            if not self.use_compression:
+                return False
+
+            if self.background:
+                compressed = self._compressed_since_add
+                self._compressed_since_add = False
+                if not self.compression_pending and self._should_compress(early=True):
+                    self._start_background_compression()
+                return compressed
+
+            # Проверяем, нужно ли выполнить компрессию
+            should_compress = self._should_compress()
+
+        if should_compress:
             return self._compress_history()
         return False
 
+    def get_token_budget(self):
+        """Бюджет токенов истории для режима 'tokens'"""
+        if self.token_budget:
+            return self.token_budget
+        # Окно модели известно только после загрузки модуля (YANDEX_MODELS ниже)
+        return int(YANDEX_MODELS[self.model_key]['context_window'] * self.context_fraction)
+
+    def _should_compress(self, early=False):
+        """
+        Достигнут ли порог компрессии (вызывается под self._lock).
+        early - порог фоновой компрессии, которая начинается заранее
+        """
+        if self.trigger == 'tokens':
+            ratio = self.prefetch_ratio if early else 1.0
+            threshold = self.get_token_budget() * ratio
+            if self.compressed_tokens >= threshold:
+                # Прошлая компрессия не опустила историю ниже порога: сжимать снова
+                # имеет смысл, только когда наберется новая часть истории для summary
+                threshold = self.compressed_tokens + self._keep_recent_tokens()
+            return self.history_tokens(use_compressed=True) >= threshold
+
+        prefetch = self.prefetch if early else 0
+        return len(self.messages) >= self.compression_threshold - prefetch
+
+    def _split_index(self):
+        """
+        Сколько первых сообщений сжимать (вызывается под self._lock).
+        В режиме 'tokens' без сжатия остаются последние сообщения в пределах
+        keep_recent_tokens, но хотя бы одно
+        """
+        if self.trigger != 'tokens':
+            return max(0, len(self.messages) - self.KEEP_RECENT_MESSAGES)
+
+        keep_tokens = self._keep_recent_tokens()
+        kept = 1
+        recent_tokens = self.message_tokens[-1] if self.message_tokens else 0
+        while kept < len(self.messages) and recent_tokens + self.message_tokens[-kept - 1] <= keep_tokens:
+            kept += 1
+            recent_tokens += self.message_tokens[-kept]
+        return max(0, len(self.messages) - kept)
+
+    def _keep_recent_tokens(self):
+        """Сколько токенов последних сообщений оставлять без сжатия в режиме 'tokens'"""
+        if self.keep_recent_tokens is None:
+            return self.get_token_budget() // 4
+        return self.keep_recent_tokens
+
     def _compress_history(self):
         """
         Выполняет компрессию истории диалога.
@@ -100,27 +359,98 @@ class DialogHistoryManager:
         Возвращает True, если компрессия была выполнена успешно.
         """
         # Разделяем историю на две части:
-        # 1. Старая часть для компрессии (все кроме последних 3 сообщений)
-        # 2. Новая часть для сохранения (последние 3 сообщения)
-        messages_to_compress = self.messages[:-3]
-        recent_messages = self.messages[-3:]
+        # 1. Старая часть для компрессии (все кроме последних сообщений)
+        # 2. Новая часть для сохранения (последние 3 сообщения или по бюджету токенов)
+        with self._lock:
+            messages_to_compress = self.messages[:self._split_index()]
+            summary_nodes = self.summary_nodes
+            generation = self._generation
 
         if len(messages_to_compress) < 2:
             return False  # Недостаточно сообщений для компрессии
 
+        return self._summarize_and_apply(generation, messages_to_compress, summary_nodes)
+
+    def _start_background_compression(self):
+        """Запустить компрессию старых сообщений в фоновом потоке (вызывается под self._lock)"""
+        messages_to_compress = self.messages[:self._split_index()]
+        if len(messages_to_compress) < 2:
+            return
+
+        self.compression_pending = True
+        self._compression_done.clear()
+        threading.Thread(
+            target=self._compress_in_background,
+            args=(self._generation, messages_to_compress, self.summary_nodes),
+            name="dialog-compression",
+            daemon=True
+        ).start()
+
+    def _compress_in_background(self, generation, messages_to_compress, summary_nodes):
+        """Создать summary и подменить контекст; история за это время могла пополниться"""
+        try:
+            self._summarize_and_apply(generation, messages_to_compress, summary_nodes)
+        finally:
+            with self._lock:
+                self.compression_pending = False
+            self._compression_done.set()
+
+    def wait_for_compression(self, timeout=None):
+        """Дождаться завершения фоновой компрессии; False - если не дождались"""
+        return self._compression_done.wait(timeout)
+
+    def _summarize_and_apply(self, generation, messages_to_compress, summary_nodes):
+        """Создать summary старых сообщений, добавить его в иерархию и подменить контекст"""
         # Создаем summary из старых сообщений
         summary_text = self._create_summary(messages_to_compress)
+        summary_nodes = self.summary_tree.add(summary_nodes, summary_text, len(messages_to_compress))
+        return self._apply_compression(generation, len(messages_to_compress), summary_text, summary_nodes)
 
-        # Подсчет сэкономленных токенов
-        original_tokens = sum(estimate_tokens(msg["text"]) for msg in messages_to_compress)
+    def _apply_compression(self, generation, compressed_count, summary_text, summary_nodes):
+        """
+        Заменить первые compressed_count сообщений сжатым контекстом.
+        Возвращает False, если история изменилась с начала компрессии
+        (очищена или уже сжата) и summary устарело.
+        """
+        system_message = self._context_message(SummaryTree.render(summary_nodes))
+        context_tokens = estimate_tokens(system_message)
         summary_tokens = estimate_tokens(summary_text)
-        tokens_saved = original_tokens - summary_tokens
 
-        self.total_tokens_saved += tokens_saved
-        self.compression_count += 1
+        def apply():
+            if generation != self._generation:
+                return False
 
-        # Формируем новую сжатую историю
-        system_message = f"""КОНТЕКСТ ПРЕДЫДУЩЕГО ДИАЛОГА: {summary_text}
+            # Подсчет сэкономленных токенов
+            original_tokens = sum(self.message_tokens[:compressed_count])
+            self.total_tokens_saved += original_tokens - summary_tokens
+            self.compression_count += 1
+
+            # ВАЖНО: Сохраняем только system message в compressed_messages
+            # Актуальные сообщения будут браться из self.messages в get_history_for_api()
+            self.compressed_messages = [
+                {"role": "system", "text": system_message}
+            ]
+            self.context_tokens = context_tokens
+            self.summary_nodes = summary_nodes
+
+            # Очищаем полную историю, оставляем только недавние сообщения
+            # (и добавленные во время фоновой компрессии)
+            self.messages = self.messages[compressed_count:]
+            self.message_tokens = self.message_tokens[compressed_count:]
+            self.full_tokens -= original_tokens
+            self.compressed_tokens = self.context_tokens + self.full_tokens
+            self._generation += 1
+            return True
+
+        with self._lock:
+            applied = self._update(apply)
+            if applied:
+                self._compressed_since_add = True
+        return applied
+
+    def _context_message(self, summary_text):
+        """System message со сжатым контекстом диалога"""
+        return f"""КОНТЕКСТ ПРЕДЫДУЩЕГО ДИАЛОГА: {summary_text}
 
 ═══════════════════════════════════════════════
 КРИТИЧЕСКИ ВАЖНЫЕ ИНСТРУКЦИИ ДЛЯ ТЕБЯ:
@@ -155,16 +485,6 @@ class DialogHistoryManager:
 
 ЗАПОМНИ: Ты отвечаешь ФАКТАМИ и ИНФОРМАЦИЕЙ, а НЕ задаешь вопросы!"""
 
-        # ВАЖНО: Сохраняем только system message в compressed_messages
-        # Актуальные сообщения будут браться из self.messages в get_history_for_api()
-        self.compressed_messages = [
-            {"role": "system", "text": system_message}
-        ]
-
-        # Очищаем полную историю, оставляем только недавние сообщения
-        self.messages = recent_messages.copy()
-        return True
-
     def _create_summary(self, messages):
         """
         Создает краткое резюме из списка сообщений.
@@ -179,13 +499,104 @@ class DialogHistoryManager:
         # Объединяем все ответы ассистента
         responses_text = "\n\n".join(assistant_responses)
 
-        # Используем специализированную модель для суммаризации
-        url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-        headers = {
-            "Content-Type": "application/json",
-            "Authorization": f"Api-Key {config['api_key']}"
-        }
+        try:
+            summary = self._summarize_text(responses_text)
+            if summary is None:
+                # Фоллбэк: простое текстовое резюме
+                return f"Обсуждалось {len(messages)} сообщений"
+            return summary
+        except Exception as e:
+            # В случае ошибки возвращаем простое резюме
+            return f"Предыдущий диалог ({len(messages)} сообщений)"
+
+    def _merge_summaries(self, summaries):
+        """
+        Объединяет несколько summary в одно (для SummaryTree).
+        Возвращает None, если модель суммаризации не ответила.
+        """
+        try:
+            return self._summarize_text("\n\n".join(summaries), sentence_range="3-5")
+        except Exception:
+            return None
 
+    def _summarize_text(self, responses_text, sentence_range="2-3"):
+        """
+        Краткая справка по тексту (без вопросов и предложений задач).
+        Бэкенд - self.summarizer; None - summary получить не удалось
+        """
+        max_sentences = int(sentence_range.rsplit('-', 1)[-1])
+        if self.summarizer == 'local' or (self.summarizer == 'auto' and self._remote_degraded()):
+            return self._local_summary(responses_text, max_sentences)
+
+        try:
+            summary = self._remote_summary(responses_text, sentence_range)
+        except Exception:
+            if self.summarizer != 'auto':
+                raise
+            summary = None
+
+        if summary is None:
+            if self.summarizer == 'auto':
+                return self._local_summary(responses_text, max_sentences)
+            return None  # модель не вернула summary - в summary_backends не учитывается
+        self._count_summary('remote')
+        return summary
+
+    def _local_summary(self, responses_text, max_sentences):
+        """Экстрактивное summary без вызова модели"""
+        self._count_summary('local')
+        return extractive_summarizer.summarize(responses_text, max_sentences=max_sentences)
+
+    def _count_summary(self, backend):
+        with self._lock:
+            self.summary_backends[backend] += 1
+
+    def _remote_degraded(self):
+        """
+        Модель суммаризации недоступна или медленная: предохранитель не замкнут
+        или p95 задержки в его окне выше summarizer_slow_seconds
+        """
+        breaker = yandex_client.breakers.get('summarization')
+        if breaker is None:
+            return False
+        stats = breaker.get_stats()
+        return stats['state'] != 'closed' or stats['latency_p95'] > config.get('summarizer_slow_seconds', 10.0)
+
+    def _remote_summary(self, responses_text, sentence_range, depth=0):
+        """
+        Краткая справка по тексту от модели суммаризации Yandex Cloud.
+        Текст больше summary_chunk_tokens делится на фрагменты, они
+        суммаризируются параллельно (map), а их summary объединяются (reduce)
+        """
+        chunks = split_by_tokens(responses_text, config.get('summary_chunk_tokens', 4000), tokenizer.count)
+        if len(chunks) <= 1 or depth >= 3:
+            return self._summarize_chunk(responses_text, sentence_range)
+
+        # map: summary фрагментов (каждое попадает в кэш ответов отдельно)
+        outcomes = parallel_runner.run(
+            {index: partial(self._summarize_chunk, chunk, "2-3") for index, chunk in enumerate(chunks)},
+            max_concurrency=config.get('summary_map_concurrency', 4)
+        )
+        partials = []
+        for index, chunk in enumerate(chunks):
+            summary = outcomes[index]['result']
+            if not summary and self.summarizer == 'auto':
+                # Фрагмент без summary модели заменяем локальным, чтобы не потерять его факты
+                summary = self._local_summary(chunk, 3)
+            if summary:
+                partials.append(summary)
+        if not partials:
+            return None
+
+        # reduce: объединение summary фрагментов (при необходимости - снова по частям)
+        return self._remote_summary("\n\n".join(partials), sentence_range, depth + 1)
+
+    def _summarize_chunk(self, responses_text, sentence_range):
+        """
+        Краткая справка по тексту от модели суммаризации Yandex Cloud
+        (без вопросов и предложений задач). None - модель не вернула ответ
+        """
+        # Используем специализированную модель для суммаризации
         payload = {
             "modelUri": f"gpt://{config['catalog_id']}/summarization/latest",
             "completionOptions": {
@@ -218,75 +629,24 @@ class DialogHistoryManager:
 Исходная информация:
 {responses_text}
 
-Твоя справка (2-3 предложения с точками, БЕЗ вопросов):"""
+Твоя справка ({sentence_range} предложения с точками, БЕЗ вопросов):"""
                 }
             ]
         }
 
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            result = response.json()
-
-            if "result" in result and "alternatives" in result["result"]:
-                summary = result["result"]["alternatives"][0]["message"]["text"].strip()
-
-                # Очищаем summary от типичных вводных фраз
-                unwanted_phrases = [
-                    "Перечисли основные моменты предыдущего диалога.",
-                    "Основные моменты:",
-                    "Резюме:",
-                    "Краткое резюме:",
-                    "В диалоге обсуждались следующие темы:",
-                    "Пользователь спросил",
-                    "Обсуждались темы:",
-                    "В предыдущем диалоге:",
-                    "Факты из диалога:",
-                ]
-
-                for phrase in unwanted_phrases:
-                    if summary.lower().startswith(phrase.lower()):
-                        summary = summary[len(phrase):].strip()
-                        # Удаляем начальные двоеточия и точки после удаления фразы
-                        summary = summary.lstrip(':. ')
-
-                # КРИТИЧЕСКИ ВАЖНО: Удаляем ВСЕ предложения с вопросами
-                # Разбиваем на предложения и оставляем только утвердительные
-                sentences = summary.split('.')
-                filtered_sentences = []
-                for sentence in sentences:
-                    sentence = sentence.strip()
-                    if not sentence:
-                        continue
-                    # Удаляем предложения с вопросительными знаками
-                    if '?' in sentence:
-                        continue
-                    # Удаляем предложения, начинающиеся с вопросительных слов
-                    lower_sentence = sentence.lower()
-                    question_words = ['как', 'какой', 'какая', 'какие', 'почему', 'зачем', 'где',
-                                     'куда', 'когда', 'чем', 'кто', 'что', 'нужно ли', 'следует ли',
-                                     'можно ли', 'стоит ли']
-                    if any(lower_sentence.startswith(word) for word in question_words):
-                        continue
-                    # Удаляем предложения с модальными словами (предложения задач)
-                    modal_words = ['нужно', 'следует', 'необходимо', 'стоит', 'давайте']
-                    if any(word in lower_sentence for word in modal_words):
-                        continue
-                    filtered_sentences.append(sentence)
-
-                # Собираем обратно
-                summary = '. '.join(filtered_sentences)
-                if summary and not summary.endswith('.'):
-                    summary += '.'
-
-                return summary
-            else:
-                # Фоллбэк: простое текстовое резюме
-                return f"Обсуждалось {len(messages)} сообщений"
+        # Summary одного и того же фрагмента не зависит от менеджера: кэш ответов
+        # (ключ - хеш текста фрагмента и параметров суммаризации) переиспользует
+        # его при повторном проигрывании истории в compare/run_test и между
+        # перезапусками, хотя temperature здесь не 0
+        result = yandex_client.completion(
+            payload, timeout=30, upstream='summarization',
+            use_cache=True if config.get('summary_cache_enabled', True) else None
+        )
 
-        except Exception as e:
-            # В случае ошибки возвращаем простое резюме
-            return f"Предыдущий диалог ({len(messages)} сообщений)"
+        if "result" in result and "alternatives" in result["result"]:
+            summary = result["result"]["alternatives"][0]["message"]["text"].strip()
+            return clean_summary(summary)
+        return None
 
     def get_history_for_api(self, use_compressed=None):
         """
@@ -299,46 +659,128 @@ class DialogHistoryManager:
         Returns:
             list: Список сообщений для API
         """
-        should_use_compressed = use_compressed if use_compressed is not None else self.use_compression
+        with self._lock:
+            self._refresh()
+            return self._api_history(use_compressed)
+
+    def history_snapshot(self, use_compressed=None):
+        """
+        История для API и ее число токенов, прочитанные под одной блокировкой:
+        фоновая компрессия не может подменить историю между ними.
 
+        Returns:
+            tuple: (список сообщений для API, число токенов этой истории)
+        """
+        with self._lock:
+            self._refresh()
+            return self._api_history(use_compressed), self._api_history_tokens(use_compressed)
+
+    def _api_history(self, use_compressed):
+        """История для API из текущего состояния (вызывается под self._lock)"""
+        should_use_compressed = use_compressed if use_compressed is not None else self.use_compression
         if should_use_compressed and self.compressed_messages:
             # ВАЖНО: Формируем актуальную историю с system message + все текущие сообщения
             # compressed_messages[0] - это system message с контекстом
             # self.messages - это актуальные последние сообщения
             return [self.compressed_messages[0]] + self.messages
-        else:
-            return self.messages
+        return list(self.messages)
+
+    def _api_history_tokens(self, use_compressed):
+        """Число токенов истории _api_history (вызывается под self._lock)"""
+        should_use_compressed = use_compressed if use_compressed is not None else self.use_compression
+        if should_use_compressed and self.compressed_messages:
+            return self.context_tokens + self.full_tokens
+        return self.full_tokens
+
+    def message_snapshot(self):
+        """Пары (сообщение, токены) текущей истории, согласованные между собой"""
+        with self._lock:
+            self._refresh()
+            return list(zip(self.messages, self.message_tokens))
+
+    def history_tokens(self, use_compressed=None):
+        """Число токенов истории, которую вернет get_history_for_api() с теми же аргументами"""
+        with self._lock:
+            self._refresh()
+            return self._api_history_tokens(use_compressed)
 
     def get_stats(self):
         """Получить статистику использования компрессии"""
-        full_tokens = sum(estimate_tokens(msg["text"]) for msg in self.messages)
+        with self._lock:
+            self._refresh()
+            full_tokens = self.full_tokens
 
-        # Если есть компрессия, считаем токены как: system message + актуальные сообщения
-        if self.compressed_messages:
-            compressed_tokens = sum(estimate_tokens(msg["text"]) for msg in self.compressed_messages) + full_tokens
-        else:
-            compressed_tokens = full_tokens
+            # Если есть компрессия, считаем токены как: system message + актуальные сообщения
+            compressed_tokens = self.history_tokens(use_compressed=True)
 
-        return {
-            "total_messages": len(self.messages),
-            "compressed_messages": len(self.compressed_messages) + len(self.messages) if self.compressed_messages else 0,
-            "compression_count": self.compression_count,
-            "total_tokens_saved": self.total_tokens_saved,
-            "current_full_tokens": full_tokens,
-            "current_compressed_tokens": compressed_tokens,
-            "compression_ratio": round((1 - compressed_tokens / full_tokens) * 100, 2) if full_tokens > 0 else 0
-        }
+            return {
+                "total_messages": len(self.messages),
+                "compressed_messages": len(self.compressed_messages) + len(self.messages) if self.compressed_messages else 0,
+                "compression_count": self.compression_count,
+                "total_tokens_saved": self.total_tokens_saved,
+                "current_full_tokens": full_tokens,
+                "current_compressed_tokens": compressed_tokens,
+                "compression_ratio": round((1 - compressed_tokens / full_tokens) * 100, 2) if full_tokens > 0 else 0,
+                "compression_pending": self.compression_pending,
+                "compression_trigger": self.trigger,
+                "token_budget": self.get_token_budget() if self.trigger == 'tokens' else None,
+                "summary_nodes": len(self.summary_nodes),
+                "summary_levels": max((node['level'] for node in self.summary_nodes), default=-1) + 1,
+                "summary_tokens": SummaryTree.total_tokens(self.summary_nodes),
+                "summary_backends": dict(self.summary_backends)
+            }
 
     def clear(self):
-        """Очистить всю историю"""
+        """Очистить всю историю (результат идущей фоновой компрессии будет отброшен)"""
+        with self._lock:
+            self._update(self._reset_state)
+            self._compressed_since_add = False
+
+    def _reset_state(self):
+        """Пустая история (вызывается под self._lock)"""
         self.messages = []
+        self.message_tokens = []
         self.compressed_messages = []
         self.compression_count = 0
         self.total_tokens_saved = 0
+        self.full_tokens = 0
+        self.context_tokens = 0
+        self.compressed_tokens = 0
+        self.summary_nodes = []
+        self.summary_backends = {'remote': 0, 'local': 0}
+        self._generation += 1
 
 
-# Создаем менеджер истории с компрессией
-dialog_manager = DialogHistoryManager(compression_threshold=10, use_compression=True)
+# Состояние истории с компрессией хранится по сессиям в той же базе, что и память:
+# все воркеры gunicorn видят один диалог, сжатый контекст переживает перезапуск
+dialog_store = DialogStateStore(memory)
+
+
+def create_dialog_manager(session_id):
+    """
+    Менеджер истории с компрессией для сессии.
+    Компрессия основного диалога идет в фоне и не задерживает ответ пользователю
+    """
+    return DialogHistoryManager(
+        compression_threshold=10,
+        use_compression=True,
+        background=config.get('compression_background', True),
+        prefetch=config.get('compression_prefetch', 2),
+        summary_fanout=config.get('summary_fanout', 4),
+        summary_budget_tokens=config.get('summary_budget_tokens', 800),
+        trigger=config.get('compression_trigger', 'messages'),
+        token_budget=config.get('compression_token_budget'),
+        context_fraction=config.get('compression_context_fraction', 0.5),
+        prefetch_ratio=config.get('compression_prefetch_ratio', 0.8),
+        keep_recent_tokens=config.get('compression_keep_recent_tokens'),
+        summarizer=config.get('summarizer', 'auto'),
+        store=dialog_store if config.get('dialog_state_persist', True) else None,
+        session_id=session_id
+    )
+
+
+# Менеджеры недавних сессий в памяти процесса (сверяют версию состояния в базе)
+dialog_sessions = DialogSessionCache(create_dialog_manager, max_sessions=config.get('dialog_cache_size', 32))
 
 
 RECOMMENDATION_AGENT_PROMPT = """
@@ -468,15 +910,7 @@ EXPERT_PANEL_PROMPT = """Ты - модератор группы эксперто
 def get_recommendation_agent_response(user_message):
     """Получает ответ от агента-рекомендатора фильмов"""
     use_agents_api = bool(config.get('agent_id'))
-    url = (
-        "https://llm.api.cloud.yandex.net/agents/v1/completions"
-        if use_agents_api
-        else "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-    )
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {config['api_key']}"
-    }
+    url = AGENTS_URL if use_agents_api else COMPLETION_URL
 
     # Формируем историю сообщений
     messages = [
@@ -486,6 +920,11 @@ def get_recommendation_agent_response(user_message):
         }
     ]
 
+    # Добавляем относящиеся к запросу факты из долговременной памяти
+    memory_message = memory_context_message(user_message)
+    if memory_message:
+        messages.append(memory_message)
+
     # Добавляем историю диалога
     for msg in recommendation_history[-10:]:
         messages.append(msg)
@@ -513,9 +952,7 @@ def get_recommendation_agent_response(user_message):
         }
 
     try:
-        response = requests.post(url, headers=headers, json=prompt)
-        response.raise_for_status()
-        result = response.json()
+        result = yandex_client.completion(prompt, url=url)
 
         if "result" in result and "alternatives" in result["result"]:
             assistant_text = result["result"]["alternatives"][0]["message"]["text"]
@@ -553,36 +990,62 @@ def get_recommendation_agent_response(user_message):
         else:
             return "Извините, произошла ошибка при получении ответа."
 
+    except LLMUnavailableError:
+        raise
     except requests.exceptions.RequestException as e:
         return f"Ошибка подключения к API: {str(e)}"
     except Exception as e:
         return f"Произошла ошибка: {str(e)}"
 
 
-def get_agent_response(user_message):
-    """Получает ответ от Yandex GPT агента в строгом JSON-формате"""
+def empty_movie_object():
+    """Пустой объект фильма - фолбэк, если модель не вернула валидный JSON"""
+    return {
+        "actors": [],
+        "release": "",
+        "rating": 0,
+        "producer": "",
+        "description": "",
+        "title": ""
+    }
+
+
+def memory_context_message(user_message):
+    """
+    System message с записями долговременной памяти, ближайшими по смыслу
+    к сообщению пользователя (не больше semantic_memory_budget_tokens токенов).
+    None - подходящих записей нет или поиск выключен
+    """
+    if not config.get('semantic_memory_enabled', True):
+        return None
+
+    try:
+        memories = semantic_memory.relevant(
+            user_message,
+            token_budget=config.get('semantic_memory_budget_tokens', 300),
+            count_tokens=tokenizer.count,
+            top_k=config.get('semantic_memory_top_k', 5),
+            min_score=config.get('semantic_memory_min_score', 0.08)
+        )
+    except Exception as e:
+        print(f"Ошибка поиска по долговременной памяти: {e}")
+        return None
+
+    if not memories:
+        return None
+    facts = "\n".join(f"- {item['text']}" for item in memories)
+    return {
+        "role": "system",
+        "text": f"Известные факты из долговременной памяти (используй, если они относятся к вопросу):\n{facts}"
+    }
+
+
+def build_agent_request(user_message):
+    """Формирует URL и тело запроса к агенту-критику фильмов"""
     # Если указан agent_id — используем Agents API (строгая схема применяется на стороне Агента)
     use_agents_api = bool(config.get('agent_id'))
-    url = (
-        "https://llm.api.cloud.yandex.net/agents/v1/completions"
-        if use_agents_api
-        else "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-    )
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {config['api_key']}"
-    }
+    url = AGENTS_URL if use_agents_api else COMPLETION_URL
 
-    def empty_movie_object():
-        return {
-            "actors": [],
-            "release": "",
-            "rating": 0,
-            "producer": "",
-            "description": "",
-            "title": ""
-        }
-    
     # Формируем историю сообщений
     messages = []
     if not use_agents_api:
@@ -612,7 +1075,12 @@ def get_agent_response(user_message):
                 )
             }
         ]
-    
+
+    # Добавляем относящиеся к запросу факты из долговременной памяти
+    memory_message = memory_context_message(user_message)
+    if memory_message:
+        messages.append(memory_message)
+
     # Добавляем историю диалога
     for msg in chat_history[-10:]:
         messages.append(msg)
@@ -640,133 +1108,298 @@ def get_agent_response(user_message):
             },
             "messages": messages
         }
-    
-    try:
-        response = requests.post(url, headers=headers, json=prompt)
-        response.raise_for_status()
-        result = response.json()
 
-        # Извлекаем текст ответа
-        if "result" in result and "alternatives" in result["result"]:
-            assistant_text = result["result"]["alternatives"][0]["message"]["text"]
+    return url, prompt
 
-            # Пытаемся гарантировать строгий JSON: парсим, расковыриваем кавычки, форматируем
-            raw = assistant_text.strip()
+
+def format_agent_text(assistant_text):
+    """Приводит ответ агента к строгому JSON, отформатированному для фронта"""
+    # Пытаемся гарантировать строгий JSON: парсим, расковыриваем кавычки, форматируем
+    raw = assistant_text.strip()
+    parsed = None
+    # 1) прямая попытка распарсить
+    try:
+        parsed = json.loads(raw)
+    except json.JSONDecodeError:
+        parsed = None
+
+    # 2) если это строка с внутри-JSON ("{...}") — распарсим второй раз
+    if isinstance(parsed, str):
+        try:
+            parsed = json.loads(parsed)
+        except json.JSONDecodeError:
             parsed = None
-            # 1) прямая попытка распарсить
+
+    # 3) если всё ещё None — попробуем вырезать самый похожий на JSON блок
+    if parsed is None:
+        match = re.search(r"\{[\s\S]*\}", raw)
+        if match:
+            candidate = match.group(0)
             try:
-                parsed = json.loads(raw)
+                parsed = json.loads(candidate)
             except json.JSONDecodeError:
                 parsed = None
 
-            # 2) если это строка с внутри-JSON ("{...}") — распарсим второй раз
-            if isinstance(parsed, str):
-                try:
-                    parsed = json.loads(parsed)
-                except json.JSONDecodeError:
-                    parsed = None
-
-            # 3) если всё ещё None — попробуем вырезать самый похожий на JSON блок
-            if parsed is None:
-                match = re.search(r"\{[\s\S]*\}", raw)
-                if match:
-                    candidate = match.group(0)
-                    try:
-                        parsed = json.loads(candidate)
-                    except json.JSONDecodeError:
-                        parsed = None
-
-            if parsed is None:
-                # жёсткий фолбэк: пустые поля
-                return json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
-
-            # Успешно: вернём красиво отформатированный JSON строкой (для фронта)
-            return json.dumps(parsed, ensure_ascii=False, indent=2)
+    if parsed is None:
+        # жёсткий фолбэк: пустые поля
+        return json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
+
+    # Успешно: вернём красиво отформатированный JSON строкой (для фронта)
+    return json.dumps(parsed, ensure_ascii=False, indent=2)
+
+
+def get_agent_response(user_message, use_cache=None):
+    """
+    Получает ответ от Yandex GPT агента в строгом JSON-формате.
+    use_cache=False - обойти кэш ответов (по умолчанию кэшируются запросы с temperature 0)
+    """
+    url, prompt = build_agent_request(user_message)
+
+    try:
+        result = yandex_client.completion(prompt, url=url, use_cache=use_cache)
+
+        # Извлекаем текст ответа
+        if "result" in result and "alternatives" in result["result"]:
+            assistant_text = result["result"]["alternatives"][0]["message"]["text"]
+            return format_agent_text(assistant_text)
         else:
             return json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
             
+    except LLMUnavailableError:
+        raise
     except requests.exceptions.RequestException:
         return json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
     except Exception:
         return json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
 
 
-def call_yandex_gpt(messages, temperature=0.7):
-    """Универсальная функция для вызова Yandex GPT"""
-    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {config['api_key']}"
-    }
+def stream_agent_response(user_message, use_cache=None):
+    """
+    Потоковая версия get_agent_response.
+    Отдает сырые фрагменты текста по мере генерации; итоговый JSON
+    нужно получить через format_agent_text() от склеенного текста.
+    """
+    url, prompt = build_agent_request(user_message)
 
-    prompt = {
-        "modelUri": f"gpt://{config['catalog_id']}/yandexgpt/latest",
+    if url == AGENTS_URL:
+        # Agents API отвечает целиком - отдаем ответ одним фрагментом
+        result = yandex_client.completion(prompt, url=url, use_cache=use_cache)
+        if "result" in result and "alternatives" in result["result"]:
+            yield result["result"]["alternatives"][0]["message"]["text"]
+        return
+
+    yield from yandex_client.stream_completion(prompt, url=url, use_cache=use_cache)
+
+
+# Лимит токенов ответа для call_yandex_gpt и stream_yandex_gpt
+GPT_MAX_TOKENS = 2000
+
+
+def build_gpt_request(messages, temperature, stream=False):
+    """
+    Тело запроса для call_yandex_gpt / stream_yandex_gpt.
+    Используется YandexGPT, а если история в ее окно не помещается - модель
+    с большим окном контекста (см. model_router).
+    Возвращает (payload, routing); payload = None, если запрос не помещается ни в одну модель
+    """
+    input_tokens = tokenizer.count_messages(messages)
+    routing = model_router.route(input_tokens, GPT_MAX_TOKENS, preferred='yandexgpt')
+    if routing['model'] is None:
+        return None, routing
+
+    payload = {
+        "modelUri": f"gpt://{config['catalog_id']}/{YANDEX_MODELS[routing['model']]['uri']}",
         "completionOptions": {
-            "stream": False,
+            "stream": stream,
             "temperature": temperature,
-            "maxTokens": 2000
+            "maxTokens": GPT_MAX_TOKENS
         },
         "messages": messages
     }
+    return payload, routing
+
+
+def routed_pricing(routing):
+    """Цены модели, выбранной маршрутизатором (YandexGPT, если запрос никуда не отправлен)"""
+    return YANDEX_MODELS[routing.get('model') or 'yandexgpt']['pricing']
+
+
+def too_large_message(routing):
+    """Текст ошибки для запроса, который не помещается в контекст ни одной модели"""
+    return f"Ошибка: запрос (~{routing['input_tokens']} токенов) не помещается в контекст ни одной модели"
+
+
+def call_yandex_gpt(messages, temperature=0.7, use_cache=None, on_routing=None):
+    """
+    Универсальная функция для вызова Yandex GPT.
+    on_routing(routing) получает решение маршрутизатора (какая модель
+    ответила и почему), чтобы вызывающий добавил его в метрики ответа
+    """
+    prompt, routing = build_gpt_request(messages, temperature)
+    if on_routing is not None:
+        on_routing(routing)
+    if prompt is None:
+        return too_large_message(routing)
 
     try:
-        response = requests.post(url, headers=headers, json=prompt)
-        response.raise_for_status()
-        result = response.json()
+        result = yandex_client.completion(prompt, use_cache=use_cache)
 
         if "result" in result and "alternatives" in result["result"]:
             return result["result"]["alternatives"][0]["message"]["text"]
         else:
             return "Ошибка: не удалось получить ответ"
+    except LLMUnavailableError:
+        raise
     except Exception as e:
         return f"Ошибка: {str(e)}"
 
 
-def solve_direct(task):
+def stream_yandex_gpt(messages, temperature=0.7, use_cache=None, on_routing=None):
+    """Потоковая версия call_yandex_gpt: отдает фрагменты текста по мере генерации"""
+    prompt, routing = build_gpt_request(messages, temperature, stream=True)
+    if on_routing is not None:
+        on_routing(routing)
+    if prompt is None:
+        yield too_large_message(routing)
+        return
+
+    try:
+        yield from yandex_client.stream_completion(prompt, use_cache=use_cache)
+    except LLMUnavailableError:
+        raise
+    except Exception as e:
+        yield f"Ошибка: {str(e)}"
+
+
+def ndjson_response(events):
+    """
+    Отдает генератор событий клиенту потоком NDJSON (один JSON-объект на строку).
+    Заголовок X-Accel-Buffering отключает буферизацию ответа в nginx.
+    """
+    def generate():
+        for event in events:
+            yield json.dumps(event, ensure_ascii=False) + "\n"
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+def json_errors(view):
+    """
+    Ошибка обработчика - ответ {'error': ...} с кодом 500.
+    LLMUnavailableError пропускается дальше, в обработчик handle_llm_unavailable (503 + Retry-After)
+    """
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        try:
+            return view(*args, **kwargs)
+        except LLMUnavailableError:
+            raise
+        except Exception as e:
+            return jsonify({'error': str(e)}), 500
+    return wrapper
+
+
+def solve_direct(task, on_routing=None):
     """Способ 1: Прямой ответ без дополнительных инструкций"""
     messages = [
         {"role": "system", "text": DIRECT_PROMPT},
         {"role": "user", "text": task}
     ]
-    return call_yandex_gpt(messages)
+    return call_yandex_gpt(messages, on_routing=on_routing)
 
 
-def solve_step_by_step(task):
+def solve_step_by_step(task, on_routing=None):
     """Способ 2: Пошаговое решение"""
     messages = [
         {"role": "system", "text": STEP_BY_STEP_PROMPT},
         {"role": "user", "text": task}
     ]
-    return call_yandex_gpt(messages)
+    return call_yandex_gpt(messages, on_routing=on_routing)
 
 
-def solve_with_prompt_generator(task):
-    """Способ 3: Сначала генерируем промпт, затем решаем с его помощью"""
+def solve_with_prompt_generator(task, on_routing=None):
+    """
+    Способ 3: Сначала генерируем промпт, затем решаем с его помощью.
+    on_routing получает решения маршрутизатора для обоих шагов (последнее - для решения)
+    """
     # Шаг 1: Генерируем оптимальный промпт
     messages_generator = [
         {"role": "system", "text": PROMPT_GENERATOR_INSTRUCTION},
         {"role": "user", "text": f"Создай оптимальный промпт для решения следующей задачи:\n\n{task}"}
     ]
-    generated_prompt = call_yandex_gpt(messages_generator)
+    generated_prompt = call_yandex_gpt(messages_generator, on_routing=on_routing)
 
     # Шаг 2: Используем сгенерированный промпт для решения задачи
     messages_solver = [
         {"role": "system", "text": generated_prompt},
         {"role": "user", "text": task}
     ]
-    solution = call_yandex_gpt(messages_solver)
+    solution = call_yandex_gpt(messages_solver, on_routing=on_routing)
 
     # Возвращаем и промпт, и решение
     return f"=== СГЕНЕРИРОВАННЫЙ ПРОМПТ ===\n{generated_prompt}\n\n=== РЕШЕНИЕ С ИСПОЛЬЗОВАНИЕМ ПРОМПТА ===\n{solution}"
 
 
-def solve_with_expert_panel(task):
+def solve_with_expert_panel(task, on_routing=None):
     """Способ 4: Группа экспертов"""
     messages = [
         {"role": "system", "text": EXPERT_PANEL_PROMPT},
         {"role": "user", "text": task}
     ]
-    return call_yandex_gpt(messages, temperature=0.8)
+    return call_yandex_gpt(messages, temperature=0.8, on_routing=on_routing)
+
+
+# Способы рассуждения в порядке вывода. Способы независимы друг от друга
+# и выполняются параллельно; последовательны только два шага prompt_generator.
+REASONING_SOLVERS = {
+    'direct': solve_direct,
+    'step_by_step': solve_step_by_step,
+    'prompt_generator': solve_with_prompt_generator,
+    'expert_panel': solve_with_expert_panel
+}
+REASONING_METHODS = list(REASONING_SOLVERS)
+
+# Системные промпты и температуры одношаговых способов рассуждения
+REASONING_PROMPTS = {
+    'direct': (DIRECT_PROMPT, 0.7),
+    'step_by_step': (STEP_BY_STEP_PROMPT, 0.7),
+    'expert_panel': (EXPERT_PANEL_PROMPT, 0.8)
+}
+
+
+def stream_reasoning_method(method, task, on_routing=None):
+    """
+    Потоковая версия способов рассуждения.
+    Склеенные фрагменты дают тот же текст, что и соответствующая функция solve_*.
+    """
+    if method == 'prompt_generator':
+        messages_generator = [
+            {"role": "system", "text": PROMPT_GENERATOR_INSTRUCTION},
+            {"role": "user", "text": f"Создай оптимальный промпт для решения следующей задачи:\n\n{task}"}
+        ]
+        yield "=== СГЕНЕРИРОВАННЫЙ ПРОМПТ ===\n"
+        generated_prompt = ""
+        for delta in stream_yandex_gpt(messages_generator, on_routing=on_routing):
+            generated_prompt += delta
+            yield delta
+
+        yield "\n\n=== РЕШЕНИЕ С ИСПОЛЬЗОВАНИЕМ ПРОМПТА ===\n"
+        messages_solver = [
+            {"role": "system", "text": generated_prompt},
+            {"role": "user", "text": task}
+        ]
+        yield from stream_yandex_gpt(messages_solver, on_routing=on_routing)
+    else:
+        system_prompt, temperature = REASONING_PROMPTS[method]
+        messages = [
+            {"role": "system", "text": system_prompt},
+            {"role": "user", "text": task}
+        ]
+        yield from stream_yandex_gpt(messages, temperature=temperature, on_routing=on_routing)
 
 
 @app.route('/')
@@ -784,6 +1417,9 @@ def chat():
     if not user_message:
         return jsonify({'error': 'Пустое сообщение'}), 400
 
+    # no_cache: true - запросить у модели свежий ответ в обход кэша
+    use_cache = False if data.get('no_cache') else None
+
     # Сохраняем сообщение пользователя в историю
     chat_history.append({
         "role": "user",
@@ -791,21 +1427,44 @@ def chat():
     })
 
     # ДЕНЬ 9: Сохраняем в внешнюю память
+    current_session_id = get_or_create_session()
     user_tokens = estimate_tokens(user_message)
     memory.save_message(current_session_id, "user", user_message, user_tokens)
 
-    # Получаем ответ от агента
-    assistant_response = get_agent_response(user_message)
+    def save_assistant_response(assistant_response):
+        # Сохраняем ответ агента в историю
+        chat_history.append({
+            "role": "assistant",
+            "text": assistant_response
+        })
 
-    # Сохраняем ответ агента в историю
-    chat_history.append({
-        "role": "assistant",
-        "text": assistant_response
-    })
+        # ДЕНЬ 9: Сохраняем ответ в внешнюю память
+        assistant_tokens = estimate_tokens(assistant_response)
+        memory.save_message(current_session_id, "assistant", assistant_response, assistant_tokens)
 
-    # ДЕНЬ 9: Сохраняем ответ в внешнюю память
-    assistant_tokens = estimate_tokens(assistant_response)
-    memory.save_message(current_session_id, "assistant", assistant_response, assistant_tokens)
+    if data.get('stream'):
+        # Потоковый режим: фрагменты ответа уходят клиенту по мере генерации
+        def generate_events():
+            text = ""
+            try:
+                for delta in stream_agent_response(user_message, use_cache=use_cache):
+                    text += delta
+                    yield {'delta': delta}
+                assistant_response = format_agent_text(text)
+            except LLMUnavailableError as e:
+                yield {'error': str(e), 'reason': e.reason, 'retry_after': round(e.retry_after, 1)}
+                return
+            except Exception:
+                assistant_response = json.dumps(empty_movie_object(), ensure_ascii=False, indent=2)
+
+            save_assistant_response(assistant_response)
+            yield {'done': True, 'response': assistant_response}
+
+        return ndjson_response(generate_events())
+
+    # Получаем ответ от агента
+    assistant_response = get_agent_response(user_message, use_cache=use_cache)
+    save_assistant_response(assistant_response)
 
     return jsonify({
         'response': assistant_response
@@ -828,6 +1487,7 @@ def recommend():
     })
 
     # ДЕНЬ 9: Сохраняем в внешнюю память
+    current_session_id = get_or_create_session()
     user_tokens = estimate_tokens(user_message)
     memory.save_message(current_session_id, "user", f"[Рекомендация] {user_message}", user_tokens)
 
@@ -861,15 +1521,13 @@ def recommend():
 @app.route('/clear', methods=['POST'])
 def clear_history():
     """Очистка истории чата"""
-    global chat_history, current_session_id
+    global chat_history
 
     # Очищаем временную историю
     chat_history = []
 
     # ДЕНЬ 9: Создаем новую сессию, чтобы старые сообщения не загружались
-    old_session_id = current_session_id
-    current_session_id = str(uuid.uuid4())
-    memory.create_session(current_session_id, f'Сессия {datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    current_session_id = start_new_session()
 
     print(f"🗑️ Очищена история чата. Создана новая сессия: {current_session_id[:8]}...")
 
@@ -900,15 +1558,13 @@ def get_recommendation_history():
 @app.route('/clear_recommendations', methods=['POST'])
 def clear_recommendations():
     """Очистка истории рекомендаций"""
-    global recommendation_history, current_session_id
+    global recommendation_history
 
     # Очищаем временную историю
     recommendation_history = []
 
     # ДЕНЬ 9: Создаем новую сессию, чтобы старые сообщения не загружались
-    old_session_id = current_session_id
-    current_session_id = str(uuid.uuid4())
-    memory.create_session(current_session_id, f'Сессия {datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    current_session_id = start_new_session()
 
     print(f"🗑️ Очищена история рекомендаций. Создана новая сессия: {current_session_id[:8]}...")
 
@@ -930,15 +1586,13 @@ def get_reasoning_history():
 @app.route('/clear_reasoning', methods=['POST'])
 def clear_reasoning():
     """Очистка истории рассуждений"""
-    global reasoning_history, current_session_id
+    global reasoning_history
 
     # Очищаем временную историю
     reasoning_history = []
 
     # ДЕНЬ 9: Создаем новую сессию, чтобы старые сообщения не загружались
-    old_session_id = current_session_id
-    current_session_id = str(uuid.uuid4())
-    memory.create_session(current_session_id, f'Сессия {datetime.now().strftime("%Y-%m-%d %H:%M")}')
+    current_session_id = start_new_session()
 
     print(f"🗑️ Очищена история рассуждений. Создана новая сессия: {current_session_id[:8]}...")
 
@@ -949,6 +1603,7 @@ def clear_reasoning():
 
 
 @app.route('/reasoning', methods=['POST'])
+@json_errors
 def reasoning():
     """Решение задачи разными способами рассуждения"""
     global reasoning_history
@@ -968,24 +1623,15 @@ def reasoning():
     })
 
     # ДЕНЬ 9: Сохраняем вопрос в память
+    current_session_id = get_or_create_session()
     user_tokens = estimate_tokens(task)
     memory.save_message(current_session_id, "user", f"[Рассуждение] {task}", user_tokens)
 
-    results = {}
-
-    try:
-        if method == 'all' or method == 'direct':
-            results['direct'] = solve_direct(task)
-
-        if method == 'all' or method == 'step_by_step':
-            results['step_by_step'] = solve_step_by_step(task)
-
-        if method == 'all' or method == 'prompt_generator':
-            results['prompt_generator'] = solve_with_prompt_generator(task)
-
-        if method == 'all' or method == 'expert_panel':
-            results['expert_panel'] = solve_with_expert_panel(task)
+    selected_methods = [name for name in REASONING_METHODS if method == 'all' or method == name]
+    # Решение маршрутизатора по каждому способу: какая модель ответила (YandexGPT или модель с большим окном)
+    routing = {}
 
+    def save_reasoning_results(results):
         # Сохраняем результаты в историю рассуждений
         reasoning_history.append({
             "role": "assistant",
@@ -999,17 +1645,125 @@ def reasoning():
         assistant_tokens = estimate_tokens(str(results))
         memory.save_message(current_session_id, "assistant", f"[Рассуждение] {results_summary}", assistant_tokens)
 
-        return jsonify({
-            'task': task,
-            'method': method,
-            'results': results
-        })
+    if data.get('stream'):
+        # Потоковый режим: события {method, delta} от всех способов по мере генерации
+        def generate_events():
+            streams = {
+                name: partial(stream_reasoning_method, name, task, on_routing=partial(routing.__setitem__, name))
+                for name in selected_methods
+            }
+            texts = {name: "" for name in selected_methods}
+            timings = {}
+            errors = {}
+
+            for name, delta, outcome in parallel_runner.merge_streams(streams):
+                if outcome is None:
+                    texts[name] += delta
+                    yield {'method': name, 'delta': delta}
+                    continue
+
+                timings[name] = outcome['elapsed']
+                if outcome['error']:
+                    errors[name] = outcome['error']
+                    texts[name] += f"Ошибка: {outcome['error']}"
+                yield {'method': name, 'result': texts[name], 'elapsed': outcome['elapsed']}
+
+            # Восстанавливаем порядок способов независимо от порядка завершения
+            results = {name: texts[name] for name in selected_methods}
+            save_reasoning_results(results)
+            yield {
+                'done': True,
+                'task': task,
+                'method': method,
+                'results': results,
+                'timings': timings,
+                'errors': errors,
+                'routing': routing
+            }
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return ndjson_response(generate_events())
+
+    start_time = time.time()
+    outcomes = parallel_runner.run({
+        name: partial(REASONING_SOLVERS[name], task, on_routing=partial(routing.__setitem__, name))
+        for name in selected_methods
+    })
+
+    results = {}
+    timings = {}
+    errors = {}
+    for name, outcome in outcomes.items():
+        timings[name] = outcome['elapsed']
+        if outcome['error']:
+            # Ошибка одного способа не влияет на остальные
+            errors[name] = outcome['error']
+            results[name] = f"Ошибка: {outcome['error']}"
+        else:
+            results[name] = outcome['result']
+
+    save_reasoning_results(results)
+
+    return jsonify({
+        'task': task,
+        'method': method,
+        'results': results,
+        'timings': timings,
+        'errors': errors,
+        'routing': routing,
+        'total_time': round(time.time() - start_time, 3)
+    })
+
+
+# Описания и рекомендации для опорных значений температуры
+TEMPERATURE_DESCRIPTIONS = {
+    '0.0': 'Детерминированный режим - максимальная точность и предсказуемость',
+    '0.5': 'Сбалансированный режим - умеренная креативность с сохранением точности',
+    '1.0': 'Креативный режим - максимальная вариативность и оригинальность'
+}
+
+TEMPERATURE_RECOMMENDATIONS = {
+    '0.0': 'Подходит для: фактических запросов, технической документации, точных вычислений, переводов',
+    '0.5': 'Подходит для: общения, рассказов, объяснений, советов, деловой переписки',
+    '1.0': 'Подходит для: креативного письма, генерации идей, художественных текстов, нестандартных решений'
+}
+
+# Ограничения на размер эксперимента в одном запросе
+TEMPERATURE_MAX_POINTS = 21
+TEMPERATURE_MAX_SAMPLES = 10
+TEMPERATURE_MAX_CALLS = config.get('temperature_max_calls', 66)
+TEMPERATURE_CONCURRENCY = config.get('temperature_concurrency', 8)
+
+
+def parse_temperature_grid(data):
+    """
+    Получает сетку температур из запроса.
+    Поддерживает явный список "temperatures" или диапазон "grid": {"start", "stop", "step"}.
+    По умолчанию - классические 0.0, 0.5 и 1.0.
+    """
+    if 'grid' in data:
+        grid = data['grid']
+        start = float(grid.get('start', 0.0))
+        stop = float(grid.get('stop', 1.0))
+        step = float(grid.get('step', 0.1))
+        if step <= 0:
+            raise ValueError('Шаг сетки должен быть положительным')
+        count = int(round((stop - start) / step)) + 1
+        temperatures = [start + i * step for i in range(max(count, 0))]
+    else:
+        temperatures = [float(t) for t in data.get('temperatures', [0.0, 0.5, 1.0])]
+
+    temperatures = sorted({round(t, 2) for t in temperatures})
+    if not temperatures:
+        raise ValueError('Сетка температур пуста')
+    if len(temperatures) > TEMPERATURE_MAX_POINTS:
+        raise ValueError(f'Слишком много значений температуры (максимум {TEMPERATURE_MAX_POINTS})')
+    if any(t < 0.0 or t > 1.0 for t in temperatures):
+        raise ValueError('Температура должна быть в диапазоне 0.0 - 1.0')
+    return temperatures
 
 
 @app.route('/temperature_experiment', methods=['POST'])
+@json_errors
 def temperature_experiment():
     """Эксперимент с разными значениями температуры"""
     data = request.json
@@ -1018,58 +1772,69 @@ def temperature_experiment():
     if not prompt:
         return jsonify({'error': 'Запрос не указан'}), 400
 
-    # Значения температуры для сравнения (0.0 - 1.0)
-    temperatures = [0.0, 0.5, 1.0]
-    results = {}
-
+    # Значения температуры для сравнения (0.0 - 1.0) и число прогонов на каждое
     try:
-        # Запускаем один и тот же запрос с разными температурами
-        for temp in temperatures:
-            messages = [
-                {"role": "user", "text": prompt}
-            ]
-            response = call_yandex_gpt(messages, temperature=temp)
-            results[str(temp)] = response
-
-        # Добавляем анализ результатов
-        analysis = {
-            'prompt': prompt,
-            'temperatures': {
-                '0.0': {
-                    'response': results['0.0'],
-                    'description': 'Детерминированный режим - максимальная точность и предсказуемость'
-                },
-                '0.5': {
-                    'response': results['0.5'],
-                    'description': 'Сбалансированный режим - умеренная креативность с сохранением точности'
-                },
-                '1.0': {
-                    'response': results['1.0'],
-                    'description': 'Креативный режим - максимальная вариативность и оригинальность'
-                }
-            },
-            'recommendations': {
-                '0.0': 'Подходит для: фактических запросов, технической документации, точных вычислений, переводов',
-                '0.5': 'Подходит для: общения, рассказов, объяснений, советов, деловой переписки',
-                '1.0': 'Подходит для: креативного письма, генерации идей, художественных текстов, нестандартных решений'
+        temperatures = parse_temperature_grid(data)
+        samples = int(data.get('samples', 1))
+    except (TypeError, ValueError, AttributeError) as e:
+        return jsonify({'error': f'Некорректная сетка температур: {e}'}), 400
+
+    if samples < 1 or samples > TEMPERATURE_MAX_SAMPLES:
+        return jsonify({'error': f'samples должно быть от 1 до {TEMPERATURE_MAX_SAMPLES}'}), 400
+    if len(temperatures) * samples > TEMPERATURE_MAX_CALLS:
+        return jsonify({'error': f'Слишком много запросов к модели (максимум {TEMPERATURE_MAX_CALLS})'}), 400
+
+    # Запускаем один и тот же запрос со всеми температурами параллельно.
+    # Кэш не используется: эксперимент измеряет поведение самой модели
+    messages = [
+        {"role": "user", "text": prompt}
+    ]
+    tasks = {
+        (str(temp), sample): partial(call_yandex_gpt, messages, temperature=temp, use_cache=False)
+        for temp in temperatures
+        for sample in range(samples)
+    }
+    start_time = time.time()
+    outcomes = parallel_runner.run(tasks, max_concurrency=TEMPERATURE_CONCURRENCY)
+    total_time = time.time() - start_time
+
+    responses = {str(temp): [] for temp in temperatures}
+    for (label, _), outcome in outcomes.items():
+        responses[label].append(outcome['result'] if outcome['error'] is None else f"Ошибка: {outcome['error']}")
+
+    # Статистика разнообразия по всем температурам за один проход
+    stats = diversity_stats(responses)
+
+    # Добавляем анализ результатов
+    analysis = {
+        'prompt': prompt,
+        'samples': samples,
+        'total_time': round(total_time, 3),
+        'temperatures': {
+            label: {
+                'response': responses[label][0],
+                'description': TEMPERATURE_DESCRIPTIONS[label]
             }
-        }
-
-        return jsonify(analysis)
+            for label in TEMPERATURE_DESCRIPTIONS if label in responses
+        },
+        'sweep': [
+            {
+                'temperature': temp,
+                'responses': responses[str(temp)],
+                'stats': stats[str(temp)]
+            }
+            for temp in temperatures
+        ],
+        'recommendations': TEMPERATURE_RECOMMENDATIONS
+    }
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify(analysis)
 
 
-# Функция для подсчета токенов (приблизительная оценка)
+# Функция для подсчета токенов (см. tokenizer_service)
 def estimate_tokens(text: str) -> int:
-    """Приблизительная оценка количества токенов"""
-    # Простая эвристика: ~4 символа = 1 токен для английского
-    # Для русского языка: ~6 символов = 1 токен
-    words = text.split()
-    chars = len(text)
-    # Среднее между словами и символами
-    return max(len(words), chars // 5)
+    """Количество токенов текста: точное или по откалиброванной локальной модели"""
+    return tokenizer.count(text)
 
 
 # Доступные модели Yandex Cloud
@@ -1078,35 +1843,54 @@ YANDEX_MODELS = {
         'uri': 'yandexgpt-lite/latest',
         'name': 'YandexGPT Lite',
         'description': 'Легковесная модель для быстрых ответов',
+        'context_window': 8000,  # токенов запроса и ответа вместе
         'pricing': {'input': 0.2, 'output': 0.6}  # руб за 1K токенов
     },
     'yandexgpt': {
         'uri': 'yandexgpt/latest',
         'name': 'YandexGPT',
         'description': 'Стандартная модель с балансом качества и скорости',
+        'context_window': 8000,
         'pricing': {'input': 0.4, 'output': 1.2}
     },
     'yandexgpt-32k': {
         'uri': 'yandexgpt-32k/rc',
         'name': 'YandexGPT 32K',
         'description': 'Модель с расширенным контекстом',
+        'context_window': 32000,
         'pricing': {'input': 0.8, 'output': 2.4}
     },
     'summarization': {
         'uri': 'summarization/latest',
         'name': 'Summarization',
         'description': 'Специализированная модель для суммаризации',
+        'context_window': 8000,
+        'routable': False,  # только для явных запросов суммаризации
         'pricing': {'input': 0.4, 'output': 1.2}
     }
 }
 
+# Выбор модели по размеру контекста: запрос и ответ должны поместиться в окно модели
+model_router = ModelRouter(YANDEX_MODELS, safety_margin=config.get('router_safety_margin', 0.1))
+
+# Ключ модели для автоматического выбора в call_yandex_model
+MODEL_AUTO = 'auto'
+
+# Лимит токенов ответа для call_yandex_model
+MODEL_MAX_TOKENS = 2000
+
 
-def call_yandex_model(model_key: str, prompt: str) -> Dict[str, Any]:
+def call_yandex_model(model_key: str, prompt: str, temperature: float = 0.7,
+                      escalate: bool = False) -> Dict[str, Any]:
     """
     Вызов модели Yandex Cloud через Foundation Models API
-    Возвращает результат с метриками
+    Возвращает результат с метриками.
+    model_key = 'auto' - самая дешевая модель, в окно которой помещается запрос;
+    escalate=True - если запрос не помещается в model_key, взять модель с большим окном.
+    Запрос, который не помещается в выбранную модель, не отправляется.
+    При temperature = 0 медленный запрос может хеджироваться (hedging_enabled в config.json)
     """
-    if model_key not in YANDEX_MODELS:
+    if model_key != MODEL_AUTO and model_key not in YANDEX_MODELS:
         return {
             'success': False,
             'model': model_key,
@@ -1114,21 +1898,40 @@ def call_yandex_model(model_key: str, prompt: str) -> Dict[str, Any]:
             'metrics': {'response_time': 0}
         }
 
+    input_estimate = estimate_tokens(prompt)
+    if model_key == MODEL_AUTO:
+        routing = model_router.route(input_estimate, MODEL_MAX_TOKENS)
+    elif escalate:
+        routing = model_router.route(input_estimate, MODEL_MAX_TOKENS, preferred=model_key)
+    else:
+        routing = model_router.check(model_key, input_estimate, MODEL_MAX_TOKENS)
+
+    if routing['model'] is None:
+        # Заведомо слишком большой запрос не тратит время и квоту на отказ API
+        model_info = YANDEX_MODELS.get(model_key, {})
+        return {
+            'success': False,
+            'skipped': True,
+            'model': model_key,
+            'model_name': model_info.get('name', model_key),
+            'error': (f"Запрос (~{input_estimate} токенов + {MODEL_MAX_TOKENS} на ответ) не помещается "
+                      f"в контекст модели ({routing['context_window'] or 'ни одной модели'} токенов)"),
+            'metrics': {
+                'response_time': 0,
+                'routing': routing
+            }
+        }
+
+    model_key = routing['model']
     model_info = YANDEX_MODELS[model_key]
     model_uri = model_info['uri']
 
-    url = "https://llm.api.cloud.yandex.net/foundationModels/v1/completion"
-    headers = {
-        "Content-Type": "application/json",
-        "Authorization": f"Api-Key {config['api_key']}"
-    }
-
     payload = {
         "modelUri": f"gpt://{config['catalog_id']}/{model_uri}",
         "completionOptions": {
             "stream": False,
-            "temperature": 0.7,
-            "maxTokens": 8000  # Максимальный лимит - модель не ограничена
+            "temperature": temperature,
+            "maxTokens": MODEL_MAX_TOKENS
         },
         "messages": [
             {"role": "user", "text": prompt}
@@ -1138,56 +1941,65 @@ def call_yandex_model(model_key: str, prompt: str) -> Dict[str, Any]:
     start_time = time.time()
 
     try:
-        response = requests.post(url, headers=headers, json=payload, timeout=180)  # Увеличен до 3 минут для больших запросов
+        # Одинаковые запросы в полете объединяются клиентом (single-flight)
+        result = yandex_client.completion(payload, timeout=180, hedge=True)  # Увеличен до 3 минут для больших запросов
         elapsed_time = time.time() - start_time
 
-        if response.status_code == 200:
-            result = response.json()
+        # Извлечение текста ответа
+        generated_text = ""
+        input_tokens = 0
+        output_tokens = 0
 
-            # Извлечение текста ответа
-            generated_text = ""
-            input_tokens = 0
-            output_tokens = 0
+        if "result" in result and "alternatives" in result["result"]:
+            generated_text = result["result"]["alternatives"][0]["message"]["text"]
+
+            # Получаем реальные метрики токенов из ответа
+            usage = result["result"].get("usage", {})
+            # Явно преобразуем в int, API может вернуть строки
+            input_tokens = int(usage["inputTextTokens"]) if "inputTextTokens" in usage else input_estimate
+            if "completionTokens" in usage:
+                output_tokens = int(usage["completionTokens"])
+                # Точное число токенов ответа - образец для калибровки локальной модели
+                tokenizer.observe(generated_text, output_tokens)
+            else:
+                output_tokens = estimate_tokens(generated_text)
 
-            if "result" in result and "alternatives" in result["result"]:
-                generated_text = result["result"]["alternatives"][0]["message"]["text"]
+        total_tokens = input_tokens + output_tokens
 
-                # Получаем реальные метрики токенов из ответа
-                usage = result["result"].get("usage", {})
-                # Явно преобразуем в int, API может вернуть строки
-                input_tokens = int(usage.get("inputTextTokens", estimate_tokens(prompt)))
-                output_tokens = int(usage.get("completionTokens", estimate_tokens(generated_text)))
+        # Расчет стоимости в рублях
+        pricing = model_info['pricing']
+        cost_rub = (float(input_tokens) * pricing['input'] + float(output_tokens) * pricing['output']) / 1000
 
-            total_tokens = input_tokens + output_tokens
+        return {
+            'success': True,
+            'model': model_key,
+            'model_name': model_info['name'],
+            'response': generated_text,
+            'metrics': {
+                'response_time': float(round(elapsed_time, 3)),
+                'input_tokens': int(input_tokens),
+                'output_tokens': int(output_tokens),
+                'total_tokens': int(total_tokens),
+                'cost_rub': float(round(cost_rub, 4)),
+                'is_free': False,
+                'routing': routing
+            }
+        }
 
-            # Расчет стоимости в рублях
-            pricing = model_info['pricing']
-            cost_rub = (float(input_tokens) * pricing['input'] + float(output_tokens) * pricing['output']) / 1000
+    except LLMUnavailableError:
+        raise
 
-            return {
-                'success': True,
-                'model': model_key,
-                'model_name': model_info['name'],
-                'response': generated_text,
-                'metrics': {
-                    'response_time': float(round(elapsed_time, 3)),
-                    'input_tokens': int(input_tokens),
-                    'output_tokens': int(output_tokens),
-                    'total_tokens': int(total_tokens),
-                    'cost_rub': float(round(cost_rub, 4)),
-                    'is_free': False
-                }
-            }
-        else:
-            return {
-                'success': False,
-                'model': model_key,
-                'model_name': model_info['name'],
-                'error': f"HTTP {response.status_code}: {response.text[:200]}",
-                'metrics': {
-                    'response_time': float(round(time.time() - start_time, 3))
-                }
+    except requests.exceptions.HTTPError as e:
+        return {
+            'success': False,
+            'model': model_key,
+            'model_name': model_info['name'],
+            'error': f"HTTP {e.response.status_code}: {e.response.text[:200]}",
+            'metrics': {
+                'response_time': float(round(time.time() - start_time, 3)),
+                'routing': routing
             }
+        }
 
     except Exception as e:
         return {
@@ -1196,12 +2008,35 @@ def call_yandex_model(model_key: str, prompt: str) -> Dict[str, Any]:
             'model_name': model_info.get('name', model_key),
             'error': str(e),
             'metrics': {
-                'response_time': float(round(time.time() - start_time, 3))
+                'response_time': float(round(time.time() - start_time, 3)),
+                'routing': routing
             }
         }
 
 
+# Сколько вызовов моделей один запрос может выполнять одновременно
+LLM_REQUEST_CONCURRENCY = config.get('llm_request_concurrency', 4)
+
+
+def model_outcome_to_result(model_key: str, outcome: Dict[str, Any]) -> Dict[str, Any]:
+    """Преобразует результат parallel_runner.run() в ответ call_yandex_model"""
+    if outcome['error'] is None:
+        return outcome['result']
+
+    model_info = YANDEX_MODELS.get(model_key, {})
+    return {
+        'success': False,
+        'model': model_key,
+        'model_name': model_info.get('name', model_key),
+        'error': outcome['error'],
+        'metrics': {
+            'response_time': outcome['elapsed']
+        }
+    }
+
+
 @app.route('/token_test', methods=['POST'])
+@json_errors
 def token_test():
     """Тестирование токенов с разными размерами запросов"""
     data = request.json
@@ -1214,105 +2049,110 @@ def token_test():
     # Оценка количества токенов в запросе
     estimated_input_tokens = estimate_tokens(prompt)
 
-    try:
-        # Для экстремального теста пробуем обе модели для наглядного сравнения
-        if test_type == 'extreme':
-            # Сначала пробуем базовую модель (лимит 8000 токенов)
-            result_base = call_yandex_model('yandexgpt', prompt)
-            # Затем пробуем 32K модель (лимит 32000 токенов)
-            result_32k = call_yandex_model('yandexgpt-32k', prompt)
-
-            response_data = {
-                'test_type': test_type,
-                'prompt': prompt,
-                'prompt_length': len(prompt),
-                'estimated_input_tokens': estimated_input_tokens,
-                'comparison_mode': True,
-                'base_model': {
-                    'model_key': 'yandexgpt',
-                    'model_name': YANDEX_MODELS['yandexgpt']['name'],
-                    'model_limit': 8000,
-                    'result': result_base
-                },
-                'extended_model': {
-                    'model_key': 'yandexgpt-32k',
-                    'model_name': YANDEX_MODELS['yandexgpt-32k']['name'],
-                    'model_limit': 32000,
-                    'result': result_32k
-                }
+    # Для экстремального теста пробуем обе модели для наглядного сравнения
+    if test_type == 'extreme':
+        # Базовая модель (окно 8000 токенов) и 32K модель (окно 32000 токенов)
+        # вызываются параллельно, время ответа замеряется для каждой отдельно.
+        # Запрос, который не помещается в окно модели, в нее не отправляется
+        outcomes = parallel_runner.run({
+            'yandexgpt': partial(call_yandex_model, 'yandexgpt', prompt),
+            'yandexgpt-32k': partial(call_yandex_model, 'yandexgpt-32k', prompt)
+        }, max_concurrency=LLM_REQUEST_CONCURRENCY)
+        result_base = model_outcome_to_result('yandexgpt', outcomes['yandexgpt'])
+        result_32k = model_outcome_to_result('yandexgpt-32k', outcomes['yandexgpt-32k'])
+        limit_base = YANDEX_MODELS['yandexgpt']['context_window']
+        limit_32k = YANDEX_MODELS['yandexgpt-32k']['context_window']
+
+        response_data = {
+            'test_type': test_type,
+            'prompt': prompt,
+            'prompt_length': len(prompt),
+            'estimated_input_tokens': estimated_input_tokens,
+            'comparison_mode': True,
+            'base_model': {
+                'model_key': 'yandexgpt',
+                'model_name': YANDEX_MODELS['yandexgpt']['name'],
+                'model_limit': limit_base,
+                'result': result_base
+            },
+            'extended_model': {
+                'model_key': 'yandexgpt-32k',
+                'model_name': YANDEX_MODELS['yandexgpt-32k']['name'],
+                'model_limit': limit_32k,
+                'result': result_32k
             }
+        }
 
-            # Анализ для базовой модели
-            if result_base['success']:
-                actual_input = result_base['metrics']['input_tokens']
-                response_data['base_model']['analysis'] = {
-                    'within_limit': actual_input < 8000,
-                    'limit_usage_percent': round((actual_input / 8000) * 100, 1)
-                }
-            else:
-                response_data['base_model']['analysis'] = {
-                    'within_limit': False,
-                    'error': 'Превышен лимит или ошибка API'
-                }
-
-            # Анализ для 32K модели
-            if result_32k['success']:
-                actual_input = result_32k['metrics']['input_tokens']
-                response_data['extended_model']['analysis'] = {
-                    'within_limit': actual_input < 32000,
-                    'limit_usage_percent': round((actual_input / 32000) * 100, 1)
-                }
-            else:
-                response_data['extended_model']['analysis'] = {
-                    'within_limit': False,
-                    'error': 'Превышен лимит или ошибка API'
-                }
-
-            return jsonify(response_data)
+        # Анализ для базовой модели
+        if result_base['success']:
+            actual_input = result_base['metrics']['input_tokens']
+            response_data['base_model']['analysis'] = {
+                'within_limit': actual_input < limit_base,
+                'limit_usage_percent': round((actual_input / limit_base) * 100, 1)
+            }
+        else:
+            response_data['base_model']['analysis'] = {
+                'within_limit': False,
+                'error': 'Запрос не помещается в контекст модели' if result_base.get('skipped') else 'Превышен лимит или ошибка API'
+            }
 
+        # Анализ для 32K модели
+        if result_32k['success']:
+            actual_input = result_32k['metrics']['input_tokens']
+            response_data['extended_model']['analysis'] = {
+                'within_limit': actual_input < limit_32k,
+                'limit_usage_percent': round((actual_input / limit_32k) * 100, 1)
+            }
         else:
-            # Для коротких и длинных запросов используем стандартную модель
-            model_key = 'yandexgpt'
-            result = call_yandex_model(model_key, prompt)
-
-            # Добавляем дополнительную информацию
-            response_data = {
-                'test_type': test_type,
-                'prompt': prompt,
-                'prompt_length': len(prompt),
-                'estimated_input_tokens': estimated_input_tokens,
-                'model_used': model_key,
-                'model_name': YANDEX_MODELS[model_key]['name'],
-                'model_limit': 8000,
-                'comparison_mode': False,
-                'result': result
+            response_data['extended_model']['analysis'] = {
+                'within_limit': False,
+                'error': 'Запрос не помещается в контекст модели' if result_32k.get('skipped') else 'Превышен лимит или ошибка API'
             }
 
-            # Анализ результата
-            if result['success']:
-                actual_input_tokens = result['metrics']['input_tokens']
-                actual_output_tokens = result['metrics']['output_tokens']
-                total_tokens = result['metrics']['total_tokens']
-
-                response_data['analysis'] = {
-                    'within_limit': actual_input_tokens < response_data['model_limit'],
-                    'token_efficiency': round((actual_output_tokens / actual_input_tokens) if actual_input_tokens > 0 else 0, 2),
-                    'cost_per_token': round(result['metrics']['cost_rub'] / total_tokens, 6) if total_tokens > 0 else 0,
-                    'response_quality': 'Ответ получен успешно' if actual_output_tokens > 50 else 'Короткий ответ'
-                }
-            else:
-                response_data['analysis'] = {
-                    'within_limit': False,
-                    'error_type': 'API Error' if 'HTTP' in result['error'] else 'Unknown Error'
-                }
+        return jsonify(response_data)
+
+    else:
+        # Для коротких и длинных запросов используем стандартную модель,
+        # а если запрос в нее не помещается - модель с большим окном
+        result = call_yandex_model('yandexgpt', prompt, escalate=True)
+        model_key = result['model'] if result['model'] in YANDEX_MODELS else 'yandexgpt'
+
+        # Добавляем дополнительную информацию
+        response_data = {
+            'test_type': test_type,
+            'prompt': prompt,
+            'prompt_length': len(prompt),
+            'estimated_input_tokens': estimated_input_tokens,
+            'model_used': model_key,
+            'model_name': YANDEX_MODELS[model_key]['name'],
+            'model_limit': YANDEX_MODELS[model_key]['context_window'],
+            'comparison_mode': False,
+            'result': result
+        }
 
-            return jsonify(response_data)
+        # Анализ результата
+        if result['success']:
+            actual_input_tokens = result['metrics']['input_tokens']
+            actual_output_tokens = result['metrics']['output_tokens']
+            total_tokens = result['metrics']['total_tokens']
+
+            response_data['analysis'] = {
+                'within_limit': actual_input_tokens < response_data['model_limit'],
+                'token_efficiency': round((actual_output_tokens / actual_input_tokens) if actual_input_tokens > 0 else 0, 2),
+                'cost_per_token': round(result['metrics']['cost_rub'] / total_tokens, 6) if total_tokens > 0 else 0,
+                'response_quality': 'Ответ получен успешно' if actual_output_tokens > 50 else 'Короткий ответ'
+            }
+        else:
+            response_data['analysis'] = {
+                'within_limit': False,
+                'error_type': 'API Error' if 'HTTP' in result['error'] else 'Unknown Error'
+            }
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+        return jsonify(response_data)
 
 
 @app.route('/model_comparison', methods=['POST'])
+@json_errors
 def model_comparison():
     """Сравнение разных моделей Yandex AI с замером метрик"""
     data = request.json
@@ -1325,62 +2165,71 @@ def model_comparison():
     if not models or len(models) < 2:
         return jsonify({'error': 'Необходимо выбрать минимум 2 модели для сравнения'}), 400
 
-    results = []
-
+    # temperature: 0 - детерминированное сравнение (ответы кэшируются, медленные запросы хеджируются)
     try:
-        # Вызываем каждую модель
-        for model_key in models:
-            result = call_yandex_model(model_key, prompt)
-            results.append(result)
+        temperature = float(data.get('temperature', 0.7))
+    except (TypeError, ValueError):
+        return jsonify({'error': 'Некорректная температура'}), 400
+    if not 0.0 <= temperature <= 1.0:
+        return jsonify({'error': 'Температура должна быть от 0 до 1'}), 400
 
-        # Добавляем сравнительный анализ
-        successful_results = [r for r in results if r['success']]
-
-        comparison = {
-            'prompt': prompt,
-            'models_compared': len(models),
-            'successful_calls': len(successful_results),
-            'results': results
-        }
+    results = []
 
-        if successful_results:
-            # Находим самую быструю и медленную модель
-            fastest = min(successful_results, key=lambda x: x['metrics']['response_time'])
-            slowest = max(successful_results, key=lambda x: x['metrics']['response_time'])
-
-            # Находим модель с наименьшим количеством токенов
-            most_concise = min(successful_results, key=lambda x: x['metrics']['output_tokens'])
-            most_verbose = max(successful_results, key=lambda x: x['metrics']['output_tokens'])
-
-            # Находим самую дешевую и дорогую
-            cheapest = min(successful_results, key=lambda x: x['metrics']['cost_rub'])
-            most_expensive = max(successful_results, key=lambda x: x['metrics']['cost_rub'])
-
-            comparison['analysis'] = {
-                'fastest_model': fastest.get('model_name', fastest['model']),
-                'fastest_time': fastest['metrics']['response_time'],
-                'slowest_model': slowest.get('model_name', slowest['model']),
-                'slowest_time': slowest['metrics']['response_time'],
-                'most_concise_model': most_concise.get('model_name', most_concise['model']),
-                'most_concise_tokens': most_concise['metrics']['output_tokens'],
-                'most_verbose_model': most_verbose.get('model_name', most_verbose['model']),
-                'most_verbose_tokens': most_verbose['metrics']['output_tokens'],
-                'cheapest_model': cheapest.get('model_name', cheapest['model']),
-                'cheapest_cost': cheapest['metrics']['cost_rub'],
-                'most_expensive_model': most_expensive.get('model_name', most_expensive['model']),
-                'most_expensive_cost': most_expensive['metrics']['cost_rub'],
-                'avg_response_time': round(sum(r['metrics']['response_time'] for r in successful_results) / len(successful_results), 3),
-                'avg_output_tokens': round(sum(r['metrics']['output_tokens'] for r in successful_results) / len(successful_results), 1),
-                'avg_cost': round(sum(r['metrics']['cost_rub'] for r in successful_results) / len(successful_results), 4)
-            }
+    # Вызываем все модели параллельно (не больше LLM_REQUEST_CONCURRENCY одновременно)
+    outcomes = parallel_runner.run({
+        model_key: partial(call_yandex_model, model_key, prompt, temperature=temperature)
+        for model_key in dict.fromkeys(models)
+    }, max_concurrency=LLM_REQUEST_CONCURRENCY)
+    for model_key in models:
+        results.append(model_outcome_to_result(model_key, outcomes[model_key]))
+
+    # Добавляем сравнительный анализ
+    successful_results = [r for r in results if r['success']]
+
+    comparison = {
+        'prompt': prompt,
+        'models_compared': len(models),
+        'temperature': temperature,
+        'successful_calls': len(successful_results),
+        'results': results
+    }
 
-        return jsonify(comparison)
+    if successful_results:
+        # Находим самую быструю и медленную модель
+        fastest = min(successful_results, key=lambda x: x['metrics']['response_time'])
+        slowest = max(successful_results, key=lambda x: x['metrics']['response_time'])
+
+        # Находим модель с наименьшим количеством токенов
+        most_concise = min(successful_results, key=lambda x: x['metrics']['output_tokens'])
+        most_verbose = max(successful_results, key=lambda x: x['metrics']['output_tokens'])
+
+        # Находим самую дешевую и дорогую
+        cheapest = min(successful_results, key=lambda x: x['metrics']['cost_rub'])
+        most_expensive = max(successful_results, key=lambda x: x['metrics']['cost_rub'])
+
+        comparison['analysis'] = {
+            'fastest_model': fastest.get('model_name', fastest['model']),
+            'fastest_time': fastest['metrics']['response_time'],
+            'slowest_model': slowest.get('model_name', slowest['model']),
+            'slowest_time': slowest['metrics']['response_time'],
+            'most_concise_model': most_concise.get('model_name', most_concise['model']),
+            'most_concise_tokens': most_concise['metrics']['output_tokens'],
+            'most_verbose_model': most_verbose.get('model_name', most_verbose['model']),
+            'most_verbose_tokens': most_verbose['metrics']['output_tokens'],
+            'cheapest_model': cheapest.get('model_name', cheapest['model']),
+            'cheapest_cost': cheapest['metrics']['cost_rub'],
+            'most_expensive_model': most_expensive.get('model_name', most_expensive['model']),
+            'most_expensive_cost': most_expensive['metrics']['cost_rub'],
+            'avg_response_time': round(sum(r['metrics']['response_time'] for r in successful_results) / len(successful_results), 3),
+            'avg_output_tokens': round(sum(r['metrics']['output_tokens'] for r in successful_results) / len(successful_results), 1),
+            'avg_cost': round(sum(r['metrics']['cost_rub'] for r in successful_results) / len(successful_results), 4)
+        }
 
-    except Exception as e:
-        return jsonify({'error': str(e)}), 500
+    return jsonify(comparison)
 
 
 @app.route('/compression_test', methods=['POST'])
+@json_errors
 def compression_test():
     """
     Тестирование механизма компрессии диалога (День 8).
@@ -1389,6 +2238,8 @@ def compression_test():
     data = request.json
     message = data.get('message', '').strip()
     action = data.get('action', 'send')  # send, stats, clear, compare
+    # История хранится по сессиям: любой воркер продолжит тот же диалог
+    dialog_manager = dialog_sessions.get(data.get('session_id') or get_or_create_session())
 
     if action == 'clear':
         # Очистка истории
@@ -1411,276 +2262,276 @@ def compression_test():
         if not message:
             return jsonify({'error': 'Сообщение не указано'}), 400
 
-        try:
-            # Создаем два независимых менеджера для честного сравнения
-            manager_with_compression = DialogHistoryManager(compression_threshold=10, use_compression=True)
-            manager_without_compression = DialogHistoryManager(compression_threshold=10, use_compression=False)
-
-            # Копируем текущую историю в оба менеджера
-            for msg in dialog_manager.messages:
-                manager_with_compression.add_message(msg['role'], msg['text'])
-                manager_without_compression.add_message(msg['role'], msg['text'])
-
-            # Добавляем новое сообщение
-            manager_with_compression.add_message('user', message)
-            manager_without_compression.add_message('user', message)
-
-            # Получаем ответы с обоих вариантов истории
-            # С компрессией
-            start_time = time.time()
-            history_compressed = manager_with_compression.get_history_for_api(use_compressed=True)
-            messages_compressed = [{"role": "user", "text": message}]
-            if len(history_compressed) > 0:
-                messages_compressed = history_compressed + [{"role": "user", "text": message}]
-
-            response_compressed = call_yandex_gpt(messages_compressed, temperature=0.7)
-            time_compressed = time.time() - start_time
-
-            # Без компрессии
-            start_time = time.time()
-            history_full = manager_without_compression.get_history_for_api(use_compressed=False)
-            messages_full = [{"role": "user", "text": message}]
-            if len(history_full) > 0:
-                messages_full = history_full + [{"role": "user", "text": message}]
-
-            response_full = call_yandex_gpt(messages_full, temperature=0.7)
-            time_full = time.time() - start_time
-
-            # Подсчет токенов
-            tokens_compressed_input = sum(estimate_tokens(msg['text']) for msg in messages_compressed)
-            tokens_compressed_output = estimate_tokens(response_compressed)
-
-            tokens_full_input = sum(estimate_tokens(msg['text']) for msg in messages_full)
-            tokens_full_output = estimate_tokens(response_full)
-
-            # Расчет стоимости (используем цены YandexGPT)
-            pricing = YANDEX_MODELS['yandexgpt']['pricing']
-            cost_compressed = (tokens_compressed_input * pricing['input'] + tokens_compressed_output * pricing['output']) / 1000
-            cost_full = (tokens_full_input * pricing['input'] + tokens_full_output * pricing['output']) / 1000
-
-            # Добавляем ответ агента в главный менеджер
-            dialog_manager.add_message('user', message)
-            dialog_manager.add_message('assistant', response_compressed)
-
-            comparison_result = {
-                'with_compression': {
-                    'response': response_compressed,
-                    'metrics': {
-                        'response_time': round(time_compressed, 3),
-                        'input_tokens': tokens_compressed_input,
-                        'output_tokens': tokens_compressed_output,
-                        'total_tokens': tokens_compressed_input + tokens_compressed_output,
-                        'cost_rub': round(cost_compressed, 4),
-                        'history_messages': len(messages_compressed) - 1  # Минус текущее сообщение
-                    }
-                },
-                'without_compression': {
-                    'response': response_full,
-                    'metrics': {
-                        'response_time': round(time_full, 3),
-                        'input_tokens': tokens_full_input,
-                        'output_tokens': tokens_full_output,
-                        'total_tokens': tokens_full_input + tokens_full_output,
-                        'cost_rub': round(cost_full, 4),
-                        'history_messages': len(messages_full) - 1  # Минус текущее сообщение
-                    }
-                },
-                'savings': {
-                    'tokens_saved': tokens_full_input - tokens_compressed_input,
-                    'tokens_saved_percent': round((1 - tokens_compressed_input / tokens_full_input) * 100, 2) if tokens_full_input > 0 else 0,
-                    'cost_saved': round(cost_full - cost_compressed, 4),
-                    'cost_saved_percent': round((1 - cost_compressed / cost_full) * 100, 2) if cost_full > 0 else 0,
-                    'time_difference': round(time_full - time_compressed, 3)
-                },
-                'compression_stats': manager_with_compression.get_stats()
-            }
-
-            return jsonify({
-                'status': 'ok',
-                'comparison': comparison_result
-            })
+        # Создаем два независимых менеджера для честного сравнения
+        manager_with_compression = DialogHistoryManager(compression_threshold=10, use_compression=True)
+        manager_without_compression = DialogHistoryManager(compression_threshold=10, use_compression=False)
+
+        # Копируем текущую историю в оба менеджера (токены уже посчитаны)
+        for msg, tokens in dialog_manager.message_snapshot():
+            manager_with_compression.add_message(msg['role'], msg['text'], tokens)
+            manager_without_compression.add_message(msg['role'], msg['text'], tokens)
+
+        # Добавляем новое сообщение
+        message_tokens = estimate_tokens(message)
+        manager_with_compression.add_message('user', message, message_tokens)
+        manager_without_compression.add_message('user', message, message_tokens)
+
+        # Получаем ответы с обоих вариантов истории
+        # С компрессией
+        start_time = time.time()
+        history_compressed = manager_with_compression.get_history_for_api(use_compressed=True)
+        messages_compressed = [{"role": "user", "text": message}]
+        if len(history_compressed) > 0:
+            messages_compressed = history_compressed + [{"role": "user", "text": message}]
+
+        routing_compressed = {}
+        response_compressed = call_yandex_gpt(messages_compressed, temperature=0.7, on_routing=routing_compressed.update)
+        time_compressed = time.time() - start_time
+
+        # Без компрессии
+        start_time = time.time()
+        history_full = manager_without_compression.get_history_for_api(use_compressed=False)
+        messages_full = [{"role": "user", "text": message}]
+        if len(history_full) > 0:
+            messages_full = history_full + [{"role": "user", "text": message}]
+
+        routing_full = {}
+        response_full = call_yandex_gpt(messages_full, temperature=0.7, on_routing=routing_full.update)
+        time_full = time.time() - start_time
+
+        # Подсчет токенов: история по текущим суммам менеджеров + текущее сообщение
+        tokens_compressed_input = manager_with_compression.history_tokens(use_compressed=True) + message_tokens
+        tokens_compressed_output = estimate_tokens(response_compressed)
+
+        tokens_full_input = manager_without_compression.history_tokens(use_compressed=False) + message_tokens
+        tokens_full_output = estimate_tokens(response_full)
+
+        # Расчет стоимости (используем цены YandexGPT)
+        pricing_compressed = routed_pricing(routing_compressed)
+        pricing_full = routed_pricing(routing_full)
+        cost_compressed = (tokens_compressed_input * pricing_compressed['input'] + tokens_compressed_output * pricing_compressed['output']) / 1000
+        cost_full = (tokens_full_input * pricing_full['input'] + tokens_full_output * pricing_full['output']) / 1000
+
+        # Добавляем ответ агента в главный менеджер
+        dialog_manager.add_message('user', message, message_tokens)
+        dialog_manager.add_message('assistant', response_compressed, tokens_compressed_output)
+
+        comparison_result = {
+            'with_compression': {
+                'response': response_compressed,
+                'metrics': {
+                    'response_time': round(time_compressed, 3),
+                    'input_tokens': tokens_compressed_input,
+                    'output_tokens': tokens_compressed_output,
+                    'total_tokens': tokens_compressed_input + tokens_compressed_output,
+                    'cost_rub': round(cost_compressed, 4),
+                    'history_messages': len(messages_compressed) - 1,  # Минус текущее сообщение
+                    'routing': routing_compressed
+                }
+            },
+            'without_compression': {
+                'response': response_full,
+                'metrics': {
+                    'response_time': round(time_full, 3),
+                    'input_tokens': tokens_full_input,
+                    'output_tokens': tokens_full_output,
+                    'total_tokens': tokens_full_input + tokens_full_output,
+                    'cost_rub': round(cost_full, 4),
+                    'history_messages': len(messages_full) - 1,  # Минус текущее сообщение
+                    'routing': routing_full
+                }
+            },
+            'savings': {
+                'tokens_saved': tokens_full_input - tokens_compressed_input,
+                'tokens_saved_percent': round((1 - tokens_compressed_input / tokens_full_input) * 100, 2) if tokens_full_input > 0 else 0,
+                'cost_saved': round(cost_full - cost_compressed, 4),
+                'cost_saved_percent': round((1 - cost_compressed / cost_full) * 100, 2) if cost_full > 0 else 0,
+                'time_difference': round(time_full - time_compressed, 3)
+            },
+            'compression_stats': manager_with_compression.get_stats()
+        }
 
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'status': 'ok',
+            'comparison': comparison_result
+        })
 
     elif action == 'run_test':
         # Автоматический тест компрессии
-        try:
-            # Очищаем историю перед тестом
-            dialog_manager.clear()
-
-            # Серия тестовых сообщений (упрощенная версия)
-            test_messages = [
-                "Расскажи о Python",
-                "Что такое Django?",
-                "Как работает Flask?",
-                "Что такое FastAPI?",
-                "Сравни Django и Flask",
-                "Какие есть ORM для Python?",
-                "Что такое SQLAlchemy?",
-                "Как работает async/await?",
-                "Что такое asyncio?",
-                "Объясни декораторы в Python",
-                "Что такое генераторы?",
-                "Как работает yield?",
-            ]
-
-            total_tokens = 0
-            total_cost = 0
-            start_time_total = time.time()
-
-            # Отправляем сообщения
-            for message in test_messages:
-                # Добавляем сообщение пользователя
-                dialog_manager.add_message('user', message)
-
-                # Получаем историю для API
-                history = dialog_manager.get_history_for_api()
-                messages = history.copy()
-
-                # Получаем ответ от модели
-                response = call_yandex_gpt(messages, temperature=0.7)
-
-                # Добавляем ответ в историю
-                dialog_manager.add_message('assistant', response)
-
-                # Подсчет токенов
-                input_tokens = sum(estimate_tokens(msg['text']) for msg in messages)
-                output_tokens = estimate_tokens(response)
-                total_tokens += input_tokens + output_tokens
-
-                # Расчет стоимости
-                pricing = YANDEX_MODELS['yandexgpt']['pricing']
-                cost = (input_tokens * pricing['input'] + output_tokens * pricing['output']) / 1000
-                total_cost += cost
-
-            total_time = time.time() - start_time_total
-
-            # Получаем финальную статистику
-            final_stats = dialog_manager.get_stats()
+        # Очищаем историю перед тестом
+        dialog_manager.clear()
 
-            # Делаем финальное сравнение
-            test_question = "Какой фреймворк лучше выбрать для веб-разработки?"
+        # Серия тестовых сообщений (упрощенная версия)
+        test_messages = [
+            "Расскажи о Python",
+            "Что такое Django?",
+            "Как работает Flask?",
+            "Что такое FastAPI?",
+            "Сравни Django и Flask",
+            "Какие есть ORM для Python?",
+            "Что такое SQLAlchemy?",
+            "Как работает async/await?",
+            "Что такое asyncio?",
+            "Объясни декораторы в Python",
+            "Что такое генераторы?",
+            "Как работает yield?",
+        ]
 
-            # Создаем два независимых менеджера для честного сравнения
-            manager_with = DialogHistoryManager(compression_threshold=10, use_compression=True)
-            manager_without = DialogHistoryManager(compression_threshold=10, use_compression=False)
+        total_tokens = 0
+        total_cost = 0
+        models_used = {}  # Сколько ответов дала каждая модель по решению маршрутизатора
+        start_time_total = time.time()
 
-            # Копируем текущую историю
-            for msg in dialog_manager.messages:
-                manager_with.add_message(msg['role'], msg['text'])
-                manager_without.add_message(msg['role'], msg['text'])
+        # Отправляем сообщения
+        for message in test_messages:
+            # Добавляем сообщение пользователя
+            dialog_manager.add_message('user', message)
 
-            # Добавляем тестовый вопрос
-            manager_with.add_message('user', test_question)
-            manager_without.add_message('user', test_question)
+            # Получаем историю для API вместе с ее размером
+            messages, input_tokens = dialog_manager.history_snapshot()
 
-            # С компрессией
-            start_time = time.time()
-            history_compressed = manager_with.get_history_for_api(use_compressed=True)
-            messages_compressed = history_compressed + [{"role": "user", "text": test_question}] if history_compressed else [{"role": "user", "text": test_question}]
-            response_compressed = call_yandex_gpt(messages_compressed, temperature=0.7)
-            time_compressed = time.time() - start_time
+            # Получаем ответ от модели
+            routing = {}
+            response = call_yandex_gpt(messages, temperature=0.7, on_routing=routing.update)
+            routed_model = routing.get('model') or 'none'
+            models_used[routed_model] = models_used.get(routed_model, 0) + 1
 
-            # Без компрессии
-            start_time = time.time()
-            history_full = manager_without.get_history_for_api(use_compressed=False)
-            messages_full = history_full + [{"role": "user", "text": test_question}] if history_full else [{"role": "user", "text": test_question}]
-            response_full = call_yandex_gpt(messages_full, temperature=0.7)
-            time_full = time.time() - start_time
+            # Подсчет токенов
+            output_tokens = estimate_tokens(response)
+            total_tokens += input_tokens + output_tokens
 
-            # Подсчет токенов для сравнения
-            tokens_compressed_input = sum(estimate_tokens(msg['text']) for msg in messages_compressed)
-            tokens_compressed_output = estimate_tokens(response_compressed)
-            tokens_full_input = sum(estimate_tokens(msg['text']) for msg in messages_full)
-            tokens_full_output = estimate_tokens(response_full)
+            # Добавляем ответ в историю
+            dialog_manager.add_message('assistant', response, output_tokens)
 
             # Расчет стоимости
-            pricing = YANDEX_MODELS['yandexgpt']['pricing']
-            cost_compressed = (tokens_compressed_input * pricing['input'] + tokens_compressed_output * pricing['output']) / 1000
-            cost_full = (tokens_full_input * pricing['input'] + tokens_full_output * pricing['output']) / 1000
-
-            comparison_result = {
-                'with_compression': {
-                    'response': response_compressed,
-                    'metrics': {
-                        'response_time': round(time_compressed, 3),
-                        'input_tokens': tokens_compressed_input,
-                        'output_tokens': tokens_compressed_output,
-                        'total_tokens': tokens_compressed_input + tokens_compressed_output,
-                        'cost_rub': round(cost_compressed, 4),
-                        'history_messages': len(messages_compressed) - 1
-                    }
-                },
-                'without_compression': {
-                    'response': response_full,
-                    'metrics': {
-                        'response_time': round(time_full, 3),
-                        'input_tokens': tokens_full_input,
-                        'output_tokens': tokens_full_output,
-                        'total_tokens': tokens_full_input + tokens_full_output,
-                        'cost_rub': round(cost_full, 4),
-                        'history_messages': len(messages_full) - 1
-                    }
-                },
-                'savings': {
-                    'tokens_saved': tokens_full_input - tokens_compressed_input,
-                    'tokens_saved_percent': round((1 - tokens_compressed_input / tokens_full_input) * 100, 2) if tokens_full_input > 0 else 0,
-                    'cost_saved': round(cost_full - cost_compressed, 4),
-                    'cost_saved_percent': round((1 - cost_compressed / cost_full) * 100, 2) if cost_full > 0 else 0,
-                    'time_difference': round(time_full - time_compressed, 3)
+            pricing = routed_pricing(routing)
+            cost = (input_tokens * pricing['input'] + output_tokens * pricing['output']) / 1000
+            total_cost += cost
+
+        total_time = time.time() - start_time_total
+
+        # Получаем финальную статистику (после фоновой компрессии, если она идет)
+        dialog_manager.wait_for_compression(timeout=60)
+        final_stats = dialog_manager.get_stats()
+
+        # Делаем финальное сравнение
+        test_question = "Какой фреймворк лучше выбрать для веб-разработки?"
+
+        # Создаем два независимых менеджера для честного сравнения
+        manager_with = DialogHistoryManager(compression_threshold=10, use_compression=True)
+        manager_without = DialogHistoryManager(compression_threshold=10, use_compression=False)
+
+        # Копируем текущую историю (токены уже посчитаны)
+        for msg, tokens in dialog_manager.message_snapshot():
+            manager_with.add_message(msg['role'], msg['text'], tokens)
+            manager_without.add_message(msg['role'], msg['text'], tokens)
+
+        # Добавляем тестовый вопрос
+        question_tokens = estimate_tokens(test_question)
+        manager_with.add_message('user', test_question, question_tokens)
+        manager_without.add_message('user', test_question, question_tokens)
+
+        # С компрессией
+        start_time = time.time()
+        history_compressed = manager_with.get_history_for_api(use_compressed=True)
+        messages_compressed = history_compressed + [{"role": "user", "text": test_question}] if history_compressed else [{"role": "user", "text": test_question}]
+        routing_compressed = {}
+        response_compressed = call_yandex_gpt(messages_compressed, temperature=0.7, on_routing=routing_compressed.update)
+        time_compressed = time.time() - start_time
+
+        # Без компрессии
+        start_time = time.time()
+        history_full = manager_without.get_history_for_api(use_compressed=False)
+        messages_full = history_full + [{"role": "user", "text": test_question}] if history_full else [{"role": "user", "text": test_question}]
+        routing_full = {}
+        response_full = call_yandex_gpt(messages_full, temperature=0.7, on_routing=routing_full.update)
+        time_full = time.time() - start_time
+
+        # Подсчет токенов для сравнения: история по текущим суммам менеджеров + вопрос
+        tokens_compressed_input = manager_with.history_tokens(use_compressed=True) + question_tokens
+        tokens_compressed_output = estimate_tokens(response_compressed)
+        tokens_full_input = manager_without.history_tokens(use_compressed=False) + question_tokens
+        tokens_full_output = estimate_tokens(response_full)
+
+        # Расчет стоимости
+        pricing_compressed = routed_pricing(routing_compressed)
+        pricing_full = routed_pricing(routing_full)
+        cost_compressed = (tokens_compressed_input * pricing_compressed['input'] + tokens_compressed_output * pricing_compressed['output']) / 1000
+        cost_full = (tokens_full_input * pricing_full['input'] + tokens_full_output * pricing_full['output']) / 1000
+
+        comparison_result = {
+            'with_compression': {
+                'response': response_compressed,
+                'metrics': {
+                    'response_time': round(time_compressed, 3),
+                    'input_tokens': tokens_compressed_input,
+                    'output_tokens': tokens_compressed_output,
+                    'total_tokens': tokens_compressed_input + tokens_compressed_output,
+                    'cost_rub': round(cost_compressed, 4),
+                    'history_messages': len(messages_compressed) - 1,
+                    'routing': routing_compressed
                 }
+            },
+            'without_compression': {
+                'response': response_full,
+                'metrics': {
+                    'response_time': round(time_full, 3),
+                    'input_tokens': tokens_full_input,
+                    'output_tokens': tokens_full_output,
+                    'total_tokens': tokens_full_input + tokens_full_output,
+                    'cost_rub': round(cost_full, 4),
+                    'history_messages': len(messages_full) - 1,
+                    'routing': routing_full
+                }
+            },
+            'savings': {
+                'tokens_saved': tokens_full_input - tokens_compressed_input,
+                'tokens_saved_percent': round((1 - tokens_compressed_input / tokens_full_input) * 100, 2) if tokens_full_input > 0 else 0,
+                'cost_saved': round(cost_full - cost_compressed, 4),
+                'cost_saved_percent': round((1 - cost_compressed / cost_full) * 100, 2) if cost_full > 0 else 0,
+                'time_difference': round(time_full - time_compressed, 3)
             }
+        }
 
-            return jsonify({
-                'status': 'ok',
-                'messages_sent': len(test_messages),
-                'total_time': round(total_time, 2),
-                'total_tokens': total_tokens,
-                'total_cost': round(total_cost, 4),
-                'final_stats': final_stats,
-                'comparison': comparison_result
-            })
-
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        return jsonify({
+            'status': 'ok',
+            'messages_sent': len(test_messages),
+            'total_time': round(total_time, 2),
+            'total_tokens': total_tokens,
+            'total_cost': round(total_cost, 4),
+            'models_used': models_used,
+            'final_stats': final_stats,
+            'comparison': comparison_result
+        })
 
     elif action == 'send':
         # Обычная отправка сообщения с компрессией
         if not message:
             return jsonify({'error': 'Сообщение не указано'}), 400
 
-        try:
-            # Добавляем сообщение пользователя и проверяем, произошла ли компрессия
-            compression_triggered = dialog_manager.add_message('user', message)
+        # Добавляем сообщение пользователя и проверяем, произошла ли компрессия
+        compression_triggered = dialog_manager.add_message('user', message)
 
-            # Получаем историю для API
-            history = dialog_manager.get_history_for_api()
-
-            # Формируем сообщения для API
-            messages = history.copy()
-
-            # Получаем ответ от модели
-            start_time = time.time()
-            response = call_yandex_gpt(messages, temperature=0.7)
-            response_time = time.time() - start_time
-
-            # Добавляем ответ в историю
-            dialog_manager.add_message('assistant', response)
+        # Получаем историю для API вместе с ее размером (один согласованный снимок)
+        messages, input_tokens = dialog_manager.history_snapshot()
+        routing = {}  # Решение маршрутизатора: YandexGPT или модель с большим окном контекста
 
+        def build_send_result(response, response_time):
             # Подсчет токенов
-            input_tokens = sum(estimate_tokens(msg['text']) for msg in messages)
             output_tokens = estimate_tokens(response)
             total_tokens = input_tokens + output_tokens
 
+            # Добавляем ответ в историю
+            dialog_manager.add_message('assistant', response, output_tokens)
+
             # Расчет стоимости
-            pricing = YANDEX_MODELS['yandexgpt']['pricing']
+            pricing = routed_pricing(routing)
             cost = (input_tokens * pricing['input'] + output_tokens * pricing['output']) / 1000
 
             # Получаем статистику
             stats = dialog_manager.get_stats()
 
-            return jsonify({
+            return {
                 'status': 'ok',
                 'response': response,
                 'compression_triggered': compression_triggered,
@@ -1689,24 +2540,99 @@ def compression_test():
                     'input_tokens': input_tokens,
                     'output_tokens': output_tokens,
                     'total_tokens': total_tokens,
-                    'cost_rub': round(cost, 4)
+                    'cost_rub': round(cost, 4),
+                    'routing': routing
                 },
                 'compression_stats': stats
-            })
+            }
 
-        except Exception as e:
-            return jsonify({'error': str(e)}), 500
+        if data.get('stream'):
+            # Потоковый режим: фрагменты ответа, затем итоговые метрики
+            def generate_events():
+                start_time = time.time()
+                response = ""
+                try:
+                    for delta in stream_yandex_gpt(messages, temperature=0.7, on_routing=routing.update):
+                        response += delta
+                        yield {'delta': delta}
+                except LLMUnavailableError as e:
+                    # Отказ клиента LLM - не ответ модели: в историю диалога он не попадает
+                    yield {'error': str(e), 'reason': e.reason, 'retry_after': round(e.retry_after, 1)}
+                    return
+                result = build_send_result(response, time.time() - start_time)
+                result['done'] = True
+                yield result
+
+            return ndjson_response(generate_events())
+
+        # Получаем ответ от модели
+        start_time = time.time()
+        response = call_yandex_gpt(messages, temperature=0.7, on_routing=routing.update)
+        response_time = time.time() - start_time
+
+        return jsonify(build_send_result(response, response_time))
 
     else:
         return jsonify({'error': f'Неизвестное действие: {action}'}), 400
 
 
+# ==================== СОСТОЯНИЕ КЛИЕНТА LLM ====================
+
+@app.route('/llm/status', methods=['GET'])
+def llm_status():
+    """
+    Статистика вызовов LLM: пул соединений, кэш ответов, очереди к моделям,
+    повторы, состояние предохранителей и подсчет токенов. status: degraded - хотя бы один
+    предохранитель не замкнут
+    """
+    stats = yandex_client.get_stats()
+    stats['routing'] = model_router.get_stats()
+    stats['tokenizer'] = tokenizer.get_stats()
+    stats['semantic_memory'] = semantic_memory.get_stats()
+    stats['dialog_state'] = dict(dialog_store.get_stats(), **dialog_sessions.get_stats())
+    circuits = stats.get('circuits', {})
+    degraded = [name for name, circuit in circuits.items() if circuit['state'] != 'closed']
+
+    return jsonify({
+        'status': 'degraded' if degraded else 'ok',
+        'degraded_upstreams': degraded,
+        'client': stats
+    })
+
+
+@app.errorhandler(LLMUnavailableError)
+def handle_llm_unavailable(e):
+    """
+    Запрос к LLM отклонен на стороне клиента: квота модели исчерпана
+    (reason: rate_limited) или API деградировал и предохранитель разомкнут
+    (reason: circuit_open). Быстрый отказ вместо долгого ожидания
+    """
+    response = jsonify({
+        'error': str(e),
+        'reason': e.reason,
+        'retry_after': round(e.retry_after, 1)
+    })
+    response.status_code = e.status_code
+    response.headers['Retry-After'] = str(int(e.retry_after) + 1)
+    return response
+
+
+@app.route('/llm/cache', methods=['DELETE'])
+def clear_llm_cache():
+    """Очистить кэш ответов LLM"""
+    completion_cache.clear()
+    return jsonify({
+        'status': 'ok',
+        'message': 'Кэш ответов очищен'
+    })
+
+
 # ==================== ВНЕШНЯЯ ПАМЯТЬ (ДЕНЬ 9) ====================
 
 @app.route('/memory/sessions', methods=['GET', 'POST'])
 def manage_sessions():
     """Управление сессиями диалогов"""
-    global current_session_id
+    current_session_id = get_or_create_session()
 
     if request.method == 'GET':
         # Получить список сессий
@@ -1729,7 +2655,7 @@ def manage_sessions():
             metadata = data.get('metadata', {})
 
             if memory.create_session(session_id, title, metadata):
-                current_session_id = session_id
+                memory.set_current_session(session_id)
                 return jsonify({
                     'status': 'ok',
                     'session_id': session_id,
@@ -1746,7 +2672,7 @@ def manage_sessions():
 
             session = memory.get_session(session_id)
             if session:
-                current_session_id = session_id
+                memory.set_current_session(session_id)
                 # Загружаем историю сообщений сессии
                 messages = memory.get_messages(session_id)
                 return jsonify({
@@ -1765,10 +2691,11 @@ def manage_sessions():
                 return jsonify({'error': 'session_id не указан'}), 400
 
             if memory.delete_session(session_id):
+                dialog_store.delete(session_id)
+                dialog_sessions.discard(session_id)
                 # Если удалили текущую сессию, создаем новую
                 if session_id == current_session_id:
-                    current_session_id = str(uuid.uuid4())
-                    memory.create_session(current_session_id, 'Новая сессия')
+                    current_session_id = start_new_session('Новая сессия')
 
                 return jsonify({
                     'status': 'ok',
@@ -1783,6 +2710,7 @@ def manage_sessions():
 def get_session_messages():
     """Получить историю сообщений текущей сессии"""
     limit = request.args.get('limit', type=int, default=None)
+    current_session_id = get_or_create_session()
     messages = memory.get_messages(current_session_id, limit)
 
     return jsonify({
@@ -1793,6 +2721,45 @@ def get_session_messages():
     })
 
 
+@app.route('/memory/search', methods=['GET'])
+def search_memory():
+    """
+    Полнотекстовый поиск по сообщениям, долговременной памяти и контексту.
+    Параметры: q, session_id, category, source (через запятую), limit, offset
+    """
+    query = request.args.get('q', '').strip()
+    if not query:
+        return jsonify({'error': 'Параметр q не указан'}), 400
+
+    source = request.args.get('source')
+    limit = min(max(request.args.get('limit', type=int, default=20), 1), 100)
+    offset = max(request.args.get('offset', type=int, default=0), 0)
+
+    try:
+        found = memory.search(
+            query,
+            session_id=request.args.get('session_id'),
+            category=request.args.get('category'),
+            sources=source.split(',') if source else None,
+            limit=limit,
+            offset=offset
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RuntimeError as e:
+        return jsonify({'error': str(e)}), 503
+
+    return jsonify({
+        'status': 'ok',
+        'query': query,
+        'count': len(found['results']),
+        'limit': limit,
+        'offset': offset,
+        'has_more': found['has_more'],
+        'results': found['results']
+    })
+
+
 @app.route('/memory/memories', methods=['GET', 'POST', 'DELETE'])
 def manage_memories():
     """Управление долговременной памятью"""
@@ -1826,6 +2793,7 @@ def manage_memories():
             return jsonify({'error': 'key и value обязательны'}), 400
 
         if memory.save_memory(key, value, category, importance, metadata):
+            semantic_memory.schedule_indexing()
             return jsonify({
                 'status': 'ok',
                 'message': 'Запись сохранена в память'
@@ -1853,6 +2821,7 @@ def manage_memories():
 @app.route('/memory/context', methods=['GET', 'POST', 'DELETE'])
 def manage_context():
     """Управление промежуточным контекстом сессии"""
+    current_session_id = get_or_create_session()
 
     if request.method == 'GET':
         # Получить весь контекст или конкретное значение
@@ -1913,6 +2882,7 @@ def memory_stats():
     stats = memory.get_stats()
 
     # Добавляем информацию о текущей сессии
+    current_session_id = get_or_create_session()
     session = memory.get_session(current_session_id)
     message_count = memory.get_message_count(current_session_id)
 
@@ -2053,7 +3023,7 @@ def restore_session_history():
 
     try:
         # Получаем последние 50 сообщений из текущей сессии
-        messages = memory.get_messages(current_session_id, limit=50)
+        messages = memory.get_messages(get_or_create_session(), limit=50)
 
         if messages:
             print(f"📚 Восстановлено {len(messages)} сообщений из БД")
@@ -2185,6 +3155,7 @@ def call_mcp_tool():
 
         # Сохраняем в память (опционально)
         if result.get('success'):
+            current_session_id = get_or_create_session()
             memory.save_message(
                 current_session_id,
                 "user",
@@ -2233,6 +3204,7 @@ def call_github_mcp_tool():
 
         # Сохраняем в память (опционально)
         if result.get('success'):
+            current_session_id = get_or_create_session()
             memory.save_message(
                 current_session_id,
                 "user",
@@ -2259,6 +3231,7 @@ def call_github_mcp_tool():
 
 if __name__ == '__main__':
     # Выводим информацию о текущей сессии
+    current_session_id = get_or_create_session()
     session = memory.get_session(current_session_id)
     if session:
         print(f"🔄 Продолжаем сессию: {session['title']}")
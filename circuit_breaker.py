@@ -0,0 +1,186 @@
+"""
+Предохранитель (circuit breaker) для вызовов LLM API
+Отдельный на каждый вышестоящий сервис: completion, agents, summarization, tokenize, embedding
+"""
+import threading
+import time
+from collections import deque
+from typing import Any, Dict
+
+import numpy as np
+
+from llm_errors import LLMUnavailableError
+
+
+class CircuitOpenError(LLMUnavailableError):
+    """Предохранитель разомкнут: запрос отклонен без обращения к API"""
+
+    reason = 'circuit_open'
+
+    def __init__(self, upstream: str, retry_after: float):
+        super().__init__(
+            f"Сервис LLM ({upstream}) временно недоступен, повторите запрос позже",
+            retry_after=retry_after
+        )
+        self.upstream = upstream
+
+
+class CircuitBreaker:
+    """
+    Предохранитель со скользящим окном.
+
+    closed - запросы идут в API, результаты копятся в окне window_seconds.
+    Если в окне не меньше min_requests вызовов и доля ошибок или медленных
+    вызовов (дольше slow_call_seconds) превысила порог, предохранитель
+    размыкается (open) и open_seconds отклоняет вызовы сразу.
+    half_open - пропускает до half_open_probes пробных вызовов: все успешны -
+    замыкается, любая ошибка - снова размыкается.
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, name: str, window_seconds: float = 60.0, min_requests: int = 5,
+                 error_threshold: float = 0.5, slow_call_seconds: float = 30.0,
+                 slow_call_threshold: float = 0.8, open_seconds: float = 30.0,
+                 half_open_probes: int = 2):
+        """
+        Args:
+            name: имя вышестоящего сервиса
+            window_seconds: длина скользящего окна (сек)
+            min_requests: минимум вызовов в окне для принятия решения
+            error_threshold: доля ошибок, при которой предохранитель размыкается
+            slow_call_seconds: вызов дольше считается медленным (сек)
+            slow_call_threshold: доля медленных вызовов, при которой предохранитель размыкается
+            open_seconds: сколько держать предохранитель разомкнутым (сек)
+            half_open_probes: число пробных вызовов в состоянии half_open
+        """
+        self.name = name
+        self.window_seconds = window_seconds
+        self.min_requests = min_requests
+        self.error_threshold = error_threshold
+        self.slow_call_seconds = slow_call_seconds
+        self.slow_call_threshold = slow_call_threshold
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+
+        self._state = self.CLOSED
+        self._opened_at = 0.0
+        self._probes_started = 0
+        self._probes_succeeded = 0
+        self._calls = deque()  # (время завершения, длительность, ошибка)
+        self._lock = threading.Lock()
+        self._stats = {
+            'rejected': 0,
+            'opened': 0
+        }
+
+    @classmethod
+    def from_config(cls, name: str, config: Dict[str, Any]) -> 'CircuitBreaker':
+        """Создать предохранитель по настройкам из config.json"""
+        return cls(
+            name,
+            window_seconds=config.get('circuit_window_seconds', 60.0),
+            min_requests=config.get('circuit_min_requests', 5),
+            error_threshold=config.get('circuit_error_threshold', 0.5),
+            slow_call_seconds=config.get('circuit_slow_call_seconds', 30.0),
+            slow_call_threshold=config.get('circuit_slow_call_threshold', 0.8),
+            open_seconds=config.get('circuit_open_seconds', 30.0),
+            half_open_probes=config.get('circuit_half_open_probes', 2)
+        )
+
+    def before_call(self):
+        """
+        Разрешить вызов или отклонить его
+
+        Raises:
+            CircuitOpenError: предохранитель разомкнут или все пробные вызовы уже идут
+        """
+        with self._lock:
+            now = time.monotonic()
+            if self._state == self.OPEN:
+                remaining = self._opened_at + self.open_seconds - now
+                if remaining > 0:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, retry_after=remaining)
+                self._state = self.HALF_OPEN
+                self._probes_started = 0
+                self._probes_succeeded = 0
+
+            if self._state == self.HALF_OPEN:
+                if self._probes_started >= self.half_open_probes:
+                    self._stats['rejected'] += 1
+                    raise CircuitOpenError(self.name, retry_after=1.0)
+                self._probes_started += 1
+
+    def record(self, elapsed: float, failed: bool):
+        """Учесть результат вызова, разрешенного before_call()"""
+        with self._lock:
+            now = time.monotonic()
+            self._calls.append((now, elapsed, failed))
+            self._trim(now)
+
+            if self._state == self.HALF_OPEN:
+                if failed:
+                    self._open(now)
+                else:
+                    self._probes_succeeded += 1
+                    if self._probes_succeeded >= self.half_open_probes:
+                        self._state = self.CLOSED
+                        self._calls.clear()
+                return
+
+            if self._state == self.CLOSED and len(self._calls) >= self.min_requests:
+                total = len(self._calls)
+                errors = sum(1 for _, _, call_failed in self._calls if call_failed)
+                slow = sum(1 for _, duration, _ in self._calls if duration >= self.slow_call_seconds)
+                if errors / total >= self.error_threshold or slow / total >= self.slow_call_threshold:
+                    self._open(now)
+
+    def cancel(self):
+        """Вызов, разрешенный before_call(), не дошел до API - вернуть пробный слот"""
+        with self._lock:
+            if self._state == self.HALF_OPEN and self._probes_started > self._probes_succeeded:
+                self._probes_started -= 1
+
+    def _open(self, now: float):
+        """Разомкнуть предохранитель (вызывается под self._lock)"""
+        self._state = self.OPEN
+        self._opened_at = now
+        self._stats['opened'] += 1
+
+    def _trim(self, now: float):
+        """Удалить из окна старые вызовы (вызывается под self._lock)"""
+        while self._calls and now - self._calls[0][0] > self.window_seconds:
+            self._calls.popleft()
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                return self.HALF_OPEN
+            return self._state
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить состояние и показатели скользящего окна"""
+        state = self.state
+        with self._lock:
+            now = time.monotonic()
+            self._trim(now)
+            durations = np.asarray([duration for _, duration, _ in self._calls], dtype=np.float64)
+            failures = np.asarray([call_failed for _, _, call_failed in self._calls], dtype=bool)
+            stats = dict(self._stats)
+            open_remaining = self._opened_at + self.open_seconds - now if self._state == self.OPEN else 0
+
+        total = len(durations)
+        stats.update({
+            'state': state,
+            'window_requests': total,
+            'error_rate': round(float(failures.mean()), 3) if total else 0,
+            'slow_rate': round(float((durations >= self.slow_call_seconds).mean()), 3) if total else 0,
+            'latency_p50': round(float(np.percentile(durations, 50)), 3) if total else 0,
+            'latency_p95': round(float(np.percentile(durations, 95)), 3) if total else 0,
+            'retry_after': round(max(0.0, open_remaining), 1)
+        })
+        return stats
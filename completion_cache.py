@@ -0,0 +1,230 @@
+"""
+Кэш детерминированных ответов LLM
+Два уровня: LRU в памяти процесса и персистентный SQLite
+"""
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+
+def is_deterministic(payload: Dict[str, Any]) -> bool:
+    """Прямой вызов модели с temperature = 0: повторный запрос даст тот же ответ"""
+    if 'modelUri' not in payload:
+        return False
+    temperature = payload.get('completionOptions', {}).get('temperature')
+    return temperature is not None and float(temperature) == 0.0
+
+
+class CompletionCache:
+    """
+    Кэш ответов completion API, адресуемый по содержимому запроса.
+
+    Ключ - SHA-256 от (URL, modelUri/agentId, completionOptions без stream, messages).
+    По умолчанию кэшируются только запросы с temperature = 0: для них
+    повторный вызов модели дает тот же ответ и лишь тратит деньги и время.
+    """
+
+    def __init__(self, db_path: str = "llm_cache.db", max_memory_entries: int = 512,
+                 max_entries: int = 10000, ttl_seconds: float = 86400, enabled: bool = True):
+        """
+        Args:
+            db_path: путь к файлу базы данных SQLite
+            max_memory_entries: размер LRU-кэша в памяти процесса
+            max_entries: максимальное число записей в SQLite
+            ttl_seconds: время жизни записи (сек)
+            enabled: включен ли кэш
+        """
+        self.db_path = db_path
+        self.max_memory_entries = max_memory_entries
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.enabled = enabled
+
+        self._memory = OrderedDict()  # key -> (created_at, value)
+        self._lock = threading.Lock()
+        self._stats = {
+            'memory_hits': 0,
+            'db_hits': 0,
+            'misses': 0,
+            'stores': 0,
+            'evictions': 0,
+            'bypassed': 0
+        }
+
+        self._init_database()
+
+    def _init_database(self):
+        """Создание таблицы кэша если ее нет"""
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS completion_cache (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL,
+                created_at REAL NOT NULL,
+                accessed_at REAL NOT NULL
+            )
+        """)
+        cursor.execute("CREATE INDEX IF NOT EXISTS idx_completion_cache_accessed ON completion_cache(accessed_at)")
+
+        conn.commit()
+        conn.close()
+
+    # ==================== КЛЮЧИ И ПОЛИТИКА ====================
+
+    @staticmethod
+    def make_key(payload: Dict[str, Any], url: str = "") -> str:
+        """Построить ключ кэша по содержимому запроса"""
+        options = dict(payload.get('completionOptions', {}))
+        options.pop('stream', None)
+
+        canonical = json.dumps({
+            'url': url,
+            'modelUri': payload.get('modelUri'),
+            'agentId': payload.get('agentId'),
+            'completionOptions': options,
+            'messages': payload.get('messages', [])
+        }, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+
+        return hashlib.sha256(canonical.encode('utf-8')).hexdigest()
+
+    def is_cacheable(self, payload: Dict[str, Any]) -> bool:
+        """Кэшировать ли запрос по умолчанию: только прямые вызовы модели с temperature = 0"""
+        return self.enabled and is_deterministic(payload)
+
+    # ==================== ЧТЕНИЕ И ЗАПИСЬ ====================
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Получить ответ из кэша или None"""
+        now = time.time()
+
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                created_at, value = entry
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats['memory_hits'] += 1
+                    return value
+                del self._memory[key]
+
+        conn = sqlite3.connect(self.db_path)
+        cursor = conn.cursor()
+
+        cursor.execute("""
+            SELECT value, created_at FROM completion_cache WHERE key = ?
+        """, (key,))
+        row = cursor.fetchone()
+
+        if row and now - row[1] <= self.ttl_seconds:
+            cursor.execute("""
+                UPDATE completion_cache SET accessed_at = ? WHERE key = ?
+            """, (now, key))
+            conn.commit()
+            conn.close()
+
+            value = json.loads(row[0])
+            with self._lock:
+                self._remember(key, row[1], value)
+                self._stats['db_hits'] += 1
+            return value
+
+        if row:
+            # Запись устарела
+            cursor.execute("DELETE FROM completion_cache WHERE key = ?", (key,))
+            conn.commit()
+        conn.close()
+
+        with self._lock:
+            self._stats['misses'] += 1
+        return None
+
+    def set(self, key: str, value: Dict[str, Any]):
+        """Сохранить ответ в оба уровня кэша"""
+        now = time.time()
+
+        with self._lock:
+            self._remember(key, now, value)
+            self._stats['stores'] += 1
+
+        try:
+            conn = sqlite3.connect(self.db_path)
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                INSERT INTO completion_cache (key, value, created_at, accessed_at)
+                VALUES (?, ?, ?, ?)
+                ON CONFLICT(key) DO UPDATE SET
+                    value = excluded.value,
+                    created_at = excluded.created_at,
+                    accessed_at = excluded.accessed_at
+            """, (key, json.dumps(value, ensure_ascii=False), now, now))
+
+            evicted = self._evict(cursor, now)
+
+            conn.commit()
+            conn.close()
+        except sqlite3.Error as e:
+            print(f"Ошибка записи в кэш ответов: {e}")
+            return
+
+        if evicted:
+            with self._lock:
+                self._stats['evictions'] += evicted
+
+    def record_bypass(self):
+        """Учесть запрос, выполненный в обход кэша"""
+        with self._lock:
+            self._stats['bypassed'] += 1
+
+    def _remember(self, key: str, created_at: float, value: Dict[str, Any]):
+        """Положить запись в LRU (вызывается под self._lock)"""
+        self._memory[key] = (created_at, value)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self, cursor: sqlite3.Cursor, now: float) -> int:
+        """Удалить устаревшие записи и самые давно читанные сверх лимита"""
+        cursor.execute("DELETE FROM completion_cache WHERE created_at < ?", (now - self.ttl_seconds,))
+        evicted = cursor.rowcount
+
+        cursor.execute("SELECT COUNT(*) FROM completion_cache")
+        overflow = cursor.fetchone()[0] - self.max_entries
+        if overflow > 0:
+            cursor.execute("""
+                DELETE FROM completion_cache WHERE key IN (
+                    SELECT key FROM completion_cache ORDER BY accessed_at ASC LIMIT ?
+                )
+            """, (overflow,))
+            evicted += cursor.rowcount
+
+        return evicted
+
+    # ==================== УТИЛИТЫ ====================
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику попаданий в кэш"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memory_entries'] = len(self._memory)
+
+        lookups = stats['memory_hits'] + stats['db_hits'] + stats['misses']
+        stats['hit_rate'] = round((stats['memory_hits'] + stats['db_hits']) / lookups, 3) if lookups else 0
+        stats['enabled'] = self.enabled
+        return stats
+
+    def clear(self):
+        """Очистить оба уровня кэша"""
+        with self._lock:
+            self._memory.clear()
+
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("DELETE FROM completion_cache")
+        conn.commit()
+        conn.close()
@@ -0,0 +1,178 @@
+"""
+Хранилище состояния истории диалога по сессиям
+Состояние DialogHistoryManager лежит в SQLite с номером версии, поэтому
+все воркеры gunicorn видят один и тот же диалог
+"""
+import json
+import threading
+from collections import OrderedDict
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from memory_service import MemoryService
+
+
+class DialogStateStore:
+    """
+    Состояние истории диалога (сообщения, сжатый контекст, счетчики
+    компрессии, суммы токенов), адресуемое по session_id.
+
+    У каждой записи есть версия, которая растет при каждом сохранении.
+    Сохранение условное (optimistic locking): запись заменяется, только
+    если ее версия не изменилась с момента чтения, иначе вызывающий
+    перечитывает состояние и повторяет изменение.
+
+    Таблица лежит в базе MemoryService, соединения берутся из его пула
+    (WAL, busy_timeout): проверка версии перед каждой операцией менеджера
+    не открывает файл базы заново.
+    """
+
+    def __init__(self, memory: MemoryService):
+        """
+        Args:
+            memory: сервис памяти, в базе которого хранится состояние
+        """
+        self.memory = memory
+        self.db_path = memory.db_path
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'version_checks': 0,
+            'loads': 0,
+            'saves': 0,
+            'conflicts': 0
+        }
+
+        self._init_database()
+
+    def _init_database(self):
+        """Создание таблицы состояния если ее нет"""
+        with self.memory._connection() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS dialog_state (
+                    session_id TEXT PRIMARY KEY,
+                    version INTEGER NOT NULL,
+                    state TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+    def version(self, session_id: str) -> int:
+        """Текущая версия состояния сессии (0 - состояние еще не сохранялось)"""
+        self._count('version_checks')
+        with self.memory._connection() as conn:
+            row = conn.execute("SELECT version FROM dialog_state WHERE session_id = ?", (session_id,)).fetchone()
+
+        return row[0] if row else 0
+
+    def load(self, session_id: str) -> Optional[Tuple[int, Dict[str, Any]]]:
+        """Получить (версия, состояние) сессии или None"""
+        self._count('loads')
+        with self.memory._connection() as conn:
+            row = conn.execute("SELECT version, state FROM dialog_state WHERE session_id = ?",
+                               (session_id,)).fetchone()
+
+        if row:
+            return row[0], json.loads(row[1])
+        return None
+
+    def save(self, session_id: str, state: Dict[str, Any], expected_version: int) -> Optional[int]:
+        """
+        Сохранить состояние, если версия в базе равна expected_version
+
+        Returns:
+            Новая версия или None, если другой процесс успел сохранить свою
+        """
+        state_json = json.dumps(state, ensure_ascii=False)
+        with self.memory._connection() as conn:
+            cursor = conn.cursor()
+
+            if expected_version == 0:
+                cursor.execute("""
+                    INSERT INTO dialog_state (session_id, version, state)
+                    VALUES (?, 1, ?)
+                    ON CONFLICT(session_id) DO NOTHING
+                """, (session_id, state_json))
+            else:
+                cursor.execute("""
+                    UPDATE dialog_state
+                    SET version = version + 1, state = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE session_id = ? AND version = ?
+                """, (state_json, session_id, expected_version))
+
+            saved = cursor.rowcount == 1
+
+        self._count('saves' if saved else 'conflicts')
+        return expected_version + 1 if saved else None
+
+    def delete(self, session_id: str) -> bool:
+        """Удалить состояние сессии"""
+        with self.memory._connection() as conn:
+            affected = conn.execute("DELETE FROM dialog_state WHERE session_id = ?", (session_id,)).rowcount
+
+        return affected > 0
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить счетчики обращений к хранилищу"""
+        with self._lock:
+            return dict(self._stats)
+
+
+class DialogSessionCache:
+    """
+    Небольшой LRU-кэш менеджеров истории по session_id в памяти процесса.
+
+    Кэшированный менеджер перед каждой операцией сверяет свою версию
+    состояния с версией в хранилище и перечитывает состояние, только если
+    другой воркер его изменил - обычно это один SELECT версии.
+    """
+
+    def __init__(self, factory: Callable[[str], Any], max_sessions: int = 32):
+        """
+        Args:
+            factory: создание менеджера истории для session_id
+            max_sessions: сколько менеджеров держать в памяти
+        """
+        self.factory = factory
+        self.max_sessions = max_sessions
+
+        self._managers = OrderedDict()  # session_id -> менеджер
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'evictions': 0
+        }
+
+    def get(self, session_id: str) -> Any:
+        """Менеджер истории сессии (создается при первом обращении)"""
+        with self._lock:
+            manager = self._managers.get(session_id)
+            if manager is not None:
+                self._managers.move_to_end(session_id)
+                self._stats['hits'] += 1
+                return manager
+
+            self._stats['misses'] += 1
+            manager = self.factory(session_id)
+            self._managers[session_id] = manager
+            while len(self._managers) > self.max_sessions:
+                self._managers.popitem(last=False)
+                self._stats['evictions'] += 1
+            return manager
+
+    def discard(self, session_id: str):
+        """Убрать менеджер сессии из кэша"""
+        with self._lock:
+            self._managers.pop(session_id, None)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику кэша"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['sessions'] = len(self._managers)
+        stats['max_sessions'] = self.max_sessions
+        return stats
@@ -0,0 +1,121 @@
+"""
+Статистика разнообразия ответов модели для эксперимента с температурой
+Все группы ответов обрабатываются одним векторизованным проходом NumPy
+"""
+import re
+from typing import Dict, List, Sequence
+
+import numpy as np
+
+
+WORD_PATTERN = re.compile(r"\w+", re.UNICODE)
+
+
+def _distinct_ngram_ratios(token_ids: np.ndarray, response_ids: np.ndarray,
+                           group_of_response: np.ndarray, group_count: int,
+                           n: int, vocab_size: int) -> np.ndarray:
+    """
+    Доля уникальных n-грамм в каждой группе (distinct-n).
+
+    n-граммы не пересекают границы ответов: позиции, где ответ меняется
+    внутри окна, отбрасываются маской.
+    """
+    if len(token_ids) < n:
+        return np.zeros(group_count)
+
+    window = len(token_ids) - n + 1
+    valid = response_ids[:window] == response_ids[n - 1:]
+    if not valid.any():
+        return np.zeros(group_count)
+
+    # Кодируем n-грамму одним целым числом в системе счисления по основанию vocab_size
+    codes = np.zeros(window, dtype=np.int64)
+    for offset in range(n):
+        codes = codes * vocab_size + token_ids[offset:offset + window]
+    codes = codes[valid]
+    groups = group_of_response[response_ids[:window][valid]]
+
+    totals = np.bincount(groups, minlength=group_count)
+    unique_pairs = np.unique(np.stack([groups, codes], axis=1), axis=0)
+    distinct = np.bincount(unique_pairs[:, 0], minlength=group_count)
+
+    return np.divide(distinct, totals, out=np.zeros(group_count), where=totals > 0)
+
+
+def diversity_stats(groups: Dict[str, Sequence[str]],
+                    ngram_sizes: Sequence[int] = (1, 2)) -> Dict[str, Dict[str, float]]:
+    """
+    Посчитать статистику разнообразия для нескольких групп ответов
+
+    Args:
+        groups: словарь {метка группы (например, температура): список ответов}
+        ngram_sizes: размеры n-грамм для distinct-n
+
+    Returns:
+        Словарь {метка: {'samples', 'length_mean', 'length_std', 'length_min',
+        'length_max', 'length_cv', 'words_mean', 'distinct_1', 'distinct_2', ...}}
+    """
+    labels = list(groups)
+    responses: List[str] = []
+    group_of_response: List[int] = []
+    for group_index, label in enumerate(labels):
+        for text in groups[label]:
+            responses.append(text or "")
+            group_of_response.append(group_index)
+
+    group_count = len(labels)
+    group_of_response = np.asarray(group_of_response, dtype=np.int64)
+
+    # Длины ответов в символах и словах
+    tokenized = [WORD_PATTERN.findall(text.lower()) for text in responses]
+    char_lengths = np.asarray([len(text) for text in responses], dtype=np.float64)
+    word_lengths = np.asarray([len(tokens) for tokens in tokenized], dtype=np.float64)
+
+    samples = np.bincount(group_of_response, minlength=group_count).astype(np.float64)
+    safe_samples = np.maximum(samples, 1)
+    length_mean = np.bincount(group_of_response, weights=char_lengths, minlength=group_count) / safe_samples
+    length_sq_mean = np.bincount(group_of_response, weights=char_lengths ** 2, minlength=group_count) / safe_samples
+    length_std = np.sqrt(np.maximum(length_sq_mean - length_mean ** 2, 0))
+    words_mean = np.bincount(group_of_response, weights=word_lengths, minlength=group_count) / safe_samples
+
+    length_min = np.full(group_count, np.inf)
+    length_max = np.zeros(group_count)
+    if len(char_lengths):
+        np.minimum.at(length_min, group_of_response, char_lengths)
+        np.maximum.at(length_max, group_of_response, char_lengths)
+    length_min[np.isinf(length_min)] = 0
+
+    # Все токены всех ответов - один массив идентификаторов словаря
+    flat_tokens = [token for tokens in tokenized for token in tokens]
+    response_ids = np.repeat(np.arange(len(tokenized), dtype=np.int64),
+                             [len(tokens) for tokens in tokenized])
+    if flat_tokens:
+        vocab, token_ids = np.unique(np.asarray(flat_tokens), return_inverse=True)
+        vocab_size = len(vocab)
+    else:
+        token_ids = np.zeros(0, dtype=np.int64)
+        vocab_size = 1
+    token_ids = token_ids.astype(np.int64)
+
+    distinct = {
+        n: _distinct_ngram_ratios(token_ids, response_ids, group_of_response,
+                                  group_count, n, vocab_size)
+        for n in ngram_sizes
+    }
+
+    stats = {}
+    for index, label in enumerate(labels):
+        group_stats = {
+            'samples': int(samples[index]),
+            'length_mean': round(float(length_mean[index]), 1),
+            'length_std': round(float(length_std[index]), 1),
+            'length_min': int(length_min[index]),
+            'length_max': int(length_max[index]),
+            'length_cv': round(float(length_std[index] / length_mean[index]), 3) if length_mean[index] > 0 else 0,
+            'words_mean': round(float(words_mean[index]), 1)
+        }
+        for n, ratios in distinct.items():
+            group_stats[f'distinct_{n}'] = round(float(ratios[index]), 3)
+        stats[label] = group_stats
+
+    return stats
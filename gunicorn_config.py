@@ -1,4 +1,6 @@
 # Gunicorn конфигурация для production
+import sys
+
 bind = "0.0.0.0:5005"
 workers = 2
 worker_class = "sync"
@@ -8,3 +10,10 @@ accesslog = "-"
 errorlog = "-"
 loglevel = "info"
 
+
+def worker_exit(server, worker):
+    """Закрыть соединения с SQLite при остановке воркера"""
+    # Модуль приложения не импортируем заново: воркер, не загрузивший его, ничего не открывал
+    app = sys.modules.get('app')
+    if app is not None and hasattr(app, 'memory'):
+        app.memory.close()
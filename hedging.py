@@ -0,0 +1,197 @@
+"""
+Хеджирование запросов к LLM: если ответ задерживается дольше обычного,
+отправляется второй такой же запрос и берется первый успешный ответ
+"""
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Optional
+
+import numpy as np
+import requests
+
+from retry_policy import RetryBudget
+
+
+class Hedger:
+    """
+    Хеджирование по перцентилю недавних задержек модели.
+
+    Первичный запрос выполняется в пуле потоков. Если за delay (percentile
+    последних window задержек этой модели) ответа нет и бюджет позволяет,
+    отправляется второй запрос. Побеждает первый успешный ответ; HTTP-запрос
+    проигравшего прервать нельзя, поэтому его ответ закрывается по приходу.
+
+    Применять только к идемпотентным запросам, ответ на которые не зависит
+    от попытки (temperature = 0).
+    """
+
+    def __init__(self, percentile: float = 95.0, min_samples: int = 20, window: int = 200,
+                 min_delay: float = 0.5, budget: Optional[RetryBudget] = None,
+                 max_workers: int = 8):
+        """
+        Args:
+            percentile: перцентиль задержки, после которого отправляется второй запрос
+            min_samples: минимум замеров задержки модели, чтобы начать хеджирование
+            window: сколько последних задержек модели хранить
+            min_delay: минимальная задержка перед вторым запросом (сек)
+            budget: бюджет вторых запросов (None - без ограничения)
+            max_workers: размер пула потоков для запросов с хеджированием
+        """
+        self.percentile = percentile
+        self.min_samples = min_samples
+        self.window = window
+        self.min_delay = min_delay
+        self.budget = budget
+        self.max_workers = max_workers
+
+        self._latencies: Dict[str, deque] = {}
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'hedged': 0,
+            'hedge_wins': 0,
+            'primary_wins': 0,
+            'budget_exhausted': 0
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'Hedger':
+        """Создать хеджирование по настройкам из config.json"""
+        return cls(
+            percentile=config.get('hedge_percentile', 95.0),
+            min_samples=config.get('hedge_min_samples', 20),
+            min_delay=config.get('hedge_min_delay', 0.5),
+            budget=RetryBudget(
+                ratio=config.get('hedge_budget_ratio', 0.05),
+                min_retries=config.get('hedge_budget_min', 5)
+            ),
+            max_workers=config.get('hedge_max_workers', 8)
+        )
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Вернуть пул текущего процесса (после fork() создается новый)"""
+        pid = os.getpid()
+        if self._executor is not None and self._executor_pid == pid:
+            return self._executor
+
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="llm-hedge"
+                )
+                self._executor_pid = pid
+        return self._executor
+
+    def record(self, key: str, elapsed: float):
+        """Учесть задержку успешного ответа модели"""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None:
+                latencies = self._latencies[key] = deque(maxlen=self.window)
+            latencies.append(elapsed)
+
+    def delay_for(self, key: str) -> Optional[float]:
+        """Задержка перед вторым запросом или None, если замеров пока мало"""
+        with self._lock:
+            latencies = self._latencies.get(key)
+            if latencies is None or len(latencies) < self.min_samples:
+                return None
+            samples = np.fromiter(latencies, dtype=np.float64)
+        return max(self.min_delay, float(np.percentile(samples, self.percentile)))
+
+    def call(self, key: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Выполнить send() с хеджированием
+
+        Args:
+            key: ключ модели, по которому ведется статистика задержек
+            send: отправка запроса; возвращает ответ без проверки статуса
+
+        Returns:
+            Первый успешный ответ (статус < 500) или ответ/ошибка последней попытки
+        """
+        self._count('calls')
+        if self.budget is not None:
+            self.budget.deposit()
+
+        delay = self.delay_for(key)
+        if delay is None:
+            return self._timed(key, send)
+
+        executor = self._get_executor()
+        primary = executor.submit(self._timed, key, send)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        if self.budget is not None and not self.budget.withdraw():
+            self._count('budget_exhausted')
+            return primary.result()
+
+        self._count('hedged')
+        hedge = executor.submit(self._timed, key, send)
+        pending = {primary, hedge}
+        last = None
+
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                last = future
+                if future.exception() is None and future.result().status_code < 500:
+                    self._count('hedge_wins' if future is hedge else 'primary_wins')
+                    for loser in pending:
+                        loser.add_done_callback(self._close_response)
+                    return future.result()
+                if pending:
+                    # Неудачный ответ не нужен: ждем вторую попытку
+                    self._close_response(future)
+
+        return last.result()
+
+    def _timed(self, key: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """Выполнить send() и учесть задержку успешного ответа"""
+        start_time = time.time()
+        response = send()
+        if response.status_code < 500:
+            self.record(key, time.time() - start_time)
+        return response
+
+    @staticmethod
+    def _close_response(future):
+        """Закрыть ответ проигравшей попытки, освободив соединение пула"""
+        if not future.cancel() and future.exception() is None:
+            future.result().close()
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику хеджирования"""
+        with self._lock:
+            stats = dict(self._stats)
+            keys = list(self._latencies)
+        stats['hedge_rate'] = round(stats['hedged'] / stats['calls'], 3) if stats['calls'] else 0
+
+        # Текущая задержка перед вторым запросом по моделям
+        stats['delays'] = {}
+        for key in keys:
+            delay = self.delay_for(key)
+            if delay is not None:
+                stats['delays'][key] = round(delay, 3)
+        if self.budget is not None:
+            stats['budget_tokens'] = round(self.budget.tokens, 2)
+        return stats
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self._executor_pid = None
@@ -0,0 +1,17 @@
+"""
+Ошибки быстрого отказа клиента LLM
+"""
+
+
+class LLMUnavailableError(Exception):
+    """
+    Запрос к LLM отклонен на стороне клиента, без обращения к API.
+    Приложение отвечает на такие ошибки HTTP 503 с заголовком Retry-After.
+    """
+
+    status_code = 503
+    reason = 'unavailable'
+
+    def __init__(self, message: str, retry_after: float = 1.0):
+        super().__init__(message)
+        self.retry_after = retry_after
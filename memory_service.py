@@ -2,91 +2,301 @@
 Сервис внешней памяти для агента (День 9)
 Хранит долговременную память в SQLite
 """
+import atexit
+import queue
+import re
 import sqlite3
 import json
+import threading
+import time
+from contextlib import contextmanager
 from datetime import datetime
-from typing import List, Dict, Any, Optional
+from typing import List, Dict, Any, Iterator, Optional
 import os
 
 
-class MemoryService:
-    """Сервис для работы с внешней памятью агента"""
+# Полнотекстовые индексы: (таблица, индексируемые колонки, колонки для триггера обновления)
+SEARCH_INDEXES = [
+    ('messages', ('content',), 'content'),
+    ('memories', ('key', 'value'), 'key, value'),
+    ('context', ('value',), 'value'),
+]
+
 
-    def __init__(self, db_path: str = "agent_memory.db"):
+class MemoryService:
+    """
+    Сервис для работы с внешней памятью агента.
+
+    Соединения с SQLite долгоживущие: они берутся из небольшого пула и
+    возвращаются в него после операции, поэтому запрос не платит за
+    открытие файла и настройку соединения. База работает в режиме WAL:
+    чтения не ждут записи.
+
+    Режим надежности durability:
+    - 'normal' (по умолчанию): save_message только ставит сообщение в
+      очередь, фоновый писатель сохраняет накопленные сообщения одной
+      транзакцией раз в flush_interval_ms или по batch_size строк
+      (synchronous=NORMAL). Запрос не ждет диск; при падении процесса
+      теряются сообщения последних flush_interval_ms.
+    - 'full': save_message пишет и фиксирует сообщение сразу
+      (synchronous=FULL) - сохраненное переживает и сбой питания.
+
+    Чтения истории и удаление сессий сначала дожидаются записи очереди,
+    поэтому процесс всегда видит свои сообщения.
+    """
+
+    def __init__(self, db_path: str = "agent_memory.db", pool_size: int = 4,
+                 cache_size_kb: int = 8192, mmap_size_mb: int = 64, busy_timeout_ms: int = 5000,
+                 durability: str = 'normal', flush_interval_ms: int = 50, batch_size: int = 100):
         """
         Инициализация сервиса памяти
 
         Args:
             db_path: путь к файлу базы данных SQLite
+            pool_size: сколько свободных соединений держать открытыми
+            cache_size_kb: размер кэша страниц каждого соединения (КБ)
+            mmap_size_mb: сколько мегабайт файла БД читать через mmap (0 - не использовать)
+            busy_timeout_ms: сколько ждать блокировку записи другим процессом (мс)
+            durability: 'normal' - отложенная пакетная запись сообщений, 'full' - сразу на диск
+            flush_interval_ms: как долго фоновый писатель копит сообщения перед коммитом (мс)
+            batch_size: максимум сообщений в одной транзакции
         """
+        if durability not in ('normal', 'full'):
+            raise ValueError(f"Неизвестный режим надежности: {durability}")
         self.db_path = db_path
+        self.pool_size = pool_size
+        self.cache_size_kb = cache_size_kb
+        self.mmap_size_mb = mmap_size_mb
+        self.busy_timeout_ms = busy_timeout_ms
+
+        self._idle = []  # Свободные соединения (последнее возвращенное - первым в работу)
+        self._pool_pid = os.getpid()
+        self._pool_lock = threading.Lock()
+        self._pool_stats = {
+            'opened': 0,
+            'reused': 0,
+            'closed': 0
+        }
+
+        self.durability = durability
+        self.flush_interval_ms = flush_interval_ms
+        self.batch_size = max(1, batch_size)
+
+        # Очередь отложенной записи сообщений и ее фоновый писатель (запускается при первой записи)
+        self._write_queue = None
+        self._writer = None
+        self._writer_pid = None
+        self._pending = 0  # Сообщения в очереди, еще не записанные в базу
+        self._writer_lock = threading.Lock()
+        self._write_stats = {
+            'queued': 0,
+            'batches': 0,
+            'rows': 0,
+            'max_batch': 0,
+            'failed': 0,
+            'flushes': 0
+        }
+
         self._init_database()
 
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], db_path: str = "agent_memory.db") -> 'MemoryService':
+        """Создать сервис с настройками соединений из config.json"""
+        return cls(
+            db_path,
+            pool_size=config.get('memory_pool_size', 4),
+            cache_size_kb=config.get('memory_cache_size_kb', 8192),
+            mmap_size_mb=config.get('memory_mmap_size_mb', 64),
+            busy_timeout_ms=config.get('memory_busy_timeout_ms', 5000),
+            durability=config.get('memory_durability', 'normal'),
+            flush_interval_ms=config.get('memory_flush_interval_ms', 50),
+            batch_size=config.get('memory_batch_size', 100)
+        )
+
+    # ==================== СОЕДИНЕНИЯ ====================
+
+    def _open(self) -> sqlite3.Connection:
+        """Открыть и настроить новое соединение"""
+        # check_same_thread=False: соединение переходит между потоками через пул,
+        # но в каждый момент им пользуется только один поток
+        conn = sqlite3.connect(self.db_path, timeout=self.busy_timeout_ms / 1000, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(f"PRAGMA synchronous={'FULL' if self.durability == 'full' else 'NORMAL'}")
+        conn.execute(f"PRAGMA cache_size=-{int(self.cache_size_kb)}")
+        conn.execute(f"PRAGMA mmap_size={int(self.mmap_size_mb) * 1024 * 1024}")
+        conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+        return conn
+
+    @contextmanager
+    def _connection(self) -> Iterator[sqlite3.Connection]:
+        """
+        Соединение из пула на время операции.
+        Транзакция фиксируется при выходе из блока и откатывается при исключении
+        """
+        conn = None
+        with self._pool_lock:
+            if self._pool_pid != os.getpid():
+                # Соединения, унаследованные от родителя при fork, в дочернем процессе не используются
+                self._idle = []
+                self._pool_pid = os.getpid()
+            if self._idle:
+                conn = self._idle.pop()
+                self._pool_stats['reused'] += 1
+
+        if conn is None:
+            conn = self._open()
+            with self._pool_lock:
+                self._pool_stats['opened'] += 1
+
+        try:
+            yield conn
+            conn.commit()
+        except BaseException:
+            conn.rollback()
+            raise
+        finally:
+            with self._pool_lock:
+                if len(self._idle) < self.pool_size:
+                    self._idle.append(conn)
+                    conn = None
+                else:
+                    self._pool_stats['closed'] += 1
+            if conn is not None:
+                conn.close()
+
+    def close(self):
+        """Записать очередь сообщений и закрыть все свободные соединения (при остановке воркера)"""
+        self._stop_writer()
+        with self._pool_lock:
+            idle, self._idle = self._idle, []
+            if self._pool_pid != os.getpid():
+                return
+            self._pool_stats['closed'] += len(idle)
+        for conn in idle:
+            conn.close()
+
     def _init_database(self):
         """Создание таблиц базы данных если их нет"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Таблица сессий диалогов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS sessions (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT UNIQUE NOT NULL,
-                title TEXT,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                metadata TEXT
-            )
-        """)
-
-        # Таблица сообщений в диалогах
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS messages (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                role TEXT NOT NULL,
-                content TEXT NOT NULL,
-                timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                tokens INTEGER DEFAULT 0,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id)
-            )
-        """)
-
-        # Таблица долговременных заметок/фактов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS memories (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                key TEXT UNIQUE NOT NULL,
-                value TEXT NOT NULL,
-                category TEXT DEFAULT 'general',
-                importance INTEGER DEFAULT 5,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                access_count INTEGER DEFAULT 0,
-                metadata TEXT
-            )
-        """)
-
-        # Таблица промежуточных результатов
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS context (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                session_id TEXT NOT NULL,
-                key TEXT NOT NULL,
-                value TEXT NOT NULL,
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                FOREIGN KEY (session_id) REFERENCES sessions(session_id),
-                UNIQUE(session_id, key)
-            )
-        """)
-
-        # Индексы для быстрого поиска
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_memories_category ON memories(category)")
-        cursor.execute("CREATE INDEX IF NOT EXISTS idx_context_session ON context(session_id)")
-
-        conn.commit()
-        conn.close()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+
+            # Таблица сессий диалогов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS sessions (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT UNIQUE NOT NULL,
+                    title TEXT,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    metadata TEXT
+                )
+            """)
+
+            # Таблица сообщений в диалогах
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS messages (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    role TEXT NOT NULL,
+                    content TEXT NOT NULL,
+                    timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    tokens INTEGER DEFAULT 0,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id)
+                )
+            """)
+
+            # Таблица долговременных заметок/фактов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS memories (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    key TEXT UNIQUE NOT NULL,
+                    value TEXT NOT NULL,
+                    category TEXT DEFAULT 'general',
+                    importance INTEGER DEFAULT 5,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    access_count INTEGER DEFAULT 0,
+                    metadata TEXT
+                )
+            """)
+
+            # Таблица промежуточных результатов
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS context (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    session_id TEXT NOT NULL,
+                    key TEXT NOT NULL,
+                    value TEXT NOT NULL,
+                    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                    FOREIGN KEY (session_id) REFERENCES sessions(session_id),
+                    UNIQUE(session_id, key)
+                )
+            """)
+
+            # Текущая сессия приложения - одна строка, общая для всех воркеров
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS current_session (
+                    id INTEGER PRIMARY KEY CHECK (id = 1),
+                    session_id TEXT NOT NULL,
+                    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                )
+            """)
+
+            # Индексы для быстрого поиска
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_messages_session ON messages(session_id)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_memories_category ON memories(category)")
+            cursor.execute("CREATE INDEX IF NOT EXISTS idx_context_session ON context(session_id)")
+
+            self.fts_enabled = self._init_search(cursor)
+
+    def _init_search(self, cursor: sqlite3.Cursor) -> bool:
+        """
+        Полнотекстовые индексы FTS5 над messages.content, memories.key/value и
+        context.value. Индексы external content: текст не дублируется, а
+        триггеры обновляют индекс вместе с таблицей. Возвращает False, если
+        SQLite собран без FTS5
+        """
+        for table, columns, update_columns in SEARCH_INDEXES:
+            fts = f"{table}_fts"
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE name = ?", (fts,))
+            exists = cursor.fetchone() is not None
+
+            column_list = ', '.join(columns)
+            new_values = ', '.join(f"new.{column}" for column in columns)
+            old_values = ', '.join(f"old.{column}" for column in columns)
+            try:
+                cursor.execute(f"""
+                    CREATE VIRTUAL TABLE IF NOT EXISTS {fts} USING fts5(
+                        {column_list}, content='{table}', content_rowid='id',
+                        tokenize='unicode61 remove_diacritics 2'
+                    )
+                """)
+            except sqlite3.OperationalError as e:
+                print(f"⚠️ Полнотекстовый поиск недоступен: {e}")
+                return False
+
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_insert AFTER INSERT ON {table} BEGIN
+                    INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_delete AFTER DELETE ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                END
+            """)
+            cursor.execute(f"""
+                CREATE TRIGGER IF NOT EXISTS {fts}_update AFTER UPDATE OF {update_columns} ON {table} BEGIN
+                    INSERT INTO {fts} ({fts}, rowid, {column_list}) VALUES ('delete', old.id, {old_values});
+                    INSERT INTO {fts} (rowid, {column_list}) VALUES (new.id, {new_values});
+                END
+            """)
+
+            if not exists:
+                # Индекс для записей, сохраненных до его появления
+                cursor.execute(f"INSERT INTO {fts} ({fts}) VALUES ('rebuild')")
+        return True
 
     # ==================== УПРАВЛЕНИЕ СЕССИЯМИ ====================
 
@@ -103,18 +313,16 @@ class MemoryService:
             True если создано успешно
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            metadata_json = json.dumps(metadata) if metadata else None
+                metadata_json = json.dumps(metadata) if metadata else None
 
-            cursor.execute("""
-                INSERT INTO sessions (session_id, title, metadata)
-                VALUES (?, ?, ?)
-            """, (session_id, title or f"Сессия {session_id}", metadata_json))
+                cursor.execute("""
+                    INSERT INTO sessions (session_id, title, metadata)
+                    VALUES (?, ?, ?)
+                """, (session_id, title or f"Сессия {session_id}", metadata_json))
 
-            conn.commit()
-            conn.close()
             return True
         except sqlite3.IntegrityError:
             # Сессия уже существует
@@ -122,16 +330,14 @@ class MemoryService:
 
     def get_session(self, session_id: str) -> Optional[Dict[str, Any]]:
         """Получить информацию о сессии"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM sessions WHERE session_id = ?
-        """, (session_id,))
+            cursor.execute("""
+                SELECT * FROM sessions WHERE session_id = ?
+            """, (session_id,))
 
-        row = cursor.fetchone()
-        conn.close()
+            row = cursor.fetchone()
 
         if row:
             return {
@@ -146,18 +352,17 @@ class MemoryService:
 
     def list_sessions(self, limit: int = 10) -> List[Dict[str, Any]]:
         """Получить список всех сессий"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM sessions
-            ORDER BY updated_at DESC
-            LIMIT ?
-        """, (limit,))
+            cursor.execute("""
+                SELECT * FROM sessions
+                ORDER BY updated_at DESC
+                LIMIT ?
+            """, (limit,))
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         return [{
             'id': row['id'],
@@ -170,20 +375,42 @@ class MemoryService:
 
     def delete_session(self, session_id: str) -> bool:
         """Удалить сессию и все связанные данные"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        # Удаляем связанные сообщения и контекст
-        cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
-        cursor.execute("DELETE FROM context WHERE session_id = ?", (session_id,))
-        cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
+            # Удаляем связанные сообщения и контекст
+            cursor.execute("DELETE FROM messages WHERE session_id = ?", (session_id,))
+            cursor.execute("DELETE FROM context WHERE session_id = ?", (session_id,))
+            cursor.execute("DELETE FROM sessions WHERE session_id = ?", (session_id,))
 
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
+            affected = cursor.rowcount
 
         return affected > 0
 
+    def get_current_session(self) -> Optional[str]:
+        """ID текущей сессии или None, если она не выбрана или уже удалена"""
+        with self._connection() as conn:
+            cursor = conn.cursor()
+
+            cursor.execute("""
+                SELECT c.session_id FROM current_session c
+                JOIN sessions s ON s.session_id = c.session_id
+                WHERE c.id = 1
+            """)
+
+            row = cursor.fetchone()
+
+        return row['session_id'] if row else None
+
+    def set_current_session(self, session_id: str):
+        """Сделать сессию текущей для всех процессов, работающих с базой"""
+        with self._connection() as conn:
+            conn.execute("""
+                INSERT INTO current_session (id, session_id) VALUES (1, ?)
+                ON CONFLICT(id) DO UPDATE SET session_id = excluded.session_id, updated_at = CURRENT_TIMESTAMP
+            """, (session_id,))
+
     # ==================== УПРАВЛЕНИЕ СООБЩЕНИЯМИ ====================
 
     def save_message(self, session_id: str, role: str, content: str, tokens: int = 0) -> bool:
@@ -197,31 +424,141 @@ class MemoryService:
             tokens: количество токенов
 
         Returns:
-            True если сохранено успешно
+            True если сохранено успешно (в режиме 'normal' - поставлено в очередь записи)
         """
+        # Время сообщения - момент вызова, а не коммита пакета (UTC, как CURRENT_TIMESTAMP)
+        row = (session_id, role, content, tokens, time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime()))
+
+        if self.durability == 'normal':
+            self._enqueue(row)
+            return True
+
         try:
-            conn = sqlite3.connect(self.db_path)
+            self._write_messages([row])
+            return True
+        except Exception as e:
+            print(f"Ошибка сохранения сообщения: {e}")
+            return False
+
+    def _write_messages(self, rows: List[tuple]):
+        """Сохранить сообщения и обновить время их сессий одной транзакцией"""
+        with self._connection() as conn:
             cursor = conn.cursor()
 
-            # Сохраняем сообщение
-            cursor.execute("""
-                INSERT INTO messages (session_id, role, content, tokens)
-                VALUES (?, ?, ?, ?)
-            """, (session_id, role, content, tokens))
+            # Сохраняем сообщения
+            cursor.executemany("""
+                INSERT INTO messages (session_id, role, content, tokens, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            """, rows)
 
-            # Обновляем время последнего обновления сессии
-            cursor.execute("""
+            # Обновляем время последнего обновления сессий
+            cursor.executemany("""
                 UPDATE sessions
                 SET updated_at = CURRENT_TIMESTAMP
                 WHERE session_id = ?
-            """, (session_id,))
-
-            conn.commit()
-            conn.close()
-            return True
+            """, [(session_id,) for session_id in dict.fromkeys(row[0] for row in rows)])
+
+    # ==================== ОТЛОЖЕННАЯ ЗАПИСЬ ====================
+
+    def _enqueue(self, row: tuple):
+        """Поставить сообщение в очередь фонового писателя (после fork - нового)"""
+        with self._writer_lock:
+            if self._writer is None or self._writer_pid != os.getpid():
+                self._write_queue = queue.Queue()
+                self._pending = 0
+                self._writer = threading.Thread(
+                    target=self._write_loop, args=(self._write_queue,),
+                    name="memory-writer", daemon=True
+                )
+                self._writer_pid = os.getpid()
+                self._writer.start()
+            self._write_queue.put(row)
+            self._pending += 1
+            self._write_stats['queued'] += 1
+
+    def _write_loop(self, pending: queue.Queue):
+        """
+        Фоновый писатель: копит сообщения до flush_interval_ms или batch_size
+        и сохраняет их одной транзакцией (group commit).
+        Event в очереди - барьер flush(), None - остановка
+        """
+        stop = False
+        while not stop:
+            batch, barriers = [], []
+            item = pending.get()
+            deadline = time.monotonic() + self.flush_interval_ms / 1000
+            while True:
+                if item is None:
+                    stop = True
+                    break
+                if isinstance(item, threading.Event):
+                    barriers.append(item)
+                    break
+                batch.append(item)
+                if len(batch) >= self.batch_size:
+                    break
+                try:
+                    item = pending.get(timeout=max(0.0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+
+            if batch:
+                self._write_batch(batch)
+            for barrier in barriers:
+                barrier.set()
+
+    def _write_batch(self, batch: List[tuple]):
+        """Записать пакет сообщений из очереди"""
+        try:
+            self._write_messages(batch)
+            failed = 0
         except Exception as e:
-            print(f"Ошибка сохранения сообщения: {e}")
-            return False
+            print(f"Ошибка сохранения сообщений: {e}")
+            failed = len(batch)
+
+        with self._writer_lock:
+            self._pending -= len(batch)
+            self._write_stats['batches'] += 1
+            self._write_stats['rows'] += len(batch) - failed
+            self._write_stats['failed'] += failed
+            self._write_stats['max_batch'] = max(self._write_stats['max_batch'], len(batch))
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Барьер: дождаться записи всех сообщений, поставленных в очередь до вызова
+
+        Returns:
+            False, если не дождались за timeout секунд
+        """
+        with self._writer_lock:
+            if self._pending == 0 or self._writer_pid != os.getpid():
+                return True
+            barrier = threading.Event()
+            self._write_queue.put(barrier)
+            self._write_stats['flushes'] += 1
+        return barrier.wait(timeout)
+
+    def _stop_writer(self, timeout: float = 10.0):
+        """Записать очередь и остановить фоновый писатель"""
+        with self._writer_lock:
+            writer = self._writer
+            if writer is None or self._writer_pid != os.getpid():
+                return
+            self._writer = None
+            self._write_queue.put(None)
+        writer.join(timeout)
+
+    def get_write_stats(self) -> Dict[str, Any]:
+        """Получить статистику записи сообщений"""
+        with self._writer_lock:
+            stats = dict(self._write_stats)
+            stats['pending'] = self._pending
+        stats['durability'] = self.durability
+        stats['flush_interval_ms'] = self.flush_interval_ms
+        stats['batch_size'] = self.batch_size
+        return stats
+
+    # ==================== ЧТЕНИЕ СООБЩЕНИЙ ====================
 
     def get_messages(self, session_id: str, limit: int = None) -> List[Dict[str, Any]]:
         """
@@ -234,26 +571,25 @@ class MemoryService:
         Returns:
             Список сообщений
         """
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
-
-        if limit:
-            cursor.execute("""
-                SELECT * FROM messages
-                WHERE session_id = ?
-                ORDER BY id DESC
-                LIMIT ?
-            """, (session_id, limit))
-        else:
-            cursor.execute("""
-                SELECT * FROM messages
-                WHERE session_id = ?
-                ORDER BY id ASC
-            """, (session_id,))
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        rows = cursor.fetchall()
-        conn.close()
+            if limit:
+                cursor.execute("""
+                    SELECT * FROM messages
+                    WHERE session_id = ?
+                    ORDER BY id DESC
+                    LIMIT ?
+                """, (session_id, limit))
+            else:
+                cursor.execute("""
+                    SELECT * FROM messages
+                    WHERE session_id = ?
+                    ORDER BY id ASC
+                """, (session_id,))
+
+            rows = cursor.fetchall()
 
         messages = [{
             'id': row['id'],
@@ -271,15 +607,15 @@ class MemoryService:
 
     def get_message_count(self, session_id: str) -> int:
         """Получить количество сообщений в сессии"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT COUNT(*) FROM messages WHERE session_id = ?
-        """, (session_id,))
+            cursor.execute("""
+                SELECT COUNT(*) FROM messages WHERE session_id = ?
+            """, (session_id,))
 
-        count = cursor.fetchone()[0]
-        conn.close()
+            count = cursor.fetchone()[0]
 
         return count
 
@@ -301,29 +637,27 @@ class MemoryService:
             True если сохранено успешно
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
+
+                # Преобразуем value в JSON если это не строка
+                if not isinstance(value, str):
+                    value = json.dumps(value, ensure_ascii=False)
+
+                metadata_json = json.dumps(metadata) if metadata else None
+
+                # Пытаемся обновить существующую запись или создать новую
+                cursor.execute("""
+                    INSERT INTO memories (key, value, category, importance, metadata)
+                    VALUES (?, ?, ?, ?, ?)
+                    ON CONFLICT(key) DO UPDATE SET
+                        value = excluded.value,
+                        category = excluded.category,
+                        importance = excluded.importance,
+                        metadata = excluded.metadata,
+                        updated_at = CURRENT_TIMESTAMP
+                """, (key, value, category, importance, metadata_json))
 
-            # Преобразуем value в JSON если это не строка
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
-
-            metadata_json = json.dumps(metadata) if metadata else None
-
-            # Пытаемся обновить существующую запись или создать новую
-            cursor.execute("""
-                INSERT INTO memories (key, value, category, importance, metadata)
-                VALUES (?, ?, ?, ?, ?)
-                ON CONFLICT(key) DO UPDATE SET
-                    value = excluded.value,
-                    category = excluded.category,
-                    importance = excluded.importance,
-                    metadata = excluded.metadata,
-                    updated_at = CURRENT_TIMESTAMP
-            """, (key, value, category, importance, metadata_json))
-
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Ошибка сохранения памяти: {e}")
@@ -339,22 +673,20 @@ class MemoryService:
         Returns:
             Значение или None если не найдено
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            UPDATE memories
-            SET access_count = access_count + 1
-            WHERE key = ?
-        """, (key,))
+            cursor.execute("""
+                UPDATE memories
+                SET access_count = access_count + 1
+                WHERE key = ?
+            """, (key,))
 
-        cursor.execute("""
-            SELECT value FROM memories WHERE key = ?
-        """, (key,))
+            cursor.execute("""
+                SELECT value FROM memories WHERE key = ?
+            """, (key,))
 
-        row = cursor.fetchone()
-        conn.commit()
-        conn.close()
+            row = cursor.fetchone()
 
         if row:
             value = row[0]
@@ -367,18 +699,16 @@ class MemoryService:
 
     def get_memories_by_category(self, category: str) -> List[Dict[str, Any]]:
         """Получить все записи памяти по категории"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM memories
-            WHERE category = ?
-            ORDER BY importance DESC, updated_at DESC
-        """, (category,))
+            cursor.execute("""
+                SELECT * FROM memories
+                WHERE category = ?
+                ORDER BY importance DESC, updated_at DESC
+            """, (category,))
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         return [{
             'key': row['key'],
@@ -392,18 +722,16 @@ class MemoryService:
 
     def list_all_memories(self, limit: int = 50) -> List[Dict[str, Any]]:
         """Получить все записи памяти"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT * FROM memories
-            ORDER BY importance DESC, updated_at DESC
-            LIMIT ?
-        """, (limit,))
+            cursor.execute("""
+                SELECT * FROM memories
+                ORDER BY importance DESC, updated_at DESC
+                LIMIT ?
+            """, (limit,))
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         return [{
             'key': row['key'],
@@ -417,14 +745,12 @@ class MemoryService:
 
     def delete_memory(self, key: str) -> bool:
         """Удалить запись из памяти"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("DELETE FROM memories WHERE key = ?", (key,))
+            cursor.execute("DELETE FROM memories WHERE key = ?", (key,))
 
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
+            affected = cursor.rowcount
 
         return affected > 0
 
@@ -443,23 +769,21 @@ class MemoryService:
             True если сохранено успешно
         """
         try:
-            conn = sqlite3.connect(self.db_path)
-            cursor = conn.cursor()
+            with self._connection() as conn:
+                cursor = conn.cursor()
 
-            # Преобразуем value в JSON если это не строка
-            if not isinstance(value, str):
-                value = json.dumps(value, ensure_ascii=False)
+                # Преобразуем value в JSON если это не строка
+                if not isinstance(value, str):
+                    value = json.dumps(value, ensure_ascii=False)
 
-            cursor.execute("""
-                INSERT INTO context (session_id, key, value)
-                VALUES (?, ?, ?)
-                ON CONFLICT(session_id, key) DO UPDATE SET
-                    value = excluded.value,
-                    created_at = CURRENT_TIMESTAMP
-            """, (session_id, key, value))
+                cursor.execute("""
+                    INSERT INTO context (session_id, key, value)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(session_id, key) DO UPDATE SET
+                        value = excluded.value,
+                        created_at = CURRENT_TIMESTAMP
+                """, (session_id, key, value))
 
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             print(f"Ошибка сохранения контекста: {e}")
@@ -467,16 +791,15 @@ class MemoryService:
 
     def get_context(self, session_id: str, key: str) -> Optional[Any]:
         """Получить значение из контекста сессии"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT value FROM context
-            WHERE session_id = ? AND key = ?
-        """, (session_id, key))
+            cursor.execute("""
+                SELECT value FROM context
+                WHERE session_id = ? AND key = ?
+            """, (session_id, key))
 
-        row = cursor.fetchone()
-        conn.close()
+            row = cursor.fetchone()
 
         if row:
             value = row[0]
@@ -489,16 +812,14 @@ class MemoryService:
 
     def get_all_context(self, session_id: str) -> Dict[str, Any]:
         """Получить весь контекст сессии"""
-        conn = sqlite3.connect(self.db_path)
-        conn.row_factory = sqlite3.Row
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        cursor.execute("""
-            SELECT key, value FROM context WHERE session_id = ?
-        """, (session_id,))
+            cursor.execute("""
+                SELECT key, value FROM context WHERE session_id = ?
+            """, (session_id,))
 
-        rows = cursor.fetchall()
-        conn.close()
+            rows = cursor.fetchall()
 
         context = {}
         for row in rows:
@@ -523,47 +844,167 @@ class MemoryService:
         Returns:
             True если удалено успешно
         """
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        if key:
-            cursor.execute("DELETE FROM context WHERE session_id = ? AND key = ?", (session_id, key))
-        else:
-            cursor.execute("DELETE FROM context WHERE session_id = ?", (session_id,))
+            if key:
+                cursor.execute("DELETE FROM context WHERE session_id = ? AND key = ?", (session_id, key))
+            else:
+                cursor.execute("DELETE FROM context WHERE session_id = ?", (session_id,))
 
-        conn.commit()
-        affected = cursor.rowcount
-        conn.close()
+            affected = cursor.rowcount
 
         return affected > 0
 
+    # ==================== ПОИСК ====================
+
+    def search(self, query: str, session_id: str = None, category: str = None,
+               sources: List[str] = None, limit: int = 20, offset: int = 0,
+               snippet_tokens: int = 12) -> Dict[str, Any]:
+        """
+        Полнотекстовый поиск по сообщениям, долговременной памяти и контексту
+
+        Каждое слово запроса ищется как префикс ("фреймворк" найдет
+        "фреймворки"), результаты содержат все слова и упорядочены по bm25.
+
+        Args:
+            query: текст запроса
+            session_id: искать только в сообщениях и контексте этой сессии
+            category: искать только в долговременной памяти этой категории
+            sources: где искать - 'messages', 'memories', 'context' (по умолчанию везде)
+            limit: размер страницы
+            offset: сколько результатов пропустить
+            snippet_tokens: длина фрагмента с подсветкой (слов)
+
+        Returns:
+            {'results': [...], 'has_more': bool}; найденные слова во фрагменте
+            обрамлены <mark></mark>
+
+        Raises:
+            ValueError: неизвестный источник или фильтры, исключающие все
+                источники (например, session_id вместе с category)
+        """
+        if not self.fts_enabled:
+            raise RuntimeError("SQLite собран без FTS5: полнотекстовый поиск недоступен")
+
+        known_sources = [table for table, _, _ in SEARCH_INDEXES]
+        sources = set(sources or known_sources)
+        unknown = sources - set(known_sources)
+        if unknown:
+            raise ValueError(f"Неизвестные источники поиска: {', '.join(sorted(unknown))}")
+        if session_id:
+            sources.discard('memories')  # долговременная память не привязана к сессии
+        if category:
+            sources &= {'memories'}
+        if not sources:
+            raise ValueError("Фильтры исключают все источники: session_id применяется к сообщениям "
+                             "и контексту, category - только к долговременной памяти")
+
+        match = self._match_expression(query)
+        if not match:
+            return {'results': [], 'has_more': False}
+
+        selects, params = [], []
+        snippet = f"snippet({{fts}}, -1, '<mark>', '</mark>', '…', {int(snippet_tokens)})"
+        if 'messages' in sources:
+            sql = f"""
+                SELECT 'message' AS source, m.id AS id, m.session_id AS session_id, m.role AS key,
+                       NULL AS category, {snippet.format(fts='messages_fts')} AS snippet,
+                       bm25(messages_fts) AS score, m.timestamp AS timestamp
+                FROM messages_fts JOIN messages m ON m.id = messages_fts.rowid
+                WHERE messages_fts MATCH ?
+            """
+            params.append(match)
+            if session_id:
+                sql += " AND m.session_id = ?"
+                params.append(session_id)
+            selects.append(sql)
+        if 'memories' in sources:
+            # Совпадение в ключе весит вдвое больше, чем в значении
+            sql = f"""
+                SELECT 'memory' AS source, m.id AS id, NULL AS session_id, m.key AS key,
+                       m.category AS category, {snippet.format(fts='memories_fts')} AS snippet,
+                       bm25(memories_fts, 2.0, 1.0) AS score, m.updated_at AS timestamp
+                FROM memories_fts JOIN memories m ON m.id = memories_fts.rowid
+                WHERE memories_fts MATCH ?
+            """
+            params.append(match)
+            if category:
+                sql += " AND m.category = ?"
+                params.append(category)
+            selects.append(sql)
+        if 'context' in sources:
+            sql = f"""
+                SELECT 'context' AS source, c.id AS id, c.session_id AS session_id, c.key AS key,
+                       NULL AS category, {snippet.format(fts='context_fts')} AS snippet,
+                       bm25(context_fts) AS score, c.created_at AS timestamp
+                FROM context_fts JOIN context c ON c.id = context_fts.rowid
+                WHERE context_fts MATCH ?
+            """
+            params.append(match)
+            if session_id:
+                sql += " AND c.session_id = ?"
+                params.append(session_id)
+            selects.append(sql)
+
+        # Одна лишняя строка показывает, есть ли следующая страница
+        sql = " UNION ALL ".join(selects) + " ORDER BY score LIMIT ? OFFSET ?"
+        params.extend([limit + 1, offset])
+
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
+            cursor.execute(sql, params)
+            rows = cursor.fetchall()
+
+        return {
+            'results': [{
+                'source': row['source'],
+                'id': row['id'],
+                'session_id': row['session_id'],
+                'key': row['key'],
+                'category': row['category'],
+                'snippet': row['snippet'],
+                'score': round(-row['score'], 4),  # bm25 в SQLite отрицательный: меньше - лучше
+                'timestamp': row['timestamp']
+            } for row in rows[:limit]],
+            'has_more': len(rows) > limit
+        }
+
+    @staticmethod
+    def _match_expression(query: str) -> Optional[str]:
+        """Запрос FTS5 из слов текста: каждое слово - префикс в кавычках (без синтаксиса FTS5)"""
+        words = re.findall(r'\w+', query.lower())
+        if not words:
+            return None
+        return ' '.join(f'"{word}"*' for word in words)
+
     # ==================== УТИЛИТЫ ====================
 
     def get_stats(self) -> Dict[str, Any]:
         """Получить статистику использования памяти"""
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        # Количество сессий
-        cursor.execute("SELECT COUNT(*) FROM sessions")
-        sessions_count = cursor.fetchone()[0]
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        # Количество сообщений
-        cursor.execute("SELECT COUNT(*) FROM messages")
-        messages_count = cursor.fetchone()[0]
+            # Количество сессий
+            cursor.execute("SELECT COUNT(*) FROM sessions")
+            sessions_count = cursor.fetchone()[0]
 
-        # Количество записей в памяти
-        cursor.execute("SELECT COUNT(*) FROM memories")
-        memories_count = cursor.fetchone()[0]
+            # Количество сообщений
+            cursor.execute("SELECT COUNT(*) FROM messages")
+            messages_count = cursor.fetchone()[0]
 
-        # Количество записей в контексте
-        cursor.execute("SELECT COUNT(*) FROM context")
-        context_count = cursor.fetchone()[0]
+            # Количество записей в памяти
+            cursor.execute("SELECT COUNT(*) FROM memories")
+            memories_count = cursor.fetchone()[0]
 
-        # Размер файла БД
-        db_size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
+            # Количество записей в контексте
+            cursor.execute("SELECT COUNT(*) FROM context")
+            context_count = cursor.fetchone()[0]
 
-        conn.close()
+            # Размер файла БД
+            db_size = os.path.getsize(self.db_path) if os.path.exists(self.db_path) else 0
 
         return {
             'sessions': sessions_count,
@@ -571,9 +1012,19 @@ class MemoryService:
             'memories': memories_count,
             'context_entries': context_count,
             'db_size_bytes': db_size,
-            'db_size_mb': round(db_size / (1024 * 1024), 2)
+            'db_size_mb': round(db_size / (1024 * 1024), 2),
+            'connections': self.get_pool_stats(),
+            'writes': self.get_write_stats()
         }
 
+    def get_pool_stats(self) -> Dict[str, Any]:
+        """Получить статистику пула соединений"""
+        with self._pool_lock:
+            stats = dict(self._pool_stats)
+            stats['idle'] = len(self._idle)
+        stats['pool_size'] = self.pool_size
+        return stats
+
     def clear_all(self, confirm: bool = False) -> bool:
         """
         ОПАСНО: Очистить всю базу данных
@@ -587,15 +1038,20 @@ class MemoryService:
         if not confirm:
             return False
 
-        conn = sqlite3.connect(self.db_path)
-        cursor = conn.cursor()
-
-        cursor.execute("DELETE FROM context")
-        cursor.execute("DELETE FROM messages")
-        cursor.execute("DELETE FROM memories")
-        cursor.execute("DELETE FROM sessions")
+        self.flush()
+        with self._connection() as conn:
+            cursor = conn.cursor()
 
-        conn.commit()
-        conn.close()
+            cursor.execute("DELETE FROM context")
+            cursor.execute("DELETE FROM messages")
+            cursor.execute("DELETE FROM memories")
+            cursor.execute("DELETE FROM sessions")
 
         return True
+
+
+def create_memory_service(config: Dict[str, Any], db_path: str = "agent_memory.db") -> MemoryService:
+    """Создать сервис памяти и зарегистрировать закрытие соединений при завершении процесса"""
+    service = MemoryService.from_config(config, db_path)
+    atexit.register(service.close)
+    return service
@@ -0,0 +1,115 @@
+"""
+Выбор модели по размеру контекста
+Запрос уходит в самую дешевую модель, в окно которой помещаются запрос и ответ
+"""
+import math
+import threading
+from typing import Any, Dict, Optional
+
+
+class ModelRouter:
+    """
+    Маршрутизатор запросов между моделями YANDEX_MODELS.
+
+    У каждой модели объявлено окно контекста (context_window) - сумма
+    токенов запроса и ответа. Оценка токенов запроса увеличивается на
+    safety_margin, чтобы погрешность эвристики не приводила к отказу API.
+    Модели с routable = False (например, summarization) выбираются только явно.
+    """
+
+    def __init__(self, models: Dict[str, Dict[str, Any]], safety_margin: float = 0.1):
+        """
+        Args:
+            models: словарь моделей {ключ: {'uri', 'context_window', 'pricing', ...}}
+            safety_margin: запас к оценке токенов запроса (доля)
+        """
+        self.models = models
+        self.safety_margin = safety_margin
+        self._lock = threading.Lock()
+        self._stats = {
+            'models': {},
+            'reasons': {}
+        }
+
+    def required_tokens(self, input_tokens: int, max_tokens: int) -> int:
+        """Сколько токенов окна нужно запросу с учетом запаса и ответа"""
+        return math.ceil(input_tokens * (1 + self.safety_margin)) + max_tokens
+
+    def fits(self, model_key: str, input_tokens: int, max_tokens: int) -> bool:
+        """Помещается ли запрос в окно модели"""
+        return self.required_tokens(input_tokens, max_tokens) <= self.models[model_key]['context_window']
+
+    def _price(self, model_key: str) -> float:
+        pricing = self.models[model_key]['pricing']
+        return pricing['input'] + pricing['output']
+
+    def route(self, input_tokens: int, max_tokens: int,
+              preferred: Optional[str] = None) -> Dict[str, Any]:
+        """
+        Выбрать модель для запроса
+
+        Args:
+            input_tokens: оценка токенов запроса
+            max_tokens: лимит токенов ответа (maxTokens)
+            preferred: модель, которую нужно использовать, если запрос в нее помещается
+
+        Returns:
+            Решение: {'model' (None - запрос не помещается ни в одну модель),
+            'reason' (preferred | cheapest_fit | escalated | too_large),
+            'input_tokens', 'required_tokens', 'context_window'}
+        """
+        required = self.required_tokens(input_tokens, max_tokens)
+
+        if preferred is not None and self.fits(preferred, input_tokens, max_tokens):
+            model_key, reason = preferred, 'preferred'
+        else:
+            candidates = [
+                key for key, info in self.models.items()
+                if info.get('routable', True) and info['context_window'] >= required
+            ]
+            if candidates:
+                model_key = min(candidates, key=lambda key: (self._price(key), self.models[key]['context_window']))
+                reason = 'escalated' if preferred is not None else 'cheapest_fit'
+            else:
+                model_key, reason = None, 'too_large'
+
+        return self._decision(model_key, reason, input_tokens, required)
+
+    def check(self, model_key: str, input_tokens: int, max_tokens: int) -> Dict[str, Any]:
+        """
+        Решение для явно выбранной модели без замены: reason 'explicit',
+        или 'too_large' (model = None), если запрос не помещается в ее окно
+        """
+        required = self.required_tokens(input_tokens, max_tokens)
+        if self.fits(model_key, input_tokens, max_tokens):
+            return self._decision(model_key, 'explicit', input_tokens, required)
+
+        decision = self._decision(None, 'too_large', input_tokens, required)
+        decision['context_window'] = self.models[model_key]['context_window']
+        return decision
+
+    def _decision(self, model_key: Optional[str], reason: str,
+                  input_tokens: int, required: int) -> Dict[str, Any]:
+        """Учесть решение в статистике и вернуть его"""
+        with self._lock:
+            models = self._stats['models']
+            reasons = self._stats['reasons']
+            models[str(model_key)] = models.get(str(model_key), 0) + 1
+            reasons[reason] = reasons.get(reason, 0) + 1
+
+        return {
+            'model': model_key,
+            'reason': reason,
+            'input_tokens': input_tokens,
+            'required_tokens': required,
+            'context_window': self.models[model_key]['context_window'] if model_key else None
+        }
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику решений маршрутизатора"""
+        with self._lock:
+            return {
+                'models': dict(self._stats['models']),
+                'reasons': dict(self._stats['reasons']),
+                'safety_margin': self.safety_margin
+            }
@@ -0,0 +1,156 @@
+"""
+Параллельное выполнение независимых вызовов LLM
+Общий ограниченный пул потоков на воркер
+"""
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Any, Callable, Dict, Iterator, Optional, Tuple
+
+
+class ParallelRunner:
+    """
+    Запускает независимые задачи (обычно HTTP-вызовы модели) в общем пуле потоков.
+
+    Для каждой задачи отдельно замеряется время выполнения и перехватываются
+    исключения, поэтому ошибка одной задачи не влияет на остальные.
+    """
+
+    def __init__(self, max_workers: int = 8):
+        """
+        Args:
+            max_workers: размер общего пула потоков на процесс
+        """
+        self.max_workers = max_workers
+        self._executor = None
+        self._executor_pid = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        """Вернуть пул текущего процесса (после fork() создается новый)"""
+        pid = os.getpid()
+        if self._executor is not None and self._executor_pid == pid:
+            return self._executor
+
+        with self._lock:
+            if self._executor is None or self._executor_pid != pid:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.max_workers, thread_name_prefix="llm"
+                )
+                self._executor_pid = pid
+        return self._executor
+
+    def run(self, tasks: Dict[str, Callable[[], Any]],
+            max_concurrency: Optional[int] = None) -> Dict[str, Dict[str, Any]]:
+        """
+        Выполнить задачи параллельно и дождаться всех
+
+        Args:
+            tasks: словарь {имя: функция без аргументов}
+            max_concurrency: сколько задач этого вызова могут выполняться одновременно
+
+        Returns:
+            Словарь {имя: {'result', 'error', 'elapsed'}} в порядке исходных задач
+        """
+        limit = max(1, min(max_concurrency or self.max_workers, self.max_workers))
+        executor = self._get_executor()
+
+        pending = list(tasks)
+        running = {}
+        outcomes = {}
+
+        while pending or running:
+            while pending and len(running) < limit:
+                name = pending.pop(0)
+                running[executor.submit(self._timed, tasks[name])] = name
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                outcomes[running.pop(future)] = future.result()
+
+        return {name: outcomes[name] for name in tasks}
+
+    def merge_streams(self, streams: Dict[str, Callable[[], Iterator[Any]]],
+                      max_concurrency: Optional[int] = None
+                      ) -> Iterator[Tuple[str, Any, Optional[Dict[str, Any]]]]:
+        """
+        Запустить несколько генераторов параллельно и отдавать их элементы по мере появления
+
+        Args:
+            streams: словарь {имя: функция, возвращающая итератор}
+            max_concurrency: сколько потоков этого вызова читаются одновременно
+
+        Yields:
+            (имя, элемент, None) для каждого элемента и
+            (имя, None, {'error', 'elapsed'}) по завершении потока
+
+        Если потребитель закрыл генератор (например, клиент отключился от
+        потокового ответа), чтение всех потоков прекращается и слоты пула освобождаются.
+        """
+        limit = max(1, min(max_concurrency or self.max_workers, self.max_workers))
+        executor = self._get_executor()
+        events = queue.Queue()
+        cancelled = threading.Event()
+
+        def pump(name, factory):
+            start_time = time.time()
+            error = None
+            try:
+                iterator = factory()
+                try:
+                    for item in iterator:
+                        if cancelled.is_set():
+                            break
+                        events.put((name, item, None))
+                finally:
+                    close = getattr(iterator, 'close', None)
+                    if close is not None:
+                        close()
+            except Exception as e:
+                error = str(e)
+            events.put((name, None, {'error': error, 'elapsed': round(time.time() - start_time, 3)}))
+
+        pending = list(streams)
+        active = 0
+        finished = 0
+
+        try:
+            while finished < len(streams):
+                while pending and active < limit:
+                    name = pending.pop(0)
+                    executor.submit(pump, name, streams[name])
+                    active += 1
+
+                name, item, outcome = events.get()
+                if outcome is not None:
+                    active -= 1
+                    finished += 1
+                yield name, item, outcome
+        finally:
+            cancelled.set()
+
+    @staticmethod
+    def _timed(task: Callable[[], Any]) -> Dict[str, Any]:
+        """Выполнить задачу, замерив время и перехватив исключение"""
+        start_time = time.time()
+        try:
+            result = task()
+            error = None
+        except Exception as e:
+            result = None
+            error = str(e)
+        return {
+            'result': result,
+            'error': error,
+            'elapsed': round(time.time() - start_time, 3)
+        }
+
+    def shutdown(self):
+        """Остановить пул потоков"""
+        with self._lock:
+            if self._executor is not None:
+                self._executor.shutdown(wait=False)
+                self._executor = None
+                self._executor_pid = None
@@ -0,0 +1,190 @@
+"""
+Клиентский ограничитель частоты запросов к моделям Yandex (token bucket)
+Сглаживает всплески до квоты каталога вместо ответов HTTP 429
+"""
+import math
+import threading
+import time
+from typing import Any, Dict, Optional
+
+from llm_errors import LLMUnavailableError
+
+
+class RateLimitExceeded(LLMUnavailableError):
+    """Очередь к модели переполнена или ожидание превысило лимит"""
+
+    reason = 'rate_limited'
+
+
+class TokenBucket:
+    """
+    Token bucket с очередью ожидающих.
+
+    Каждый вызов резервирует токен сразу (баланс может уйти в минус) и
+    спит до момента, когда резерв покроется пополнением. Так ожидающие
+    обслуживаются в порядке прихода, а время ожидания известно заранее:
+    если оно больше max_wait, вызов отклоняется без ожидания.
+    """
+
+    def __init__(self, rate: float, burst: float, max_queue: int = 32, max_wait: float = 10.0):
+        """
+        Args:
+            rate: пополнение, запросов в секунду
+            burst: емкость ведра (допустимый всплеск)
+            max_queue: максимум одновременно ожидающих вызовов
+            max_wait: максимальное время ожидания токена (сек)
+        """
+        self.rate = rate
+        self.burst = burst
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+
+        self._tokens = burst
+        self._updated_at = time.monotonic()
+        self._waiting = 0
+        self._lock = threading.Lock()
+        self._stats = {
+            'acquired': 0,
+            'rejected': 0,
+            'waited': 0,
+            'total_wait': 0.0,
+            'max_wait_seen': 0.0
+        }
+
+    def _refill(self, now: float):
+        """Пополнить ведро (вызывается под self._lock)"""
+        self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+        self._updated_at = now
+
+    def acquire(self) -> float:
+        """
+        Получить токен, при необходимости дождавшись его
+
+        Returns:
+            Время ожидания (сек)
+
+        Raises:
+            RateLimitExceeded: очередь заполнена или ожидание превысит max_wait
+        """
+        with self._lock:
+            self._refill(time.monotonic())
+            wait = max(0.0, (1 - self._tokens) / self.rate)
+
+            if wait > 0 and self._waiting >= self.max_queue:
+                self._stats['rejected'] += 1
+                raise RateLimitExceeded(
+                    f"Очередь запросов к модели заполнена ({self.max_queue})", retry_after=wait
+                )
+            if wait > self.max_wait:
+                self._stats['rejected'] += 1
+                raise RateLimitExceeded(
+                    f"Ожидание квоты модели превышает {self.max_wait} сек", retry_after=wait
+                )
+
+            self._tokens -= 1
+            self._stats['acquired'] += 1
+            if wait > 0:
+                self._waiting += 1
+                self._stats['waited'] += 1
+                self._stats['total_wait'] += wait
+                self._stats['max_wait_seen'] = max(self._stats['max_wait_seen'], wait)
+
+        if wait > 0:
+            try:
+                time.sleep(wait)
+            finally:
+                with self._lock:
+                    self._waiting -= 1
+        return wait
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить состояние ведра и статистику ожиданий"""
+        with self._lock:
+            self._refill(time.monotonic())
+            stats = dict(self._stats)
+            stats['tokens'] = round(self._tokens, 2)
+            stats['queue_depth'] = self._waiting
+
+        stats['avg_wait'] = round(stats['total_wait'] / stats['waited'], 3) if stats['waited'] else 0
+        stats['total_wait'] = round(stats['total_wait'], 3)
+        stats['max_wait_seen'] = round(stats['max_wait_seen'], 3)
+        stats['rate'] = self.rate
+        stats['burst'] = self.burst
+        stats['max_queue'] = self.max_queue
+        stats['max_wait'] = self.max_wait
+        return stats
+
+
+class RateLimiter:
+    """
+    Набор token bucket по моделям.
+
+    Ключ - URI модели без каталога (например, "yandexgpt/latest") или
+    "agents" для Agents API. Лимиты задаются в config.json, ведро для
+    ключа без своих настроек создается по лимиту "default". Ведра живут в
+    памяти воркера: квоту каталога нужно делить на число воркеров.
+    """
+
+    DEFAULT_LIMIT = {'rps': 10}
+
+    def __init__(self, limits: Optional[Dict[str, Dict[str, float]]] = None,
+                 max_queue: int = 32, max_wait: float = 10.0):
+        """
+        Args:
+            limits: {ключ модели: {'rps': запросов в секунду, 'burst': всплеск}};
+                    burst по умолчанию равен rps, округленному вверх
+            max_queue: максимум ожидающих вызовов на модель
+            max_wait: максимальное время ожидания токена (сек)
+        """
+        self.limits = dict(limits or {})
+        self.max_queue = max_queue
+        self.max_wait = max_wait
+        self._buckets: Dict[str, TokenBucket] = {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'RateLimiter':
+        """Создать ограничитель по настройкам из config.json"""
+        return cls(
+            limits=config.get('rate_limits'),
+            max_queue=config.get('rate_limit_max_queue', 32),
+            max_wait=config.get('rate_limit_max_wait', 10.0)
+        )
+
+    @staticmethod
+    def key_for(payload: Dict[str, Any]) -> str:
+        """Ключ модели для тела запроса"""
+        model_uri = payload.get('modelUri')
+        if not model_uri:
+            return 'agents'
+        # gpt://<каталог>/yandexgpt/latest -> yandexgpt/latest
+        return model_uri.split('://', 1)[-1].split('/', 1)[-1]
+
+    def _bucket(self, key: str) -> TokenBucket:
+        bucket = self._buckets.get(key)
+        if bucket is not None:
+            return bucket
+
+        with self._lock:
+            if key not in self._buckets:
+                limit = self.limits.get(key) or self.limits.get('default') or self.DEFAULT_LIMIT
+                self._buckets[key] = TokenBucket(
+                    rate=float(limit['rps']),
+                    burst=float(limit.get('burst', max(1, math.ceil(limit['rps'])))),
+                    max_queue=self.max_queue,
+                    max_wait=self.max_wait
+                )
+            return self._buckets[key]
+
+    def acquire(self, payload: Dict[str, Any], key: Optional[str] = None) -> float:
+        """
+        Дождаться квоты для запроса; возвращает время ожидания (сек)
+        key - явный ключ квоты вместо модели запроса (например, 'tokenize')
+        """
+        return self._bucket(key or self.key_for(payload)).acquire()
+
+    def get_stats(self) -> Dict[str, Dict[str, Any]]:
+        """Получить статистику по всем моделям, к которым были запросы"""
+        with self._lock:
+            buckets = dict(self._buckets)
+        return {key: bucket.get_stats() for key, bucket in buckets.items()}
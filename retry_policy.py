@@ -0,0 +1,193 @@
+"""
+Повторные попытки запросов к LLM: экспоненциальная задержка с джиттером,
+учет Retry-After и общий бюджет повторов
+"""
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from typing import Any, Callable, Dict, Optional
+
+import requests
+
+
+class RetryBudget:
+    """
+    Бюджет повторов: каждый первичный запрос добавляет ratio токена,
+    каждый повтор тратит один. Так повторы дают не больше ratio
+    дополнительной нагрузки и не умножают ее во время сбоя API.
+    min_retries - запас токенов для редких запросов (он же потолок накопления).
+    """
+
+    def __init__(self, ratio: float = 0.1, min_retries: int = 10):
+        self.ratio = ratio
+        self.max_tokens = float(min_retries)
+        self._tokens = float(min_retries)
+        self._lock = threading.Lock()
+
+    def deposit(self):
+        """Учесть первичный запрос"""
+        with self._lock:
+            self._tokens = min(self.max_tokens, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Взять токен на повтор; False - бюджет исчерпан"""
+        with self._lock:
+            if self._tokens < 1:
+                return False
+            self._tokens -= 1
+            return True
+
+    @property
+    def tokens(self) -> float:
+        with self._lock:
+            return self._tokens
+
+
+class RetryPolicy:
+    """
+    Политика повторов для одного HTTP-запроса.
+
+    Повторяются сетевые ошибки (обрыв соединения, таймаут) и ответы со
+    статусами из RETRYABLE_STATUSES. Задержка - full jitter от
+    base_delay * 2^(попытка-1), но не больше max_delay; если сервер прислал
+    Retry-After, ждем столько, сколько он просит (до max_retry_after).
+    """
+
+    RETRYABLE_STATUSES = (429, 500, 502, 503, 504)
+    RETRYABLE_ERRORS = (requests.exceptions.ConnectionError, requests.exceptions.Timeout)
+
+    def __init__(self, max_attempts: int = 3, base_delay: float = 0.5, max_delay: float = 8.0,
+                 max_retry_after: float = 30.0, budget: Optional[RetryBudget] = None):
+        """
+        Args:
+            max_attempts: максимум попыток, включая первую
+            base_delay: базовая задержка перед первым повтором (сек)
+            max_delay: потолок задержки экспоненциального роста (сек)
+            max_retry_after: если Retry-After больше - не повторяем (сек)
+            budget: общий бюджет повторов (None - без ограничения)
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.max_retry_after = max_retry_after
+        self.budget = budget
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'retries': 0,
+            'recovered': 0,
+            'gave_up': 0,
+            'budget_exhausted': 0,
+            'retry_reasons': {}
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> 'RetryPolicy':
+        """Создать политику по настройкам из config.json"""
+        return cls(
+            max_attempts=config.get('retry_max_attempts', 3),
+            base_delay=config.get('retry_base_delay', 0.5),
+            max_delay=config.get('retry_max_delay', 8.0),
+            max_retry_after=config.get('retry_max_retry_after', 30.0),
+            budget=RetryBudget(
+                ratio=config.get('retry_budget_ratio', 0.1),
+                min_retries=config.get('retry_budget_min_retries', 10)
+            )
+        )
+
+    @staticmethod
+    def parse_retry_after(response: requests.Response) -> Optional[float]:
+        """Задержка из заголовка Retry-After (секунды или HTTP-дата)"""
+        value = response.headers.get('Retry-After')
+        if not value:
+            return None
+        try:
+            return max(0.0, float(value))
+        except ValueError:
+            pass
+        try:
+            return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+        except (TypeError, ValueError):
+            return None
+
+    def backoff(self, attempt: int, retry_after: Optional[float] = None) -> Optional[float]:
+        """Задержка перед повтором номер attempt; None - повторять не стоит"""
+        if retry_after is not None:
+            if retry_after > self.max_retry_after:
+                return None
+            return retry_after + random.uniform(0, self.base_delay)
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))
+
+    def call(self, send: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Выполнить send() с повторами
+
+        Args:
+            send: функция отправки запроса, возвращающая ответ без проверки статуса
+
+        Returns:
+            Первый неповторяемый ответ или последний ответ после исчерпания попыток
+
+        Raises:
+            requests.exceptions.RequestException: сетевая ошибка последней попытки
+        """
+        with self._lock:
+            self._stats['calls'] += 1
+        if self.budget is not None:
+            self.budget.deposit()
+
+        attempt = 1
+        while True:
+            response = None
+            error = None
+            retry_after = None
+            try:
+                response = send()
+            except self.RETRYABLE_ERRORS as e:
+                error = e
+                reason = type(e).__name__
+            else:
+                if response.status_code not in self.RETRYABLE_STATUSES:
+                    if attempt > 1:
+                        self._count('recovered')
+                    return response
+                reason = f"HTTP {response.status_code}"
+                retry_after = self.parse_retry_after(response)
+
+            delay = self.backoff(attempt, retry_after) if attempt < self.max_attempts else None
+            if delay is not None and self.budget is not None and not self.budget.withdraw():
+                self._count('budget_exhausted')
+                delay = None
+
+            if delay is None:
+                self._count('gave_up')
+                if error is not None:
+                    raise error
+                return response
+
+            with self._lock:
+                self._stats['retries'] += 1
+                reasons = self._stats['retry_reasons']
+                reasons[reason] = reasons.get(reason, 0) + 1
+
+            if response is not None:
+                response.close()
+            time.sleep(delay)
+            attempt += 1
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику повторов"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['retry_reasons'] = dict(self._stats['retry_reasons'])
+        stats['max_attempts'] = self.max_attempts
+        if self.budget is not None:
+            stats['budget_tokens'] = round(self.budget.tokens, 2)
+            stats['budget_ratio'] = self.budget.ratio
+        return stats
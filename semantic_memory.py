@@ -0,0 +1,317 @@
+"""
+Семантический поиск по долговременной памяти агента
+Векторы записей memories хранятся в SQLite (float32), поиск top-k - на NumPy
+"""
+import hashlib
+import re
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from memory_service import MemoryService
+
+
+WORD = re.compile(r'\w+')
+
+
+def local_embedding(text: str, dim: int = 1024) -> np.ndarray:
+    """
+    Детерминированный локальный эмбеддинг (feature hashing).
+
+    Признаки - слова и символьные триграммы слов: однокоренные формы
+    ("фреймворк", "фреймворки") получают близкие векторы. Признак
+    попадает в одну из dim координат со знаком +-1 по blake2b-хешу,
+    поэтому вектор одинаков во всех процессах. Вектор нормирован.
+    """
+    vector = np.zeros(dim, dtype=np.float32)
+    for word in WORD.findall(text.lower()):
+        if len(word) < 2:
+            continue
+        padded = f"#{word}#"
+        features = [(word, 1.0)] + [(padded[i:i + 3], 0.5) for i in range(len(padded) - 2)]
+        for feature, weight in features:
+            digest = int.from_bytes(hashlib.blake2b(feature.encode('utf-8'), digest_size=8).digest(), 'little')
+            vector[digest % dim] += weight if (digest >> 63) & 1 else -weight
+    return normalize(vector)
+
+
+def normalize(vector: Sequence[float]) -> np.ndarray:
+    """Вектор float32 единичной длины (нулевой остается нулевым)"""
+    vector = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(vector)
+    return vector / norm if norm > 0 else vector
+
+
+def memory_text(key: str, value: str) -> str:
+    """Текст записи памяти для эмбеддинга и для промпта"""
+    return f"{key.replace('_', ' ')}: {value}"
+
+
+class SemanticMemory:
+    """
+    Векторный индекс долговременной памяти (таблица memories MemoryService).
+
+    embed(text, kind) - эмбеддинг через API ('doc' - запись, 'query' -
+    запрос пользователя), обычно YandexClient.embed. Без него используется
+    local_embedding. Векторы хранятся в таблице memory_vectors той же базы
+    (float32 BLOB); при изменении или удалении записи памяти триггер удаляет
+    ее вектор, и запись заново получает вектор при следующем поиске.
+    Через API записи индексируются в фоновом потоке (schedule_indexing) -
+    запрос пользователя ждет только эмбеддинг своего вопроса; локальная
+    модель быстрая и индексирует записи прямо перед поиском.
+    Соединения с базой берутся из пула MemoryService (WAL, busy_timeout).
+
+    Все векторы держатся в памяти процесса одной матрицей и перечитываются,
+    только когда таблица изменилась (другим воркером тоже). Поиск - одно
+    умножение матрицы на вектор запроса и argpartition: для тысяч записей
+    это доли миллисекунды.
+    """
+
+    def __init__(self, memory: MemoryService,
+                 embed: Optional[Callable[[str, str], Sequence[float]]] = None,
+                 dim: int = 1024, max_pending: int = 32):
+        """
+        Args:
+            memory: сервис памяти, записи которого индексируются
+            embed: эмбеддинг через API (None - локальный)
+            dim: размерность локального эмбеддинга
+            max_pending: сколько новых записей памяти индексировать за один поиск
+        """
+        self.memory = memory
+        self.embed = embed
+        self.dim = dim
+        self.max_pending = max_pending
+        # Векторы разных моделей несравнимы: при смене модели записи индексируются заново
+        self.model = 'yandex' if embed is not None else f'local-{dim}'
+
+        self._ids = np.empty(0, dtype=np.int64)
+        self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._signature = None  # (число векторов, максимальный id) загруженной матрицы
+        self._indexing = False  # Идет фоновая индексация
+        self._indexing_done = threading.Event()
+        self._indexing_done.set()
+        self._lock = threading.Lock()
+        self._stats = {
+            'searches': 0,
+            'embedded': 0,
+            'embed_errors': 0,
+            'last_error': None,
+            'reloads': 0,
+            'last_search_ms': 0.0
+        }
+
+        self._init_database()
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any], memory: MemoryService,
+                    embed: Optional[Callable[[str, str], Sequence[float]]] = None) -> 'SemanticMemory':
+        """
+        Создать индекс по настройкам из config.json.
+        embed используется только при embedding_backend = 'yandex'
+        """
+        if config.get('embedding_backend', 'local') != 'yandex':
+            embed = None
+        return cls(
+            memory,
+            embed=embed,
+            dim=config.get('embedding_dim', 1024),
+            max_pending=config.get('embedding_max_pending', 32)
+        )
+
+    def _init_database(self):
+        """Создание таблицы векторов и триггеров, сбрасывающих устаревшие векторы"""
+        with self.memory._connection() as conn:
+            cursor = conn.cursor()
+
+            # AUTOINCREMENT: id не переиспользуются, поэтому (COUNT, MAX(id)) меняется при любом изменении таблицы
+            cursor.execute("""
+                CREATE TABLE IF NOT EXISTS memory_vectors (
+                    id INTEGER PRIMARY KEY AUTOINCREMENT,
+                    memory_id INTEGER UNIQUE NOT NULL,
+                    model TEXT NOT NULL,
+                    vector BLOB NOT NULL
+                )
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS memory_vectors_stale AFTER UPDATE OF key, value ON memories BEGIN
+                    DELETE FROM memory_vectors WHERE memory_id = old.id;
+                END
+            """)
+            cursor.execute("""
+                CREATE TRIGGER IF NOT EXISTS memory_vectors_delete AFTER DELETE ON memories BEGIN
+                    DELETE FROM memory_vectors WHERE memory_id = old.id;
+                END
+            """)
+
+    # ==================== ИНДЕКСАЦИЯ ====================
+
+    def _vector(self, text: str, kind: str) -> np.ndarray:
+        """Эмбеддинг текста выбранной моделью"""
+        if self.embed is None:
+            return local_embedding(text, self.dim)
+        return normalize(self.embed(text, kind))
+
+    def index_pending(self) -> int:
+        """
+        Построить векторы записей памяти, у которых их нет (новые, измененные
+        или проиндексированные другой моделью). Возвращает число новых векторов
+        """
+        with self.memory._connection() as conn:
+            pending = conn.execute("""
+                SELECT m.id, m.key, m.value FROM memories m
+                LEFT JOIN memory_vectors v ON v.memory_id = m.id AND v.model = ?
+                WHERE v.memory_id IS NULL
+                LIMIT ?
+            """, (self.model, self.max_pending)).fetchall()
+
+        rows, errors, last_error = [], 0, None
+        for memory_id, key, value in pending:
+            try:
+                rows.append((memory_id, self.model, self._vector(memory_text(key, value), 'doc').tobytes()))
+            except Exception as e:
+                # Запись без вектора попробуем проиндексировать при следующем поиске
+                errors += 1
+                last_error = f"{key}: {e}"
+
+        if rows:
+            with self.memory._connection() as conn:
+                # Удаление и вставка вместо обновления: новый id меняет сигнатуру таблицы
+                conn.executemany("DELETE FROM memory_vectors WHERE memory_id = ?", [(row[0],) for row in rows])
+                conn.executemany("INSERT INTO memory_vectors (memory_id, model, vector) VALUES (?, ?, ?)", rows)
+
+        with self._lock:
+            self._stats['embedded'] += len(rows)
+            self._stats['embed_errors'] += errors
+            if last_error:
+                self._stats['last_error'] = last_error
+        return len(rows)
+
+    def schedule_indexing(self):
+        """Проиндексировать записи без векторов в фоновом потоке (если он еще не запущен)"""
+        with self._lock:
+            if self._indexing:
+                return
+            self._indexing = True
+            self._indexing_done.clear()
+        threading.Thread(target=self._index_in_background, name="memory-indexing", daemon=True).start()
+
+    def _index_in_background(self):
+        try:
+            # Полная пачка - записей без векторов может быть больше; при ошибках API пачка неполная
+            while self.index_pending() == self.max_pending:
+                pass
+        finally:
+            with self._lock:
+                self._indexing = False
+            self._indexing_done.set()
+
+    def wait_for_indexing(self, timeout: Optional[float] = None) -> bool:
+        """Дождаться завершения фоновой индексации; False - если не дождались"""
+        return self._indexing_done.wait(timeout)
+
+    def _load(self) -> Tuple[np.ndarray, np.ndarray]:
+        """Матрица векторов текущей модели; перечитывается, только если таблица изменилась"""
+        with self.memory._connection() as conn:
+            signature = tuple(conn.execute("SELECT COUNT(*), COALESCE(MAX(id), 0) FROM memory_vectors").fetchone())
+
+            with self._lock:
+                if signature == self._signature:
+                    return self._ids, self._matrix
+
+            rows = conn.execute("SELECT memory_id, vector FROM memory_vectors WHERE model = ?",
+                                (self.model,)).fetchall()
+
+        ids = np.array([row[0] for row in rows], dtype=np.int64)
+        if rows:
+            matrix = np.vstack([np.frombuffer(row[1], dtype=np.float32) for row in rows])
+        else:
+            matrix = np.empty((0, self.dim), dtype=np.float32)
+
+        with self._lock:
+            self._ids, self._matrix, self._signature = ids, matrix, signature
+            self._stats['reloads'] += 1
+        return ids, matrix
+
+    # ==================== ПОИСК ====================
+
+    def search(self, query: str, top_k: int = 5, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Записи памяти, ближайшие к запросу по косинусной близости
+
+        Returns:
+            [(id записи memories, близость)] по убыванию близости
+        """
+        start_time = time.time()
+        if self.embed is None:
+            self.index_pending()
+        else:
+            # Новые записи найдутся, когда фоновая индексация построит их векторы
+            self.schedule_indexing()
+        ids, matrix = self._load()
+        if not len(ids) or not query.strip():
+            return []
+
+        try:
+            query_vector = self._vector(query, 'query')
+        except Exception as e:
+            # Без вектора запроса векторы записей (той же модели) сравнивать не с чем:
+            # поиск пуст, причина видна в get_stats()
+            with self._lock:
+                self._stats['embed_errors'] += 1
+                self._stats['last_error'] = f"query: {e}"
+            return []
+
+        scores = matrix @ query_vector
+        top_k = min(top_k, len(ids))
+        best = np.argpartition(-scores, top_k - 1)[:top_k]
+        best = best[np.argsort(-scores[best], kind='stable')]
+        found = [(int(ids[i]), float(scores[i])) for i in best if scores[i] >= min_score]
+
+        with self._lock:
+            self._stats['searches'] += 1
+            self._stats['last_search_ms'] = round((time.time() - start_time) * 1000, 2)
+        return found
+
+    def relevant(self, query: str, token_budget: int, count_tokens: Callable[[str], int],
+                 top_k: int = 5, min_score: float = 0.0) -> List[Dict[str, Any]]:
+        """
+        Самые близкие к запросу записи памяти, суммарно не больше token_budget токенов
+
+        Returns:
+            [{'key', 'value', 'category', 'score', 'text'}] по убыванию близости
+        """
+        found = self.search(query, top_k=top_k, min_score=min_score)
+        if not found:
+            return []
+
+        scores = dict(found)
+        with self.memory._connection() as conn:
+            cursor = conn.execute(f"""
+                SELECT id, key, value, category FROM memories
+                WHERE id IN ({', '.join('?' * len(scores))})
+            """, list(scores))
+            rows = {row['id']: (row['key'], row['value'], row['category']) for row in cursor.fetchall()}
+
+        selected, used_tokens = [], 0
+        for memory_id, score in found:
+            if memory_id not in rows:
+                continue  # запись удалена после загрузки матрицы
+            key, value, category = rows[memory_id]
+            text = memory_text(key, value)
+            tokens = count_tokens(text)
+            if used_tokens + tokens > token_budget:
+                continue  # менее близкая, но короткая запись еще может поместиться
+            used_tokens += tokens
+            selected.append({'key': key, 'value': value, 'category': category,
+                             'score': round(score, 4), 'text': text})
+        return selected
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику индекса"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['vectors'] = len(self._ids)
+        stats['model'] = self.model
+        return stats
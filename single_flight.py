@@ -0,0 +1,119 @@
+"""
+Объединение одинаковых запросов к LLM, выполняющихся одновременно
+(single-flight): пока запрос в полете, повторные вызовы ждут его результат
+"""
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+
+
+class InFlightCall:
+    """Запрос в полете: результат или ошибка, общие для всех ожидающих"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.aborted = False
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Single-flight слой для потоков одного воркера.
+
+    Первый вызов с ключом становится ведущим и выполняет запрос, остальные
+    ждут его результат. Число ожидающих на ключ ограничено: сверх лимита
+    вызов выполняется самостоятельно, чтобы один медленный запрос не
+    собирал за собой неограниченную очередь.
+    """
+
+    def __init__(self, max_waiters: int = 32):
+        """
+        Args:
+            max_waiters: максимум вызовов, ожидающих один запрос
+        """
+        self.max_waiters = max_waiters
+        self._calls: Dict[str, InFlightCall] = {}
+        self._lock = threading.Lock()
+        self._stats = {
+            'leaders': 0,
+            'coalesced': 0,
+            'overflow': 0
+        }
+
+    def acquire(self, key: str) -> Tuple[Optional[InFlightCall], bool]:
+        """
+        Зарегистрировать вызов
+
+        Returns:
+            (call, True) - вызов ведущий и должен завершить call через complete()/abort();
+            (call, False) - нужно дождаться call.done и взять результат из call;
+            (None, False) - лимит ожидающих исчерпан, выполнить запрос самостоятельно
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is None:
+                call = InFlightCall()
+                self._calls[key] = call
+                self._stats['leaders'] += 1
+                return call, True
+
+            if call.waiters >= self.max_waiters:
+                self._stats['overflow'] += 1
+                return None, False
+
+            call.waiters += 1
+            self._stats['coalesced'] += 1
+            return call, False
+
+    def complete(self, key: str, call: InFlightCall, result: Any = None,
+                 error: Optional[BaseException] = None):
+        """Опубликовать результат ведущего вызова и разбудить ожидающих"""
+        call.result = result
+        call.error = error
+        self._release(key, call)
+
+    def abort(self, key: str, call: InFlightCall):
+        """Ведущий вызов прерван без результата: ожидающие выполнят запрос сами"""
+        call.aborted = True
+        self._release(key, call)
+
+    def _release(self, key: str, call: InFlightCall):
+        with self._lock:
+            if self._calls.get(key) is call:
+                del self._calls[key]
+        call.done.set()
+
+    def do(self, key: str, fn: Callable[[], Any]) -> Any:
+        """Выполнить fn() или дождаться результата такого же запроса в полете"""
+        call, is_leader = self.acquire(key)
+
+        if call is None:
+            return fn()
+
+        if not is_leader:
+            call.done.wait()
+            if call.aborted:
+                return fn()
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            result = fn()
+        except Exception as e:
+            self.complete(key, call, error=e)
+            raise
+        except BaseException:
+            self.abort(key, call)
+            raise
+        self.complete(key, call, result=result)
+        return result
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику объединения запросов"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['in_flight'] = len(self._calls)
+        stats['max_waiters'] = self.max_waiters
+        return stats
@@ -330,6 +330,70 @@ function removeLoading() {
     }
 }
 
+// Чтение потокового ответа NDJSON: по одному JSON-событию на строку
+async function readNDJSONStream(response, onEvent) {
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder();
+    let buffer = '';
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+
+        buffer += decoder.decode(value, { stream: true });
+        let newlineIndex;
+        while ((newlineIndex = buffer.indexOf('\n')) >= 0) {
+            const line = buffer.slice(0, newlineIndex).trim();
+            buffer = buffer.slice(newlineIndex + 1);
+            if (line) {
+                onEvent(JSON.parse(line));
+            }
+        }
+    }
+
+    if (buffer.trim()) {
+        onEvent(JSON.parse(buffer));
+    }
+}
+
+// Потоковый ответ чата: текст появляется по мере генерации,
+// после завершения заменяется отформатированным сообщением
+async function renderChatStream(response) {
+    let streamingDiv = null;
+    let streamingContent = null;
+    let text = '';
+
+    await readNDJSONStream(response, (event) => {
+        if (event.delta) {
+            if (!streamingDiv) {
+                removeLoading();
+                streamingDiv = document.createElement('div');
+                streamingDiv.className = 'message assistant';
+                streamingContent = document.createElement('div');
+                streamingContent.className = 'message-content';
+                streamingDiv.appendChild(streamingContent);
+                chatMessages.appendChild(streamingDiv);
+            }
+            text += event.delta;
+            streamingContent.textContent = text;
+            chatMessages.scrollTop = chatMessages.scrollHeight;
+        } else if (event.done) {
+            removeLoading();
+            if (streamingDiv) {
+                streamingDiv.remove();
+            }
+            addMessage(event.response, false);
+        } else if (event.error) {
+            removeLoading();
+            if (streamingDiv) {
+                streamingDiv.remove();
+            }
+            addMessage(`Ошибка: ${event.error}`, false);
+        }
+    });
+    removeLoading();
+}
+
 async function solveTask(method) {
     const task = taskInput.value.trim();
     if (!task) {
@@ -350,13 +414,26 @@ async function solveTask(method) {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ task: task, method: method })
+            body: JSON.stringify({ task: task, method: method, stream: true })
         });
 
-        const data = await response.json();
-
         if (response.ok) {
-            displayReasoningResults(data);
+            // Показываем результаты по мере генерации
+            const partialResults = {};
+            const partialTimings = {};
+            await readNDJSONStream(response, (event) => {
+                if (event.done) {
+                    displayReasoningResults(event);
+                } else if (event.method) {
+                    if (event.result !== undefined) {
+                        partialResults[event.method] = event.result;
+                        partialTimings[event.method] = event.elapsed;
+                    } else {
+                        partialResults[event.method] = (partialResults[event.method] || '') + event.delta;
+                    }
+                    displayReasoningResults({ task: task, results: partialResults, timings: partialTimings });
+                }
+            });
 
             // Очищаем поле ввода после успешного решения
             taskInput.value = '';
@@ -366,6 +443,7 @@ async function solveTask(method) {
                 loadReasoningHistory();
             }, 3000);
         } else {
+            const data = await response.json();
             reasoningResults.innerHTML = `<div class="error">Ошибка: ${data.error || 'Неизвестная ошибка'}</div>`;
         }
     } catch (error) {
@@ -392,7 +470,8 @@ function displayReasoningResults(data) {
 
     for (const [method, result] of Object.entries(data.results)) {
         html += '<div class="result-card">';
-        html += `<h4>${methodNames[method] || method}</h4>`;
+        const elapsed = data.timings && data.timings[method] !== undefined ? ` ⏱️ ${data.timings[method]}s` : '';
+        html += `<h4>${methodNames[method] || method}${elapsed}</h4>`;
         html += '<div class="result-content">';
         html += `<pre>${escapeHtml(result)}</pre>`;
         html += '</div>';
@@ -596,6 +675,27 @@ function displayTemperatureResults(data) {
 
     html += '</div>';
 
+    // Статистика разнообразия по сетке температур
+    if (data.sweep && data.sweep.length) {
+        html += '<div class="temperature-sweep">';
+        html += `<h3>📈 Разнообразие ответов (прогонов на температуру: ${data.samples}, время: ${data.total_time}s)</h3>`;
+        html += '<table class="sweep-table">';
+        html += '<thead><tr><th>Температура</th><th>Средняя длина</th><th>Разброс длины (σ)</th><th>distinct-1</th><th>distinct-2</th></tr></thead>';
+        html += '<tbody>';
+        data.sweep.forEach(point => {
+            html += '<tr>';
+            html += `<td>${point.temperature}</td>`;
+            html += `<td>${point.stats.length_mean}</td>`;
+            html += `<td>${point.stats.length_std}</td>`;
+            html += `<td>${point.stats.distinct_1}</td>`;
+            html += `<td>${point.stats.distinct_2}</td>`;
+            html += '</tr>';
+        });
+        html += '</tbody>';
+        html += '</table>';
+        html += '</div>';
+    }
+
     // Рекомендации
     html += '<div class="temperature-recommendations">';
     html += '<h3>💡 Рекомендации по использованию</h3>';
@@ -1115,15 +1215,21 @@ async function sendMessage() {
     try {
         // Выбираем endpoint в зависимости от режима
         const endpoint = currentMode === 'recommend' ? '/recommend' : '/chat';
+        const useStreaming = endpoint === '/chat';
 
         const response = await fetch(endpoint, {
             method: 'POST',
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ message: message })
+            body: JSON.stringify({ message: message, stream: useStreaming })
         });
 
+        if (useStreaming && response.ok) {
+            await renderChatStream(response);
+            return;
+        }
+
         const data = await response.json();
 
         removeLoading();
@@ -1542,10 +1648,42 @@ async function sendCompressionMessage(action) {
             headers: {
                 'Content-Type': 'application/json',
             },
-            body: JSON.stringify({ message, action })
+            body: JSON.stringify({ message, action, stream: action === 'send' })
         });
 
-        const data = await response.json();
+        let data;
+        if (action === 'send' && response.ok) {
+            // Потоковый ответ: показываем текст по мере генерации
+            let streamingContent = null;
+            let text = '';
+            await readNDJSONStream(response, (event) => {
+                if (event.delta) {
+                    if (!streamingContent) {
+                        loadingDiv.remove();
+                        addCompressionMessage('', false);
+                        streamingContent = compressionMessages.lastElementChild.querySelector('.message-content');
+                    }
+                    text += event.delta;
+                    streamingContent.textContent = text;
+                    compressionMessages.scrollTop = compressionMessages.scrollHeight;
+                } else if (event.done || event.error) {
+                    data = event;
+                }
+            });
+            if (streamingContent) {
+                streamingContent.parentElement.remove();
+            }
+            if (data && data.error) {
+                loadingDiv.remove();
+                addCompressionMessage(`❌ Ошибка: ${data.error}`, false);
+                return;
+            }
+            if (!data) {
+                throw new Error('Поток ответа прервался');
+            }
+        } else {
+            data = await response.json();
+        }
 
         // Удаляем индикатор загрузки
         loadingDiv.remove();
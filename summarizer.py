@@ -0,0 +1,200 @@
+"""
+Суммаризация истории диалога без вызова LLM и подготовка текста для модели
+Экстрактивное summary (TF-IDF + TextRank), очистка summary от вопросов
+и разбиение длинного текста на фрагменты для map-reduce суммаризации
+"""
+import re
+import threading
+from typing import Any, Callable, Dict, List, Optional
+
+import numpy as np
+
+
+# Вводные фразы, которые модель суммаризации ставит в начало ответа
+UNWANTED_PHRASES = [
+    "Перечисли основные моменты предыдущего диалога.",
+    "Основные моменты:",
+    "Резюме:",
+    "Краткое резюме:",
+    "В диалоге обсуждались следующие темы:",
+    "Пользователь спросил",
+    "Обсуждались темы:",
+    "В предыдущем диалоге:",
+    "Факты из диалога:",
+]
+
+# Предложения, начинающиеся с вопросительных слов, в summary не попадают
+QUESTION_WORDS = ['как', 'какой', 'какая', 'какие', 'почему', 'зачем', 'где',
+                  'куда', 'когда', 'чем', 'кто', 'что', 'нужно ли', 'следует ли',
+                  'можно ли', 'стоит ли']
+
+# Модальные слова - признак предложения задачи, а не факта
+MODAL_WORDS = ['нужно', 'следует', 'необходимо', 'стоит', 'давайте']
+
+SENTENCE_SPLIT = re.compile(r'(?<=[.!?])\s+|\n+')
+WORD = re.compile(r'\w+')
+
+
+def split_by_tokens(text: str, max_tokens: int, count_tokens: Callable[[str], int]) -> List[str]:
+    """
+    Разбить текст на фрагменты не больше max_tokens токенов.
+    Границы - абзацы, внутри слишком длинного абзаца - предложения,
+    внутри слишком длинного предложения - слова. Фрагменты собираются
+    жадно от начала, поэтому при дописывании текста начальные фрагменты
+    не меняются.
+    """
+    pieces = []
+    for paragraph in re.split(r'\n\s*\n', text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph) <= max_tokens:
+            pieces.append(paragraph)
+            continue
+        for sentence in re.split(r'(?<=[.!?])\s+', paragraph):
+            if count_tokens(sentence) <= max_tokens:
+                pieces.append(sentence)
+                continue
+            words = sentence.split()
+            step = max(1, len(words) * max_tokens // count_tokens(sentence))
+            pieces.extend(' '.join(words[start:start + step]) for start in range(0, len(words), step))
+
+    chunks = []
+    current, current_tokens = [], 0
+    for piece in pieces:
+        tokens = count_tokens(piece)
+        if current and current_tokens + tokens > max_tokens:
+            chunks.append('\n\n'.join(current))
+            current, current_tokens = [], 0
+        current.append(piece)
+        current_tokens += tokens
+    if current:
+        chunks.append('\n\n'.join(current))
+    return chunks
+
+
+def is_statement(sentence: str) -> bool:
+    """Утвердительное предложение без вопроса и без предложения задачи"""
+    if '?' in sentence:
+        return False
+    lower_sentence = sentence.lower()
+    if any(lower_sentence.startswith(word) for word in QUESTION_WORDS):
+        return False
+    return not any(word in lower_sentence for word in MODAL_WORDS)
+
+
+def clean_summary(summary: str) -> str:
+    """Убрать вводные фразы и все предложения, кроме утвердительных"""
+    for phrase in UNWANTED_PHRASES:
+        if summary.lower().startswith(phrase.lower()):
+            summary = summary[len(phrase):].strip()
+            # Удаляем начальные двоеточия и точки после удаления фразы
+            summary = summary.lstrip(':. ')
+
+    # КРИТИЧЕСКИ ВАЖНО: Удаляем ВСЕ предложения с вопросами
+    sentences = [sentence.strip() for sentence in summary.split('.')]
+    summary = '. '.join(sentence for sentence in sentences if sentence and is_statement(sentence))
+    if summary and not summary.endswith('.'):
+        summary += '.'
+    return summary
+
+
+class ExtractiveSummarizer:
+    """
+    Локальное экстрактивное summary: из текста выбираются самые
+    центральные утвердительные предложения.
+
+    Предложения представляются векторами TF-IDF, по косинусной близости
+    строится граф, вес предложения - его TextRank. Выбранные предложения
+    выводятся в исходном порядке. Работает за миллисекунды и ничего не стоит,
+    но не перефразирует текст.
+    """
+
+    def __init__(self, min_words: int = 3, damping: float = 0.85, iterations: int = 50):
+        """
+        Args:
+            min_words: предложения короче (пункты списков, заголовки) не выбираются
+            damping: коэффициент затухания TextRank
+            iterations: максимум итераций степенного метода
+        """
+        self.min_words = min_words
+        self.damping = damping
+        self.iterations = iterations
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'calls': 0,
+            'sentences': 0
+        }
+
+    def split_sentences(self, text: str) -> List[str]:
+        """Утвердительные предложения текста без разметки списков"""
+        sentences = []
+        for sentence in SENTENCE_SPLIT.split(text):
+            sentence = sentence.strip().lstrip('-*•#> ').replace('**', '').strip()
+            if len(WORD.findall(sentence)) >= self.min_words and is_statement(sentence):
+                sentences.append(sentence)
+        return sentences
+
+    def rank(self, sentences: List[str]) -> np.ndarray:
+        """TextRank предложений по графу косинусной близости TF-IDF"""
+        documents = [[word for word in WORD.findall(sentence.lower()) if len(word) > 2]
+                     for sentence in sentences]
+        vocabulary = {word: index for index, word in
+                      enumerate(sorted({word for words in documents for word in words}))}
+        count = len(sentences)
+        if not vocabulary:
+            return np.full(count, 1.0 / count)
+
+        tf = np.zeros((count, len(vocabulary)))
+        for row, words in enumerate(documents):
+            for word in words:
+                tf[row, vocabulary[word]] += 1
+
+        document_frequency = (tf > 0).sum(axis=0)
+        idf = np.log((1 + count) / (1 + document_frequency)) + 1
+        vectors = tf * idf
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors = np.divide(vectors, norms, out=np.zeros_like(vectors), where=norms > 0)
+
+        similarity = vectors @ vectors.T
+        np.fill_diagonal(similarity, 0.0)
+        out_weight = similarity.sum(axis=1, keepdims=True)
+        # Предложение без связей голосует за все поровну
+        transition = np.divide(similarity, out_weight, out=np.full_like(similarity, 1.0 / count),
+                               where=out_weight > 0)
+
+        scores = np.full(count, 1.0 / count)
+        for _ in range(self.iterations):
+            updated = (1 - self.damping) / count + self.damping * (transition.T @ scores)
+            converged = np.abs(updated - scores).sum() < 1e-6
+            scores = updated
+            if converged:
+                break
+        return scores
+
+    def summarize(self, text: str, max_sentences: int = 3) -> Optional[str]:
+        """
+        Summary из max_sentences самых центральных предложений текста
+
+        Returns:
+            Текст summary или None, если в тексте нет подходящих предложений
+        """
+        sentences = self.split_sentences(text)
+        with self._lock:
+            self._stats['calls'] += 1
+            self._stats['sentences'] += len(sentences)
+        if not sentences:
+            return None
+
+        if len(sentences) > max_sentences:
+            scores = self.rank(sentences)
+            selected = sorted(np.argsort(-scores, kind='stable')[:max_sentences])
+            sentences = [sentences[index] for index in selected]
+
+        return ' '.join(sentence if sentence[-1] in '.!' else sentence + '.' for sentence in sentences)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику вызовов"""
+        with self._lock:
+            return dict(self._stats)
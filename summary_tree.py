@@ -0,0 +1,115 @@
+"""
+Иерархические скользящие summary истории диалога
+Старые summary объединяются в summary более высокого уровня, а не отбрасываются
+"""
+import threading
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+
+class SummaryTree:
+    """
+    Дерево summary истории диалога.
+
+    Каждая компрессия добавляет summary уровня 0 (фрагмент истории).
+    Как только в конце списка набирается fanout summary одного уровня,
+    они объединяются в одно summary следующего уровня - заново
+    суммаризируется только эта ветка. Если суммарный размер превышает
+    budget_tokens, два самых старых summary объединяются, пока размер не
+    уложится в бюджет: самые старые факты сжимаются сильнее всего, но не
+    теряются.
+
+    Узел - словарь {'level', 'text', 'tokens', 'messages'}, список узлов
+    упорядочен от старых к новым. Методы не изменяют переданный список,
+    поэтому его можно строить вне блокировки и подменять атомарно.
+    """
+
+    def __init__(self, summarize: Callable[[Sequence[str]], Optional[str]],
+                 count_tokens: Callable[[str], int],
+                 fanout: int = 4, budget_tokens: int = 800):
+        """
+        Args:
+            summarize: объединение нескольких summary в одно (None - не удалось)
+            count_tokens: подсчет токенов текста
+            fanout: сколько summary одного уровня объединять в summary следующего
+            budget_tokens: максимальный суммарный размер summary (токенов)
+        """
+        self.summarize = summarize
+        self.count_tokens = count_tokens
+        self.fanout = max(2, fanout)
+        self.budget_tokens = budget_tokens
+
+        self._lock = threading.Lock()
+        self._stats = {
+            'merges': 0,
+            'budget_merges': 0,
+            'failed_merges': 0
+        }
+
+    def make_node(self, text: str, messages: int, level: int = 0) -> Dict[str, Any]:
+        """Узел summary, покрывающий messages сообщений"""
+        return {'level': level, 'text': text, 'tokens': self.count_tokens(text), 'messages': messages}
+
+    def add(self, nodes: List[Dict[str, Any]], text: str, messages: int) -> List[Dict[str, Any]]:
+        """
+        Добавить summary нового фрагмента истории
+
+        Args:
+            nodes: текущие узлы (не изменяются)
+            text: summary фрагмента
+            messages: сколько сообщений покрывает фрагмент
+
+        Returns:
+            Новый список узлов
+        """
+        nodes = list(nodes) + [self.make_node(text, messages)]
+
+        # Слияние ветки: fanout последних узлов одного уровня -> один узел уровнем выше
+        while len(nodes) >= self.fanout:
+            tail = nodes[-self.fanout:]
+            level = tail[0]['level']
+            if any(node['level'] != level for node in tail):
+                break
+            merged = self._merge(tail, level + 1)
+            if merged is None:
+                break
+            nodes = nodes[:-self.fanout] + [merged]
+            self._count('merges')
+
+        # Бюджет: сильнее сжимаем самые старые summary
+        while len(nodes) > 1 and self.total_tokens(nodes) > self.budget_tokens:
+            merged = self._merge(nodes[:2], max(nodes[0]['level'], nodes[1]['level']) + 1)
+            if merged is None:
+                break
+            nodes = [merged] + nodes[2:]
+            self._count('budget_merges')
+
+        return nodes
+
+    def _merge(self, nodes: List[Dict[str, Any]], level: int) -> Optional[Dict[str, Any]]:
+        """Объединить узлы в один; None - суммаризация не удалась, узлы остаются как есть"""
+        text = self.summarize([node['text'] for node in nodes])
+        if not text:
+            self._count('failed_merges')
+            return None
+        return self.make_node(text, sum(node['messages'] for node in nodes), level)
+
+    @staticmethod
+    def render(nodes: List[Dict[str, Any]]) -> str:
+        """Текст контекста: summary от старых к новым"""
+        return " ".join(node['text'] for node in nodes)
+
+    @staticmethod
+    def total_tokens(nodes: List[Dict[str, Any]]) -> int:
+        return sum(node['tokens'] for node in nodes)
+
+    def _count(self, name: str):
+        with self._lock:
+            self._stats[name] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить счетчики слияний"""
+        with self._lock:
+            stats = dict(self._stats)
+        stats['fanout'] = self.fanout
+        stats['budget_tokens'] = self.budget_tokens
+        return stats
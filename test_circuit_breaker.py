@@ -0,0 +1,95 @@
+"""
+Тест предохранителя (circuit breaker) для вызовов LLM API
+"""
+import time
+from circuit_breaker import CircuitBreaker, CircuitOpenError
+
+
+def expect_open(breaker):
+    """Проверить, что вызов отклоняется сразу"""
+    try:
+        breaker.before_call()
+    except CircuitOpenError as e:
+        return e
+    assert False, "Ожидалось исключение CircuitOpenError"
+
+
+def test_circuit_breaker():
+    """Полный тест предохранителя"""
+    print("🧪 ТЕСТ ПРЕДОХРАНИТЕЛЯ")
+    print("=" * 60)
+
+    # Тест 1: ошибки ниже порога не размыкают предохранитель
+    print("\n1️⃣ Тест замкнутого состояния...")
+    breaker = CircuitBreaker('completion', min_requests=4, error_threshold=0.5,
+                             open_seconds=0.2, half_open_probes=2)
+    for failed in (False, True, False, False):
+        breaker.before_call()
+        breaker.record(0.1, failed=failed)
+    assert breaker.state == CircuitBreaker.CLOSED
+    print(f"   ✅ 1 ошибка из 4 - замкнут: {breaker.get_stats()}")
+
+    # Тест 2: доля ошибок выше порога размыкает
+    print("\n2️⃣ Тест размыкания по ошибкам...")
+    for _ in range(2):
+        breaker.before_call()
+        breaker.record(0.1, failed=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    error = expect_open(breaker)
+    assert error.status_code == 503 and error.upstream == 'completion' and error.retry_after > 0
+    assert breaker.get_stats()['rejected'] == 1
+    print(f"   ✅ Разомкнут, отказ: {error}")
+
+    # Тест 3: half_open - ограниченное число проб, успех замыкает
+    print("\n3️⃣ Тест пробных вызовов...")
+    time.sleep(0.25)
+    assert breaker.state == CircuitBreaker.HALF_OPEN
+    breaker.before_call()
+    breaker.before_call()
+    expect_open(breaker)  # третья проба не пропускается
+    breaker.record(0.1, failed=False)
+    breaker.record(0.1, failed=False)
+    assert breaker.state == CircuitBreaker.CLOSED
+    print("   ✅ Две успешные пробы замкнули предохранитель")
+
+    # Тест 4: ошибка пробы снова размыкает, отмененная проба возвращает слот
+    print("\n4️⃣ Тест неудачной пробы...")
+    for _ in range(4):
+        breaker.before_call()
+        breaker.record(0.1, failed=True)
+    time.sleep(0.25)
+    breaker.before_call()
+    breaker.cancel()
+    breaker.before_call()
+    breaker.before_call()
+    breaker.record(0.1, failed=True)
+    assert breaker.state == CircuitBreaker.OPEN
+    assert breaker.get_stats()['opened'] == 3
+    print("   ✅ Ошибка пробы снова разомкнула предохранитель")
+
+    # Тест 5: медленные вызовы тоже размыкают
+    print("\n5️⃣ Тест размыкания по задержке...")
+    slow = CircuitBreaker('agents', min_requests=3, slow_call_seconds=1.0, slow_call_threshold=0.6)
+    for elapsed in (2.0, 1.5, 0.2):
+        slow.before_call()
+        slow.record(elapsed, failed=False)
+    assert slow.state == CircuitBreaker.OPEN
+    stats = slow.get_stats()
+    assert stats['slow_rate'] == round(2 / 3, 3) and stats['latency_p95'] > 1.0
+    print(f"   ✅ {stats}")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_circuit_breaker()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
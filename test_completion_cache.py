@@ -0,0 +1,97 @@
+"""
+Тест кэша детерминированных ответов LLM
+"""
+import os
+import time
+from completion_cache import CompletionCache
+
+
+def make_payload(text, temperature=0.0):
+    return {
+        "modelUri": "gpt://catalog/yandexgpt-lite/latest",
+        "completionOptions": {"stream": False, "temperature": temperature, "maxTokens": 2000},
+        "messages": [{"role": "user", "text": text}]
+    }
+
+
+def make_result(text):
+    return {"result": {"alternatives": [{"message": {"role": "assistant", "text": text}}]}}
+
+
+def test_completion_cache():
+    """Полный тест кэша ответов"""
+    print("🧪 ТЕСТ КЭША ОТВЕТОВ LLM")
+    print("=" * 60)
+
+    db_path = "test_llm_cache.db"
+    if os.path.exists(db_path):
+        os.remove(db_path)
+
+    cache = CompletionCache(db_path, max_memory_entries=2, max_entries=3, ttl_seconds=60)
+
+    # Тест 1: политика кэширования
+    print("\n1️⃣ Тест политики кэширования...")
+    assert cache.is_cacheable(make_payload("Матрица", 0.0))
+    assert not cache.is_cacheable(make_payload("Матрица", 0.7))
+    assert not cache.is_cacheable({"agentId": "agent", "messages": []})
+    print("   ✅ Кэшируются только запросы с temperature = 0")
+
+    # Тест 2: ключ не зависит от флага stream
+    print("\n2️⃣ Тест ключа кэша...")
+    streaming = make_payload("Матрица")
+    streaming["completionOptions"]["stream"] = True
+    assert cache.make_key(make_payload("Матрица")) == cache.make_key(streaming)
+    assert cache.make_key(make_payload("Матрица")) != cache.make_key(make_payload("Аватар"))
+    print("   ✅ Ключ зависит только от содержимого запроса")
+
+    # Тест 3: попадание в память и в SQLite
+    print("\n3️⃣ Тест попаданий...")
+    key = cache.make_key(make_payload("Матрица"))
+    assert cache.get(key) is None
+    cache.set(key, make_result("Фильм 1999 года"))
+    assert cache.get(key)["result"]["alternatives"][0]["message"]["text"] == "Фильм 1999 года"
+
+    restarted = CompletionCache(db_path, max_memory_entries=2, max_entries=3, ttl_seconds=60)
+    assert restarted.get(key) is not None, "Запись не сохранилась в SQLite"
+    stats = restarted.get_stats()
+    assert stats['db_hits'] == 1 and stats['memory_hits'] == 0
+    assert restarted.get(key) is not None
+    assert restarted.get_stats()['memory_hits'] == 1
+    print(f"   ✅ Статистика: {restarted.get_stats()}")
+
+    # Тест 4: вытеснение по размеру
+    print("\n4️⃣ Тест вытеснения по размеру...")
+    for i in range(5):
+        cache.set(cache.make_key(make_payload(f"Фильм {i}")), make_result(str(i)))
+    fresh = CompletionCache(db_path, max_memory_entries=2, max_entries=3, ttl_seconds=60)
+    assert fresh.get(cache.make_key(make_payload("Фильм 0"))) is None, "Старая запись не вытеснена"
+    assert fresh.get(cache.make_key(make_payload("Фильм 4"))) is not None
+    assert cache.get_stats()['evictions'] >= 3
+    print("   ✅ Лишние записи вытеснены")
+
+    # Тест 5: TTL
+    print("\n5️⃣ Тест времени жизни...")
+    short = CompletionCache(db_path, ttl_seconds=0.1)
+    short_key = short.make_key(make_payload("Короткая жизнь"))
+    short.set(short_key, make_result("..."))
+    time.sleep(0.2)
+    assert short.get(short_key) is None, "Устаревшая запись не удалена"
+    print("   ✅ Устаревшие записи не отдаются")
+
+    os.remove(db_path)
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_completion_cache()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
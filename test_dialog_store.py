@@ -0,0 +1,86 @@
+"""
+Тест хранилища состояния истории диалога по сессиям
+"""
+import os
+from dialog_store import DialogStateStore, DialogSessionCache
+from memory_service import MemoryService
+
+
+def test_dialog_store():
+    """Полный тест хранилища состояния диалога"""
+    print("🧪 ТЕСТ ХРАНИЛИЩА СОСТОЯНИЯ ДИАЛОГА")
+    print("=" * 60)
+
+    test_db = "test_dialog_store.db"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(test_db + suffix):
+            os.remove(test_db + suffix)
+
+    # Тест 1: сохранение и чтение
+    print("\n1️⃣ Тест сохранения состояния...")
+    memory = MemoryService(test_db)
+    store = DialogStateStore(memory)
+    assert store.version("s1") == 0 and store.load("s1") is None
+    state = {'messages': [{'role': 'user', 'text': 'Привет'}], 'full_tokens': 2}
+    assert store.save("s1", state, expected_version=0) == 1
+    assert store.load("s1") == (1, state)
+    print("   ✅ Состояние сохранено с версией 1")
+
+    # Тест 2: конфликт версий между двумя воркерами
+    print("\n2️⃣ Тест конфликта версий...")
+    worker_a = DialogStateStore(MemoryService(test_db))
+    worker_b = DialogStateStore(MemoryService(test_db))
+    assert worker_a.save("s1", dict(state, full_tokens=5), expected_version=1) == 2
+    assert worker_b.save("s1", dict(state, full_tokens=7), expected_version=1) is None
+    assert worker_b.save("s1", state, expected_version=0) is None  # запись уже есть
+    version, loaded = worker_b.load("s1")
+    assert version == 2 and loaded['full_tokens'] == 5
+    assert worker_b.get_stats()['conflicts'] == 2
+    print("   ✅ Устаревшая версия не перезаписывает чужое изменение")
+
+    # Тест 3: удаление
+    print("\n3️⃣ Тест удаления...")
+    assert store.delete("s1") and not store.delete("s1")
+    assert store.version("s1") == 0
+    opened = memory.get_pool_stats()['opened']
+    for _ in range(10):
+        store.version("s1")
+    assert memory.get_pool_stats()['opened'] == opened  # соединения из пула сервиса памяти
+    print("   ✅ Состояние сессии удалено")
+
+    # Тест 4: LRU менеджеров сессий
+    print("\n4️⃣ Тест кэша менеджеров...")
+    created = []
+    cache = DialogSessionCache(lambda session_id: created.append(session_id) or {'session': session_id},
+                               max_sessions=2)
+    first = cache.get("a")
+    assert cache.get("a") is first
+    cache.get("b")
+    cache.get("c")  # вытесняет "a"
+    cache.get("a")
+    assert created == ["a", "b", "c", "a"]
+    stats = cache.get_stats()
+    assert stats['hits'] == 1 and stats['evictions'] == 2 and stats['sessions'] == 2
+    cache.discard("a")
+    assert cache.get_stats()['sessions'] == 1
+    print(f"   ✅ {stats}")
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(test_db + suffix):
+            os.remove(test_db + suffix)
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_dialog_store()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,55 @@
+"""
+Тест статистики разнообразия ответов (эксперимент с температурой)
+"""
+from diversity_stats import diversity_stats
+
+
+def test_diversity_stats():
+    """Проверка длин и distinct-n по группам ответов"""
+    print("🧪 ТЕСТ СТАТИСТИКИ РАЗНООБРАЗИЯ")
+    print("=" * 60)
+
+    stats = diversity_stats({
+        '0.0': ["кот сидит на окне", "кот сидит на окне"],
+        '1.0': ["кот спит", "собака бежит по улице"],
+        '0.5': []
+    })
+
+    # Тест 1: одинаковые ответы - половина n-грамм повторяется
+    print("\n1️⃣ Тест одинаковых ответов...")
+    assert stats['0.0']['samples'] == 2
+    assert stats['0.0']['length_std'] == 0
+    assert stats['0.0']['distinct_1'] == 0.5
+    assert stats['0.0']['distinct_2'] == 0.5
+    print(f"   ✅ {stats['0.0']}")
+
+    # Тест 2: разные ответы - все n-граммы уникальны, биграммы не склеиваются между ответами
+    print("\n2️⃣ Тест разных ответов...")
+    assert stats['1.0']['distinct_1'] == 1.0
+    assert stats['1.0']['distinct_2'] == 1.0
+    assert stats['1.0']['length_min'] == len("кот спит")
+    assert stats['1.0']['length_max'] == len("собака бежит по улице")
+    assert stats['1.0']['length_std'] > 0
+    print(f"   ✅ {stats['1.0']}")
+
+    # Тест 3: пустая группа
+    print("\n3️⃣ Тест пустой группы...")
+    assert stats['0.5']['samples'] == 0
+    assert stats['0.5']['distinct_1'] == 0
+    print("   ✅ Пустая группа обработана")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_diversity_stats()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,120 @@
+"""
+Тест хеджирования медленных запросов к LLM
+"""
+import threading
+import time
+from hedging import Hedger
+from retry_policy import RetryBudget
+
+
+class FakeResponse:
+    """Минимальный ответ для проверки хеджирования без сети"""
+
+    def __init__(self, status_code=200, name=""):
+        self.status_code = status_code
+        self.name = name
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def warm_up(hedger, key, latency=0.05, count=20):
+    """Заполнить статистику задержек модели"""
+    for _ in range(count):
+        hedger.record(key, latency)
+
+
+def test_hedging():
+    """Полный тест хеджирования"""
+    print("🧪 ТЕСТ ХЕДЖИРОВАНИЯ ЗАПРОСОВ")
+    print("=" * 60)
+
+    # Тест 1: без статистики задержек второй запрос не отправляется
+    print("\n1️⃣ Тест холодного старта...")
+    hedger = Hedger(percentile=95, min_samples=20, min_delay=0.05,
+                    budget=RetryBudget(ratio=0.5, min_retries=2))
+    assert hedger.delay_for("yandexgpt/latest") is None
+    assert hedger.call("yandexgpt/latest", lambda: FakeResponse()).status_code == 200
+    assert hedger.get_stats()['hedged'] == 0
+    print("   ✅ Без замеров запрос выполняется как обычно")
+
+    # Тест 2: медленный первичный запрос обгоняет второй
+    print("\n2️⃣ Тест хеджирования медленного запроса...")
+    warm_up(hedger, "yandexgpt/latest")
+    assert abs(hedger.delay_for("yandexgpt/latest") - 0.05) < 1e-9
+    attempts = []
+    lock = threading.Lock()
+    slow_response = FakeResponse(name="slow")
+
+    def send():
+        with lock:
+            attempts.append(1)
+            first = len(attempts) == 1
+        if first:
+            time.sleep(0.5)
+            return slow_response
+        time.sleep(0.02)
+        return FakeResponse(name="fast")
+
+    start = time.monotonic()
+    response = hedger.call("yandexgpt/latest", send)
+    elapsed = time.monotonic() - start
+    assert response.name == "fast" and len(attempts) == 2
+    assert elapsed < 0.3, f"Хеджирование не сократило задержку: {elapsed:.3f} сек"
+    time.sleep(0.6)
+    assert slow_response.closed, "Ответ проигравшей попытки не закрыт"
+    stats = hedger.get_stats()
+    assert stats['hedged'] == 1 and stats['hedge_wins'] == 1
+    print(f"   ✅ Ответ за {elapsed:.3f} сек вместо 0.5, статистика: {stats}")
+
+    # Тест 3: если второй запрос упал, ждем первый
+    print("\n3️⃣ Тест ошибки второго запроса...")
+    hedger = Hedger(min_samples=20, min_delay=0.05, budget=RetryBudget(ratio=0.5, min_retries=2))
+    warm_up(hedger, "yandexgpt/latest")
+    calls = []
+
+    def flaky_send():
+        calls.append(1)
+        if len(calls) == 1:
+            time.sleep(0.2)
+            return FakeResponse(name="primary")
+        raise ConnectionError("reset")
+
+    assert hedger.call("yandexgpt/latest", flaky_send).name == "primary"
+    assert hedger.get_stats()['primary_wins'] == 1
+    print("   ✅ Победил первичный запрос")
+
+    # Тест 4: бюджет ограничивает долю вторых запросов
+    print("\n4️⃣ Тест бюджета...")
+    strict = Hedger(min_samples=1, min_delay=0.01, budget=RetryBudget(ratio=0.0, min_retries=0))
+    strict.record("yandexgpt-lite/latest", 0.01)
+    calls.clear()
+
+    def slow_send():
+        calls.append(1)
+        time.sleep(0.1)
+        return FakeResponse()
+
+    strict.call("yandexgpt-lite/latest", slow_send)
+    assert len(calls) == 1 and strict.get_stats()['budget_exhausted'] == 1
+    print("   ✅ Бюджет исчерпан - второй запрос не отправлен")
+
+    hedger.shutdown()
+    strict.shutdown()
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_hedging()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -111,11 +111,99 @@ def test_memory_service():
     print(f"      - Сохранено: '{persistence_value}'")
     print(f"      - Загружено: '{loaded_value}'")
 
+    # Тест 11: Пул соединений и WAL
+    print("\n1️⃣1️⃣ Тест пула соединений...")
+    with memory._connection() as conn:
+        assert conn.execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        assert conn.execute("PRAGMA synchronous").fetchone()[0] == 1  # NORMAL
+    opened = memory.get_pool_stats()['opened']
+    for _ in range(20):
+        memory.get_message_count(test_session_id)
+    pool_stats = memory.get_pool_stats()
+    assert pool_stats['opened'] == opened, "Соединения должны переиспользоваться"
+    # Чтение не ждет незавершенную транзакцию записи (WAL)
+    with memory._connection() as writer:
+        writer.execute("INSERT INTO memories (key, value) VALUES ('uncommitted', 'x')")
+        assert "uncommitted" not in [item['key'] for item in memory.list_all_memories()]
+        assert memory2.get_message_count(test_session_id) == 2
+    memory.delete_memory("uncommitted")
+    memory2.close()
+    assert memory2.get_pool_stats()['idle'] == 0
+    print(f"   ✅ {pool_stats}")
+
+    # Тест 12: Отложенная запись сообщений пакетами
+    print("\n1️⃣2️⃣ Тест отложенной записи...")
+    writer_service = MemoryService("test_memory.db", flush_interval_ms=200, batch_size=50)
+    for i in range(120):
+        assert writer_service.save_message(test_session_id, "user", f"Сообщение {i}", 1)
+    assert memory2.get_message_count(test_session_id) < 122  # запрос не ждал коммита
+    assert writer_service.flush(timeout=5)
+    assert memory2.get_message_count(test_session_id) == 122
+    write_stats = writer_service.get_write_stats()
+    assert write_stats['rows'] == 120 and write_stats['batches'] <= 4 and write_stats['pending'] == 0
+    assert writer_service.get_messages(test_session_id)[-1]['content'] == "Сообщение 119"
+    writer_service.save_message(test_session_id, "assistant", "Последнее", 1)
+    writer_service.close()  # при остановке очередь записывается
+    assert memory2.get_messages(test_session_id, limit=1)[0]['content'] == "Последнее"
+    # Режим full: сообщение на диске сразу после возврата
+    durable = MemoryService("test_memory.db", durability="full")
+    durable.save_message(test_session_id, "user", "Надежно", 1)
+    assert memory2.get_messages(test_session_id, limit=1)[0]['content'] == "Надежно"
+    print(f"   ✅ 120 сообщений записаны за {write_stats['batches']} транзакции")
+
+    # Тест 13: Полнотекстовый поиск
+    print("\n1️⃣3️⃣ Тест полнотекстового поиска...")
+    memory.save_message(test_session_id, "assistant", "Django - полнофункциональный веб-фреймворк для Python")
+    memory.save_message(test_session_id, "assistant", "Погода сегодня солнечная")
+    memory.save_memory("favorite_framework", "Пользователь выбрал фреймворк Django", "preferences")
+    memory.save_context(test_session_id, "search_topic", "сравнение фреймворков")
+    found = memory.search("фреймворк")
+    sources = {item['source'] for item in found['results']}
+    assert sources == {'message', 'memory', 'context'}, f"Найдено в {sources}"
+    assert all('<mark>' in item['snippet'] for item in found['results'])
+    both = memory.search("django фреймворк")['results']  # все слова запроса
+    assert [item['source'] for item in both] == ['message', 'memory']
+    assert memory.search("погода")['results'][0]['snippet'] == "<mark>Погода</mark> сегодня солнечная"
+    # Фильтры и страницы
+    assert {item['source'] for item in memory.search("фреймворк", session_id=test_session_id)['results']} == \
+        {'message', 'context'}
+    assert [item['key'] for item in memory.search("фреймворк", category="preferences")['results']] == \
+        ["favorite_framework"]
+    for filters in ({'session_id': test_session_id, 'category': "preferences"}, {'sources': ['files']}):
+        try:
+            memory.search("фреймворк", **filters)
+            assert False, f"Фильтры {filters} должны отклоняться"
+        except ValueError:
+            pass
+    page = memory.search("фреймворк", limit=2)
+    assert len(page['results']) == 2 and page['has_more']
+    assert not memory.search("фреймворк", limit=2, offset=2)['has_more']
+    # Индекс обновляется триггерами
+    memory.save_memory("favorite_framework", "Пользователь выбрал Flask", "preferences")
+    assert memory.search("django", category="preferences")['results'] == []
+    memory.delete_context(test_session_id, "search_topic")
+    assert 'context' not in {item['source'] for item in memory.search("фреймворк")['results']}
+    assert memory.search('"; DROP TABLE messages; --')['results'] == []  # синтаксис FTS5 экранирован
+    print(f"   ✅ {page['results'][0]['snippet']!r}")
+
+    # Тест 14: Текущая сессия общая для всех процессов
+    print("\n1️⃣4️⃣ Тест текущей сессии...")
+    memory.set_current_session(test_session_id)
+    assert MemoryService("test_memory.db").get_current_session() == test_session_id
+    other_session_id = f"test_{uuid.uuid4()}"
+    memory.create_session(other_session_id, "Другая сессия")
+    memory.set_current_session(other_session_id)
+    assert memory2.get_current_session() == other_session_id
+    memory.delete_session(other_session_id)
+    assert memory.get_current_session() is None  # удаленная сессия не остается текущей
+    print("   ✅ Переключение сессии видно другому экземпляру сервиса")
+
     # Очистка тестовых данных
     print("\n🧹 Очистка тестовых данных...")
     memory.delete_session(test_session_id)
     memory.delete_memory("user_info")
     memory.delete_memory(persistence_key)
+    memory.delete_memory("favorite_framework")
     print("   ✅ Тестовые данные удалены")
 
     print("\n" + "=" * 60)
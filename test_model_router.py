@@ -0,0 +1,69 @@
+"""
+Тест выбора модели по размеру контекста
+"""
+from model_router import ModelRouter
+
+
+MODELS = {
+    'yandexgpt-lite': {'context_window': 8000, 'pricing': {'input': 0.2, 'output': 0.6}},
+    'yandexgpt': {'context_window': 8000, 'pricing': {'input': 0.4, 'output': 1.2}},
+    'yandexgpt-32k': {'context_window': 32000, 'pricing': {'input': 0.8, 'output': 2.4}},
+    'summarization': {'context_window': 8000, 'routable': False, 'pricing': {'input': 0.1, 'output': 0.1}}
+}
+
+
+def test_model_router():
+    """Полный тест маршрутизатора моделей"""
+    print("🧪 ТЕСТ ВЫБОРА МОДЕЛИ ПО КОНТЕКСТУ")
+    print("=" * 60)
+
+    router = ModelRouter(MODELS, safety_margin=0.1)
+
+    # Тест 1: короткий запрос - самая дешевая модель (summarization не участвует)
+    print("\n1️⃣ Тест самой дешевой модели...")
+    decision = router.route(1000, 2000)
+    assert decision['model'] == 'yandexgpt-lite' and decision['reason'] == 'cheapest_fit'
+    assert decision['required_tokens'] == 1100 + 2000
+    print(f"   ✅ {decision}")
+
+    # Тест 2: длинный запрос - модель с большим окном
+    print("\n2️⃣ Тест длинного запроса...")
+    decision = router.route(6000, 2000)
+    assert decision['model'] == 'yandexgpt-32k' and decision['context_window'] == 32000
+    print(f"   ✅ 6000 + 2000 токенов -> {decision['model']}")
+
+    # Тест 3: предпочтительная модель используется, пока запрос в нее помещается
+    print("\n3️⃣ Тест предпочтительной модели...")
+    assert router.route(1000, 2000, preferred='yandexgpt')['reason'] == 'preferred'
+    decision = router.route(6000, 2000, preferred='yandexgpt')
+    assert decision['model'] == 'yandexgpt-32k' and decision['reason'] == 'escalated'
+    print("   ✅ Длинная история переходит в 32K модель")
+
+    # Тест 4: явный выбор без замены и слишком большой запрос
+    print("\n4️⃣ Тест явной модели и слишком большого запроса...")
+    assert router.check('yandexgpt', 1000, 2000)['reason'] == 'explicit'
+    decision = router.check('yandexgpt', 6000, 2000)
+    assert decision['model'] is None and decision['reason'] == 'too_large'
+    assert decision['context_window'] == 8000
+    assert router.route(40000, 2000)['reason'] == 'too_large'
+    print("   ✅ Запрос, который не помещается, не отправляется")
+
+    stats = router.get_stats()
+    assert stats['reasons']['too_large'] == 2 and stats['models']['yandexgpt-32k'] == 2
+    print(f"   ✅ Статистика: {stats}")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_model_router()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
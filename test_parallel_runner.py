@@ -0,0 +1,111 @@
+"""
+Тест параллельного выполнения вызовов LLM
+"""
+import time
+from parallel_runner import ParallelRunner
+
+
+def test_parallel_runner():
+    """Задачи выполняются параллельно, ошибки и время изолированы по задачам"""
+    print("🧪 ТЕСТ ПАРАЛЛЕЛЬНОГО ВЫПОЛНЕНИЯ")
+    print("=" * 60)
+
+    runner = ParallelRunner(max_workers=4)
+
+    def slow(value, delay):
+        time.sleep(delay)
+        return value
+
+    def failing():
+        raise ValueError("сбой")
+
+    # Тест 1: параллельный запуск
+    print("\n1️⃣ Тест параллельного запуска...")
+    start_time = time.time()
+    outcomes = runner.run({
+        'a': lambda: slow('A', 0.2),
+        'b': lambda: slow('B', 0.2),
+        'c': lambda: slow('C', 0.2),
+        'broken': failing
+    })
+    elapsed = time.time() - start_time
+    assert elapsed < 0.5, f"Задачи выполнялись последовательно: {elapsed:.2f}s"
+    assert list(outcomes) == ['a', 'b', 'c', 'broken'], "Порядок результатов нарушен"
+    assert outcomes['a']['result'] == 'A'
+    assert outcomes['a']['elapsed'] >= 0.2
+    print(f"   ✅ 3 задачи по 0.2s выполнены за {elapsed:.2f}s")
+
+    # Тест 2: изоляция ошибок
+    print("\n2️⃣ Тест изоляции ошибок...")
+    assert outcomes['broken']['result'] is None
+    assert outcomes['broken']['error'] == "сбой"
+    assert outcomes['b']['error'] is None
+    print("   ✅ Ошибка одной задачи не повлияла на остальные")
+
+    # Тест 3: ограничение параллелизма на вызов
+    print("\n3️⃣ Тест ограничения параллелизма...")
+    start_time = time.time()
+    runner.run({str(i): (lambda: slow(None, 0.1)) for i in range(4)}, max_concurrency=2)
+    elapsed = time.time() - start_time
+    assert elapsed >= 0.2, f"Ограничение не соблюдено: {elapsed:.2f}s"
+    print(f"   ✅ 4 задачи с лимитом 2 выполнены за {elapsed:.2f}s")
+
+    # Тест 4: слияние потоков
+    print("\n4️⃣ Тест слияния потоков...")
+
+    def stream(prefix):
+        for i in range(3):
+            yield f"{prefix}{i}"
+
+    items = {'x': [], 'y': []}
+    finished = []
+    for name, item, outcome in runner.merge_streams({'x': lambda: stream('x'), 'y': lambda: stream('y')}):
+        if outcome is None:
+            items[name].append(item)
+        else:
+            finished.append(name)
+    assert items == {'x': ['x0', 'x1', 'x2'], 'y': ['y0', 'y1', 'y2']}
+    assert sorted(finished) == ['x', 'y']
+    print("   ✅ Элементы обоих потоков получены в исходном порядке")
+
+    # Тест 5: потребитель закрыл генератор раньше времени
+    print("\n5️⃣ Тест отмены потоков...")
+    produced = []
+    closed = []
+
+    def long_stream(prefix):
+        try:
+            for i in range(30):
+                time.sleep(0.01)
+                produced.append(i)
+                yield f"{prefix}{i}"
+        finally:
+            closed.append(prefix)
+
+    merged = runner.merge_streams({'x': lambda: long_stream('x'), 'y': lambda: long_stream('y')})
+    next(merged)
+    merged.close()  # клиент отключился
+    time.sleep(0.1)
+    stopped_at = len(produced)
+    time.sleep(0.3)
+    assert len(produced) == stopped_at, "Потоки продолжили чтение после закрытия генератора"
+    assert sorted(closed) == ['x', 'y'], "Исходные генераторы должны быть закрыты"
+    print(f"   ✅ После закрытия прочитано всего {stopped_at} элементов из 60")
+
+    runner.shutdown()
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_parallel_runner()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,106 @@
+"""
+Тест ограничителя частоты запросов к моделям (token bucket)
+"""
+import threading
+import time
+from rate_limiter import RateLimiter, RateLimitExceeded, TokenBucket
+
+
+def test_rate_limiter():
+    """Полный тест ограничителя частоты"""
+    print("🧪 ТЕСТ ОГРАНИЧИТЕЛЯ ЧАСТОТЫ")
+    print("=" * 60)
+
+    # Тест 1: всплеск в пределах burst проходит без ожидания
+    print("\n1️⃣ Тест всплеска...")
+    bucket = TokenBucket(rate=20, burst=3, max_queue=10, max_wait=5)
+    waits = [bucket.acquire() for _ in range(3)]
+    assert waits == [0.0, 0.0, 0.0]
+    print("   ✅ 3 запроса прошли сразу")
+
+    # Тест 2: сверх burst запросы сглаживаются до rate
+    print("\n2️⃣ Тест сглаживания...")
+    start = time.monotonic()
+    for _ in range(4):
+        bucket.acquire()
+    elapsed = time.monotonic() - start
+    assert 0.15 <= elapsed < 0.5, f"4 запроса при 20 rps заняли {elapsed:.3f} сек"
+    stats = bucket.get_stats()
+    assert stats['acquired'] == 7 and stats['waited'] == 4 and stats['queue_depth'] == 0
+    print(f"   ✅ 4 запроса за {elapsed:.3f} сек, статистика: {stats}")
+
+    # Тест 3: переполненная очередь - быстрый отказ
+    print("\n3️⃣ Тест переполнения очереди...")
+    slow = TokenBucket(rate=5, burst=1, max_queue=2, max_wait=5)
+    slow.acquire()
+    rejected = []
+
+    def worker():
+        try:
+            slow.acquire()
+        except RateLimitExceeded as e:
+            rejected.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(rejected) == 2, f"Ожидалось 2 отказа, было {len(rejected)}"
+    assert all(e.status_code == 503 and e.retry_after > 0 for e in rejected)
+    print(f"   ✅ Отклонено {len(rejected)} запроса: {rejected[0]}")
+
+    # Тест 4: ожидание дольше max_wait отклоняется сразу
+    print("\n4️⃣ Тест максимального ожидания...")
+    strict = TokenBucket(rate=1, burst=1, max_queue=10, max_wait=0.5)
+    strict.acquire()
+    start = time.monotonic()
+    try:
+        strict.acquire()
+        assert False, "Ожидалось исключение RateLimitExceeded"
+    except RateLimitExceeded:
+        pass
+    assert time.monotonic() - start < 0.1
+    print("   ✅ Отказ без ожидания")
+
+    # Тест 5: отдельные ведра по моделям и лимиты из конфига
+    print("\n5️⃣ Тест лимитов по моделям...")
+    limiter = RateLimiter.from_config({
+        'rate_limits': {
+            'default': {'rps': 10},
+            'yandexgpt/latest': {'rps': 2, 'burst': 1}
+        },
+        'rate_limit_max_wait': 0.1
+    })
+    pro = {"modelUri": "gpt://b1gcatalog/yandexgpt/latest", "messages": []}
+    lite = {"modelUri": "gpt://b1gcatalog/yandexgpt-lite/latest", "messages": []}
+    assert RateLimiter.key_for(pro) == 'yandexgpt/latest'
+    assert RateLimiter.key_for({"agentId": "agent"}) == 'agents'
+    limiter.acquire(pro)
+    try:
+        limiter.acquire(pro)
+        assert False, "Ожидалось исключение RateLimitExceeded"
+    except RateLimitExceeded:
+        pass
+    for _ in range(5):
+        limiter.acquire(lite)
+    stats = limiter.get_stats()
+    assert stats['yandexgpt/latest']['rate'] == 2 and stats['yandexgpt/latest']['rejected'] == 1
+    assert stats['yandexgpt-lite/latest']['burst'] == 10
+    print(f"   ✅ Модели: {list(stats)}")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_rate_limiter()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
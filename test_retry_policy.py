@@ -0,0 +1,111 @@
+"""
+Тест политики повторов запросов к LLM
+"""
+import time
+import requests
+from retry_policy import RetryBudget, RetryPolicy
+
+
+class FakeResponse:
+    """Минимальный ответ для проверки политики без сети"""
+
+    def __init__(self, status_code, headers=None):
+        self.status_code = status_code
+        self.headers = headers or {}
+        self.closed = False
+
+    def close(self):
+        self.closed = True
+
+
+def sequence(*outcomes):
+    """send(), по очереди возвращающая ответы или выбрасывающая исключения"""
+    outcomes = list(outcomes)
+    calls = []
+
+    def send():
+        calls.append(1)
+        outcome = outcomes.pop(0)
+        if isinstance(outcome, Exception):
+            raise outcome
+        return outcome
+
+    return send, calls
+
+
+def test_retry_policy():
+    """Полный тест политики повторов"""
+    print("🧪 ТЕСТ ПОВТОРОВ ЗАПРОСОВ")
+    print("=" * 60)
+
+    # Тест 1: временные ошибки повторяются до успеха
+    print("\n1️⃣ Тест восстановления после сбоев...")
+    policy = RetryPolicy(max_attempts=3, base_delay=0.01)
+    send, calls = sequence(requests.exceptions.ConnectionError("reset"), FakeResponse(503), FakeResponse(200))
+    assert policy.call(send).status_code == 200
+    assert len(calls) == 3
+    stats = policy.get_stats()
+    assert stats['retries'] == 2 and stats['recovered'] == 1
+    assert stats['retry_reasons'] == {'ConnectionError': 1, 'HTTP 503': 1}
+    print(f"   ✅ Статистика: {stats}")
+
+    # Тест 2: неповторяемые статусы возвращаются сразу
+    print("\n2️⃣ Тест неповторяемых статусов...")
+    send, calls = sequence(FakeResponse(400))
+    assert policy.call(send).status_code == 400 and len(calls) == 1
+    print("   ✅ HTTP 400 не повторяется")
+
+    # Тест 3: после max_attempts возвращается последний ответ / ошибка
+    print("\n3️⃣ Тест исчерпания попыток...")
+    send, calls = sequence(FakeResponse(500), FakeResponse(500), FakeResponse(502))
+    assert policy.call(send).status_code == 502 and len(calls) == 3
+    send, calls = sequence(*[requests.exceptions.Timeout("slow")] * 3)
+    try:
+        policy.call(send)
+        assert False, "Ожидалось исключение Timeout"
+    except requests.exceptions.Timeout:
+        pass
+    assert policy.get_stats()['gave_up'] == 2
+    print("   ✅ Последняя ошибка передается вызывающему")
+
+    # Тест 4: Retry-After
+    print("\n4️⃣ Тест Retry-After...")
+    assert RetryPolicy.parse_retry_after(FakeResponse(429, {'Retry-After': '2'})) == 2.0
+    assert RetryPolicy.parse_retry_after(FakeResponse(429)) is None
+    honoring = RetryPolicy(max_attempts=2, base_delay=0.01, max_retry_after=1)
+    send, calls = sequence(FakeResponse(429, {'Retry-After': '0.2'}), FakeResponse(200))
+    start = time.monotonic()
+    assert honoring.call(send).status_code == 200
+    assert time.monotonic() - start >= 0.2
+    send, calls = sequence(FakeResponse(429, {'Retry-After': '120'}))
+    assert honoring.call(send).status_code == 429 and len(calls) == 1
+    print("   ✅ Задержка из Retry-After соблюдается, слишком долгая - не ждем")
+
+    # Тест 5: бюджет повторов
+    print("\n5️⃣ Тест бюджета повторов...")
+    budget = RetryBudget(ratio=0.25, min_retries=2)
+    limited = RetryPolicy(max_attempts=2, base_delay=0.001, budget=budget)
+    retried = 0
+    for _ in range(10):
+        send, calls = sequence(FakeResponse(503), FakeResponse(503))
+        limited.call(send)
+        retried += len(calls) - 1
+    assert retried == 4, f"Ожидалось 4 повтора (запас 2 + 2 накопленных из 0.25 на запрос), было {retried}"
+    assert limited.get_stats()['budget_exhausted'] == 6
+    print(f"   ✅ 10 запросов -> {retried} повтора, статистика: {limited.get_stats()}")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_retry_policy()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,119 @@
+"""
+Тест векторного поиска по долговременной памяти
+"""
+import os
+import sqlite3
+import threading
+import numpy as np
+from memory_service import MemoryService
+from semantic_memory import SemanticMemory, local_embedding
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_semantic_memory():
+    """Полный тест векторного поиска по памяти"""
+    print("🧪 ТЕСТ ВЕКТОРНОГО ПОИСКА ПО ПАМЯТИ")
+    print("=" * 60)
+
+    test_db = "test_semantic_memory.db"
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(test_db + suffix):
+            os.remove(test_db + suffix)
+
+    memory = MemoryService(test_db, durability="full")
+    memory.save_memory("favorite_framework", "Пользователь пишет на Django и любит веб-фреймворки", "preferences")
+    memory.save_memory("pet", "У пользователя есть кошка по имени Мурка", "personal")
+    memory.save_memory("favorite_movies", "Любимые фильмы пользователя - научная фантастика", "preferences")
+
+    # Тест 1: локальный эмбеддинг
+    print("\n1️⃣ Тест локального эмбеддинга...")
+    vector = local_embedding("веб-фреймворки для Python")
+    assert vector.dtype == np.float32 and abs(np.linalg.norm(vector) - 1) < 1e-5
+    assert np.array_equal(vector, local_embedding("веб-фреймворки для Python"))  # детерминирован
+    assert local_embedding("фреймворк") @ local_embedding("фреймворки") > \
+        local_embedding("фреймворк") @ local_embedding("кошка")
+    print("   ✅ Однокоренные слова ближе, чем несвязанные")
+
+    # Тест 2: поиск top-k
+    print("\n2️⃣ Тест поиска...")
+    index = SemanticMemory(memory)
+    found = index.search("какой фреймворк выбрать?", top_k=2)
+    conn = sqlite3.connect(test_db)
+    keys = dict(conn.execute("SELECT id, key FROM memories").fetchall())
+    conn.close()
+    assert keys[found[0][0]] == "favorite_framework"
+    assert found[0][1] > found[1][1]
+    assert index.get_stats()['embedded'] == 3 and index.get_stats()['vectors'] == 3
+    opened = memory.get_pool_stats()['opened']
+    index.search("фреймворк")
+    assert memory.get_pool_stats()['opened'] == opened  # соединения из пула сервиса памяти
+    print(f"   ✅ {[(keys[memory_id], round(score, 3)) for memory_id, score in found]}")
+
+    # Тест 3: бюджет токенов
+    print("\n3️⃣ Тест бюджета токенов...")
+    relevant = index.relevant("посоветуй фильм в жанре фантастика", token_budget=100, count_tokens=count_words,
+                              min_score=0.1)
+    assert relevant[0]['key'] == "favorite_movies"
+    assert index.relevant("фантастика", token_budget=3, count_tokens=count_words) == []
+    limited = index.relevant("фреймворк кошка фильмы", token_budget=12, count_tokens=count_words, top_k=3)
+    assert sum(count_words(item['text']) for item in limited) <= 12
+    print(f"   ✅ {relevant[0]['text']!r}")
+
+    # Тест 4: изменение и удаление записи памяти
+    print("\n4️⃣ Тест синхронизации с таблицей memories...")
+    memory.save_memory("pet", "У пользователя есть собака по кличке Рекс", "personal")
+    reloads = index.get_stats()['reloads']
+    assert index.relevant("собака", token_budget=100, count_tokens=count_words)[0]['key'] == "pet"
+    assert index.get_stats()['reloads'] == reloads + 1
+    index.search("собака")
+    assert index.get_stats()['reloads'] == reloads + 1  # таблица не менялась - матрица не перечитана
+    memory.delete_memory("pet")
+    assert "pet" not in [item['key'] for item in index.relevant("собака", 100, count_words)]
+    print("   ✅ Векторы измененных записей пересчитаны, удаленных - убраны")
+
+    # Тест 5: эмбеддинги через API и отказ API
+    print("\n5️⃣ Тест внешней модели эмбеддингов...")
+    calls = []
+    gate = threading.Event()
+
+    def remote(text, kind):
+        calls.append(kind)
+        if kind == 'doc':
+            gate.wait(5)  # медленный API эмбеддингов
+        if "сбой" in text:
+            raise ConnectionError("embeddings down")
+        return local_embedding(text, 128) * 3  # ненормированный вектор
+
+    remote_index = SemanticMemory(memory, embed=remote)
+    assert remote_index.search("фреймворк") == []  # поиск не ждет индексацию записей через API
+    gate.set()
+    assert remote_index.wait_for_indexing(timeout=5)
+    assert keys[remote_index.search("фреймворк")[0][0]] == "favorite_framework"
+    assert calls.count('doc') == 2  # векторы локальной модели не подходят
+    assert remote_index.search("сбой") == []
+    assert remote_index.get_stats()['embed_errors'] == 1
+    assert remote_index.get_stats()['last_error'] == "query: embeddings down"
+    print(f"   ✅ {remote_index.get_stats()}")
+
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(test_db + suffix):
+            os.remove(test_db + suffix)
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_semantic_memory()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,112 @@
+"""
+Тест объединения одинаковых запросов в полете (single-flight)
+"""
+import threading
+import time
+from single_flight import SingleFlight
+
+
+def run_concurrently(flight, key, fn, count):
+    """Запустить count потоков с одним ключом и собрать результаты/ошибки"""
+    results = []
+    errors = []
+    lock = threading.Lock()
+
+    def worker():
+        try:
+            value = flight.do(key, fn)
+            with lock:
+                results.append(value)
+        except Exception as e:
+            with lock:
+                errors.append(e)
+
+    threads = [threading.Thread(target=worker) for _ in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    return results, errors
+
+
+def test_single_flight():
+    """Полный тест single-flight слоя"""
+    print("🧪 ТЕСТ ОБЪЕДИНЕНИЯ ЗАПРОСОВ")
+    print("=" * 60)
+
+    # Тест 1: одинаковые запросы выполняются один раз
+    print("\n1️⃣ Тест объединения...")
+    flight = SingleFlight(max_waiters=32)
+    calls = []
+
+    def slow_request():
+        calls.append(1)
+        time.sleep(0.2)
+        return {"text": "ответ"}
+
+    results, errors = run_concurrently(flight, "prompt", slow_request, 10)
+    assert not errors
+    assert len(calls) == 1, f"Ожидался 1 вызов API, было {len(calls)}"
+    assert len(results) == 10 and all(r is results[0] for r in results)
+    stats = flight.get_stats()
+    assert stats['leaders'] == 1 and stats['coalesced'] == 9 and stats['in_flight'] == 0
+    print(f"   ✅ 10 вызовов -> 1 запрос, статистика: {stats}")
+
+    # Тест 2: ошибка ведущего получают все ожидающие
+    print("\n2️⃣ Тест распространения ошибки...")
+
+    def failing_request():
+        time.sleep(0.2)
+        raise RuntimeError("HTTP 500")
+
+    results, errors = run_concurrently(flight, "broken", failing_request, 5)
+    assert not results and len(errors) == 5
+    assert all(str(e) == "HTTP 500" for e in errors)
+    print("   ✅ Ошибка передана всем ожидающим")
+
+    # Тест 3: лимит ожидающих на ключ
+    print("\n3️⃣ Тест лимита ожидающих...")
+    limited = SingleFlight(max_waiters=2)
+    calls.clear()
+    results, errors = run_concurrently(limited, "prompt", slow_request, 6)
+    assert not errors and len(results) == 6
+    assert len(calls) == 4, f"Ожидалось 4 вызова (1 ведущий + 3 сверх лимита), было {len(calls)}"
+    assert limited.get_stats()['overflow'] == 3
+    print(f"   ✅ Сверх лимита запросы выполняются самостоятельно: {limited.get_stats()}")
+
+    # Тест 4: прерванный ведущий не оставляет ожидающих без ответа
+    print("\n4️⃣ Тест прерванного ведущего...")
+    aborting = SingleFlight()
+    call, is_leader = aborting.acquire("stream")
+    assert is_leader
+    follower_result = []
+    follower = threading.Thread(target=lambda: follower_result.append(aborting.do("stream", lambda: "свой ответ")))
+    follower.start()
+    time.sleep(0.05)
+    aborting.abort("stream", call)
+    follower.join(timeout=1)
+    assert follower_result == ["свой ответ"]
+    assert aborting.get_stats()['in_flight'] == 0
+    print("   ✅ Ожидающий выполнил запрос сам")
+
+    # Тест 5: разные ключи не объединяются
+    print("\n5️⃣ Тест разных ключей...")
+    assert flight.do("a", lambda: 1) == 1
+    assert flight.do("b", lambda: 2) == 2
+    print("   ✅ Разные запросы выполняются независимо")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_single_flight()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
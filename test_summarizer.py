@@ -0,0 +1,81 @@
+"""
+Тест локального экстрактивного summary и очистки summary
+"""
+import time
+from summarizer import ExtractiveSummarizer, clean_summary, is_statement, split_by_tokens
+
+
+RESPONSES = """Python - интерпретируемый язык программирования общего назначения.
+Django - полнофункциональный веб-фреймворк для Python с ORM и админкой.
+Flask - минималистичный веб-фреймворк для Python.
+Какой фреймворк выбрать для вашего проекта?
+Вам нужно изучить документацию Django.
+
+FastAPI - современный асинхронный веб-фреймворк для Python с автоматической документацией.
+- Пункт
+Погода сегодня была солнечной и теплой."""
+
+
+def test_summarizer():
+    """Полный тест суммаризации"""
+    print("🧪 ТЕСТ ЛОКАЛЬНОГО SUMMARY")
+    print("=" * 60)
+
+    # Тест 1: фильтр вопросов и предложений задач
+    print("\n1️⃣ Тест фильтра утвердительных предложений...")
+    assert is_statement("Django - веб-фреймворк")
+    assert not is_statement("Какой фреймворк выбрать")
+    assert not is_statement("Давайте обсудим риски")
+    assert not is_statement("Это так?")
+    assert clean_summary("Резюме: Обсуждался Python. Что дальше? Нужно изучить Django") == "Обсуждался Python."
+    print("   ✅ Вопросы, модальные предложения и вводные фразы удалены")
+
+    # Тест 2: выбор центральных предложений
+    print("\n2️⃣ Тест TextRank...")
+    summarizer = ExtractiveSummarizer()
+    start_time = time.time()
+    summary = summarizer.summarize(RESPONSES, max_sentences=3)
+    elapsed = time.time() - start_time
+    assert summary.count('.') == 3
+    assert "Погода" not in summary  # не связано с остальными предложениями
+    assert "?" not in summary and "нужно" not in summary and "Пункт" not in summary
+    assert summary.index("Django") < summary.index("FastAPI")  # исходный порядок
+    print(f"   ✅ {summary!r} за {elapsed * 1000:.1f} мс")
+
+    # Тест 3: короткий текст и текст без утверждений
+    print("\n3️⃣ Тест граничных случаев...")
+    assert summarizer.summarize("Flask - минималистичный веб-фреймворк", max_sentences=3) == \
+        "Flask - минималистичный веб-фреймворк."
+    assert summarizer.summarize("Что такое Flask? Как его установить?") is None
+    assert summarizer.summarize("") is None
+    assert summarizer.get_stats()['calls'] == 4
+    print("   ✅ Короткий текст возвращается целиком, без утверждений - None")
+
+    # Тест 4: разбиение по токенам для map-reduce
+    print("\n4️⃣ Тест разбиения на фрагменты...")
+    count_words = lambda text: len(text.split())
+    paragraphs = [" ".join(f"слово{i}" for i in range(size)) for size in (4, 5, 3, 20)]
+    text = "\n\n".join(paragraphs)
+    chunks = split_by_tokens(text, 10, count_words)
+    assert all(count_words(chunk) <= 10 for chunk in chunks)
+    assert chunks[:2] == [paragraphs[0] + "\n\n" + paragraphs[1], paragraphs[2]]
+    assert " ".join(" ".join(chunks).split()) == " ".join(text.split())  # ничего не потеряно
+    assert split_by_tokens(text + "\n\nновый абзац", 10, count_words)[:2] == chunks[:2]
+    assert split_by_tokens("", 10, count_words) == []
+    print(f"   ✅ {len(chunks)} фрагментов: {[count_words(chunk) for chunk in chunks]}")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_summarizer()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
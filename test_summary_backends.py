@@ -0,0 +1,89 @@
+"""
+Тест учета бэкендов summary (summary_backends)
+"""
+import os
+import shutil
+import sys
+import tempfile
+
+REPO_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def import_app(work_dir):
+    """Импорт app с тестовым config.json: базы создаются во временной папке"""
+    shutil.copy(os.path.join(REPO_DIR, 'config.example.json'), os.path.join(work_dir, 'config.json'))
+    os.chdir(work_dir)
+    if REPO_DIR not in sys.path:
+        sys.path.insert(0, REPO_DIR)
+    import app
+    return app
+
+
+def test_summary_backends():
+    """В summary_backends попадают только реально созданные summary"""
+    print("🧪 ТЕСТ УЧЕТА БЭКЕНДОВ SUMMARY")
+    print("=" * 60)
+
+    original_dir = os.getcwd()
+    work_dir = tempfile.mkdtemp()
+    try:
+        app = import_app(work_dir)
+        text = "Python - язык программирования. Он популярен. На нем пишут веб-сервисы."
+
+        # Тест 1: модель не вернула summary
+        print("\n1️⃣ Тест неудачного remote...")
+        manager = app.DialogHistoryManager(summarizer='remote')
+        manager._remote_summary = lambda *args, **kwargs: None
+        assert manager._summarize_text(text, "2-3") is None
+        assert manager.summary_backends == {'remote': 0, 'local': 0}, manager.summary_backends
+        print("   ✅ Пустой ответ модели не учтен как remote summary")
+
+        # Тест 2: вызов модели упал
+        print("\n2️⃣ Тест ошибки remote...")
+
+        def failing(*args, **kwargs):
+            raise RuntimeError("модель недоступна")
+
+        manager._remote_summary = failing
+        try:
+            manager._summarize_text(text, "2-3")
+            assert False, "Ошибка модели должна пробрасываться при summarizer='remote'"
+        except RuntimeError:
+            pass
+        assert manager.summary_backends == {'remote': 0, 'local': 0}, manager.summary_backends
+        print("   ✅ Ошибка модели не учтена как remote summary")
+
+        # Тест 3: auto откатывается на локальное summary
+        print("\n3️⃣ Тест отката auto...")
+        manager = app.DialogHistoryManager(summarizer='auto')
+        manager._remote_summary = lambda *args, **kwargs: None
+        assert manager._summarize_text(text, "2-3")
+        assert manager.summary_backends == {'remote': 0, 'local': 1}, manager.summary_backends
+        print("   ✅ Учтено локальное summary")
+
+        # Тест 4: успешный remote
+        print("\n4️⃣ Тест успешного remote...")
+        manager = app.DialogHistoryManager(summarizer='remote')
+        manager._remote_summary = lambda *args, **kwargs: "Python популярен."
+        assert manager._summarize_text(text, "2-3") == "Python популярен."
+        assert manager.summary_backends == {'remote': 1, 'local': 0}, manager.summary_backends
+        print("   ✅ Учтено remote summary")
+    finally:
+        os.chdir(original_dir)
+        shutil.rmtree(work_dir, ignore_errors=True)
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_summary_backends()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,78 @@
+"""
+Тест иерархических summary истории диалога
+"""
+from summary_tree import SummaryTree
+
+
+def count_words(text):
+    return len(text.split())
+
+
+def test_summary_tree():
+    """Полный тест иерархии summary"""
+    print("🧪 ТЕСТ ИЕРАРХИИ SUMMARY")
+    print("=" * 60)
+
+    merged_inputs = []
+
+    def summarize(texts):
+        # Объединение сохраняет все факты в сжатом виде: первые слова каждого summary
+        merged_inputs.append(list(texts))
+        return " ".join(text.split()[0] for text in texts)
+
+    # Тест 1: слияние ветки по fanout
+    print("\n1️⃣ Тест слияния по fanout...")
+    tree = SummaryTree(summarize, count_words, fanout=3, budget_tokens=1000)
+    nodes = []
+    for i in range(3):
+        nodes = tree.add(nodes, f"факт{i} подробности подробности", messages=5)
+    assert len(nodes) == 1 and nodes[0]['level'] == 1 and nodes[0]['messages'] == 15
+    assert nodes[0]['text'] == "факт0 факт1 факт2"
+    print(f"   ✅ {nodes}")
+
+    # Тест 2: пересчитывается только затронутая ветка
+    print("\n2️⃣ Тест частичной пересуммаризации...")
+    merged_inputs.clear()
+    for i in range(3, 9):
+        nodes = tree.add(nodes, f"факт{i} подробности", messages=5)
+    # 3 узла уровня 0 -> уровень 1 (дважды), затем 3 узла уровня 1 -> уровень 2
+    assert [len(texts) for texts in merged_inputs] == [3, 3, 3]
+    assert len(nodes) == 1 and nodes[0]['level'] == 2
+    assert nodes[0]['text'] == "факт0 факт3 факт6"
+    print(f"   ✅ {len(merged_inputs)} слияния, уровень {nodes[0]['level']}")
+
+    # Тест 3: бюджет сжимает самые старые summary
+    print("\n3️⃣ Тест бюджета токенов...")
+    tree = SummaryTree(summarize, count_words, fanout=10, budget_tokens=8)
+    nodes = []
+    for i in range(4):
+        nodes = tree.add(nodes, f"старое{i} а б", messages=2)
+    assert SummaryTree.total_tokens(nodes) <= 8
+    assert nodes[0]['text'].startswith("старое0") and nodes[-1]['text'] == "старое3 а б"
+    assert tree.get_stats()['budget_merges'] > 0
+    print(f"   ✅ {SummaryTree.render(nodes)!r}")
+
+    # Тест 4: ошибка суммаризации не теряет summary
+    print("\n4️⃣ Тест неудачного слияния...")
+    tree = SummaryTree(lambda texts: None, count_words, fanout=2, budget_tokens=1000)
+    nodes = tree.add([], "первое", messages=3)
+    nodes = tree.add(nodes, "второе", messages=3)
+    assert [node['text'] for node in nodes] == ["первое", "второе"]
+    assert tree.get_stats()['failed_merges'] == 1
+    print("   ✅ Узлы сохранены без слияния")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_summary_tree()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
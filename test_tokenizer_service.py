@@ -0,0 +1,100 @@
+"""
+Тест сервиса подсчета токенов
+"""
+import threading
+from tokenizer_service import TokenizerService, text_features
+
+
+class FakeTokenizer:
+    """Точный токенизатор: 1 токен на 3 буквы, на цифру и на знак препинания"""
+
+    def __init__(self, fail_on=()):
+        self.fail_on = set(fail_on)
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, text):
+        with self._lock:
+            self.calls += 1
+        if text in self.fail_on:
+            raise ConnectionError("tokenizer down")
+        letters, latin, digits, other, _ = text_features(text)
+        return round((letters + latin) / 3) + digits + other
+
+
+def test_tokenizer_service():
+    """Полный тест сервиса подсчета токенов"""
+    print("🧪 ТЕСТ ПОДСЧЕТА ТОКЕНОВ")
+    print("=" * 60)
+
+    # Тест 1: локальная модель
+    print("\n1️⃣ Тест локальной модели...")
+    local = TokenizerService()
+    assert local.count("") == 0 and local.count("   ") == 0
+    assert local.count("да") == 1
+    short, long = local.count_batch(["Привет, как дела?", "Привет, как дела? " * 10])
+    assert 3 <= short <= 8 and long > 5 * short
+    print(f"   ✅ {short} и {long} токенов")
+
+    # Тест 2: LRU и повторы в пакете
+    print("\n2️⃣ Тест мемоизации...")
+    remote = FakeTokenizer()
+    service = TokenizerService(remote=remote, memo_size=3)
+    texts = ["один", "два", "один", "три"]
+    expected = [FakeTokenizer()(text) for text in texts]
+    assert service.count_batch(texts) == expected
+    assert remote.calls == 3  # повтор в пакете считается один раз
+    service.count_batch(texts)
+    stats = service.get_stats()
+    assert stats['hits'] == 3 and stats['remote_calls'] == 3
+    service.count("четыре")  # вытесняет самый старый
+    assert service.get_stats()['memo_entries'] == 3
+    print(f"   ✅ {stats}")
+
+    # Тест 3: ошибка API - локальная оценка без запоминания
+    print("\n3️⃣ Тест отказа API...")
+    remote = FakeTokenizer(fail_on={"сбой"})
+    service = TokenizerService(remote=remote)
+    assert service.count("сбой") >= 1
+    service.count("сбой")
+    stats = service.get_stats()
+    assert stats['remote_errors'] == 2 and stats['memo_entries'] == 0
+    print(f"   ✅ {stats['remote_errors']} ошибки, оценка не запомнена")
+
+    # Тест 4: калибровка по точным подсчетам
+    print("\n4️⃣ Тест калибровки...")
+    remote = FakeTokenizer()
+    samples = [f"Сообщение номер {i}: проверка калибровки, текст {'длинный ' * (i % 7)}"
+               for i in range(60)]
+    probe = "Совсем новая фраза, которой не было: 12345!"
+    before = abs(TokenizerService().estimate_batch([probe])[0] - remote(probe))
+    service = TokenizerService(remote=remote, refit_every=50)
+    service.count_batch(samples)
+    stats = service.get_stats()
+    assert stats['refits'] == 1 and stats['calibration_samples'] == 60
+    after = abs(service.estimate_batch([probe])[0] - remote(probe))
+    assert after <= before
+    print(f"   ✅ Ошибка оценки {before} -> {after} токенов, {stats['weights']}")
+
+    # Тест 5: observe() запоминает точное значение
+    print("\n5️⃣ Тест внешних точных значений...")
+    local = TokenizerService()
+    local.observe("ответ модели", 42)
+    assert local.count("ответ модели") == 42
+    print("   ✅ usage ответа модели используется как точное значение")
+
+    print("\n" + "=" * 60)
+    print("🎉 ВСЕ ТЕСТЫ ПРОЙДЕНЫ УСПЕШНО!")
+    print("=" * 60)
+
+    return True
+
+
+if __name__ == "__main__":
+    try:
+        test_tokenizer_service()
+    except Exception as e:
+        print(f"\n❌ ОШИБКА ТЕСТА: {e}")
+        import traceback
+        traceback.print_exc()
+        exit(1)
@@ -0,0 +1,268 @@
+"""
+Подсчет токенов для сжатия истории, маршрутизации и метрик
+Точный подсчет через Yandex Tokenizer API или локальная откалиброванная оценка
+"""
+import hashlib
+import re
+import threading
+from collections import OrderedDict, deque
+from typing import Any, Callable, Dict, List, Optional, Sequence
+
+import numpy as np
+
+from parallel_runner import ParallelRunner
+
+
+# Признаки локальной модели: кириллица, латиница, цифры, прочие символы, слова
+FEATURE_PATTERNS = (
+    re.compile(r'[а-яёА-ЯЁ]'),
+    re.compile(r'[a-zA-Z]'),
+    re.compile(r'\d'),
+    re.compile(r'[^\sа-яёА-ЯЁa-zA-Z\d]'),
+    re.compile(r'\S+')
+)
+
+# Токенов на единицу признака: русское слово ~ 1-2 токена,
+# знак препинания - почти всегда отдельный токен
+DEFAULT_WEIGHTS = (0.2, 0.23, 0.5, 0.7, 0.15)
+
+
+def text_features(text: str) -> List[int]:
+    """Значения признаков локальной модели для текста"""
+    return [len(pattern.findall(text)) for pattern in FEATURE_PATTERNS]
+
+
+class TokenizerService:
+    """
+    Счетчик токенов с мемоизацией.
+
+    remote - точный подсчет одного текста (обычно YandexClient.tokenize).
+    Без него используется локальная линейная модель по признакам текста.
+    Каждый точный ответ становится образцом для калибровки: каждые
+    refit_every новых образцов веса локальной модели пересчитываются
+    методом наименьших квадратов, поэтому при недоступности API оценка
+    остается близкой к настоящему токенизатору.
+
+    Точные значения из других источников (usage ответа модели) передаются
+    в observe() и тоже калибруют модель.
+
+    Результаты хранятся в LRU по хешу текста. Оценки, полученные из-за
+    ошибки API, не запоминаются, чтобы позже получить точное значение.
+    """
+
+    def __init__(self, remote: Optional[Callable[[str], int]] = None,
+                 memo_size: int = 4096,
+                 weights: Optional[Sequence[float]] = None,
+                 calibration_window: int = 2000,
+                 refit_every: int = 50,
+                 max_workers: int = 4):
+        """
+        Args:
+            remote: точный подсчет токенов текста (None - только локальная модель)
+            memo_size: сколько результатов хранить в LRU
+            weights: начальные веса локальной модели (по умолчанию DEFAULT_WEIGHTS)
+            calibration_window: сколько последних точных подсчетов хранить для калибровки
+            refit_every: через сколько новых образцов пересчитывать веса
+            max_workers: сколько текстов пакета отправлять в API одновременно
+        """
+        self.remote = remote
+        self.memo_size = memo_size
+        self.refit_every = refit_every
+        self.max_workers = max_workers
+
+        self._weights = np.asarray(weights if weights is not None else DEFAULT_WEIGHTS, dtype=np.float64)
+        self._samples = deque(maxlen=calibration_window)  # (признаки, точное число токенов)
+        self._new_samples = 0
+        self._calibration_error = None
+        self._memo = OrderedDict()
+        self._runner = ParallelRunner(max_workers=max_workers) if remote is not None else None
+        self._lock = threading.Lock()
+        self._stats = {
+            'hits': 0,
+            'misses': 0,
+            'remote_calls': 0,
+            'remote_errors': 0,
+            'local': 0,
+            'refits': 0
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any],
+                    remote: Optional[Callable[[str], int]] = None) -> 'TokenizerService':
+        """
+        Создать счетчик по настройкам из config.json.
+        remote используется только при tokenizer_backend = 'yandex'
+        """
+        if config.get('tokenizer_backend', 'local') != 'yandex':
+            remote = None
+        return cls(
+            remote=remote,
+            memo_size=config.get('tokenizer_memo_size', 4096),
+            weights=config.get('tokenizer_weights'),
+            refit_every=config.get('tokenizer_refit_every', 50),
+            max_workers=config.get('tokenizer_max_workers', 4)
+        )
+
+    @staticmethod
+    def _key(text: str) -> bytes:
+        return hashlib.blake2b(text.encode('utf-8'), digest_size=16).digest()
+
+    def count(self, text: str) -> int:
+        """Число токенов текста"""
+        return self.count_batch([text])[0]
+
+    def count_messages(self, messages: Sequence[Dict[str, Any]]) -> int:
+        """Суммарное число токенов текстов сообщений ({'role', 'text'})"""
+        return sum(self.count_batch([msg['text'] for msg in messages]))
+
+    def count_batch(self, texts: Sequence[str]) -> List[int]:
+        """
+        Посчитать токены пакета текстов
+
+        Одинаковые тексты считаются один раз, найденные в LRU не считаются
+        вовсе; остальные при наличии remote отправляются в API параллельно.
+
+        Returns:
+            Число токенов каждого текста в исходном порядке
+        """
+        keys = [self._key(text) for text in texts]
+        counts = {}
+        missing = {}
+
+        with self._lock:
+            for key, text in zip(keys, texts):
+                if key in counts or key in missing:
+                    continue
+                if not text.strip():
+                    counts[key] = 0
+                    continue
+                count = self._memo.get(key)
+                if count is not None:
+                    self._memo.move_to_end(key)
+                    self._stats['hits'] += 1
+                    counts[key] = count
+                else:
+                    self._stats['misses'] += 1
+                    missing[key] = text
+
+        if missing:
+            counts.update(self._count_missing(missing))
+        return [counts[key] for key in keys]
+
+    def _count_missing(self, missing: Dict[bytes, str]) -> Dict[bytes, int]:
+        """Посчитать тексты, которых нет в LRU, и запомнить точные результаты"""
+        if self.remote is None:
+            counts = dict(zip(missing, self.estimate_batch(list(missing.values()))))
+            with self._lock:
+                self._stats['local'] += len(counts)
+            self._remember(counts)
+            return counts
+
+        exact = self._remote_counts(missing)
+        failed = [key for key in missing if key not in exact]
+        self._remember(exact)
+        self._calibrate([(missing[key], count) for key, count in exact.items()])
+
+        counts = dict(exact)
+        if failed:
+            counts.update(zip(failed, self.estimate_batch([missing[key] for key in failed])))
+        with self._lock:
+            self._stats['remote_calls'] += len(missing)
+            self._stats['remote_errors'] += len(failed)
+            self._stats['local'] += len(failed)
+        return counts
+
+    def _remote_counts(self, missing: Dict[bytes, str]) -> Dict[bytes, int]:
+        """Точный подсчет через API; тексты с ошибкой в результат не попадают"""
+        if len(missing) == 1:
+            # Один текст считаем в текущем потоке, без пула
+            key, text = next(iter(missing.items()))
+            try:
+                return {key: self.remote(text)}
+            except Exception:
+                return {}
+
+        outcomes = self._runner.run(
+            {key: (lambda text=text: self.remote(text)) for key, text in missing.items()}
+        )
+        return {key: outcome['result'] for key, outcome in outcomes.items() if outcome['error'] is None}
+
+    def _remember(self, counts: Dict[bytes, int]):
+        with self._lock:
+            for key, count in counts.items():
+                self._memo[key] = count
+                self._memo.move_to_end(key)
+            while len(self._memo) > self.memo_size:
+                self._memo.popitem(last=False)
+
+    def estimate_batch(self, texts: Sequence[str]) -> List[int]:
+        """Оценка локальной моделью (без API и LRU)"""
+        if not texts:
+            return []
+        features = np.asarray([text_features(text) for text in texts], dtype=np.float64)
+        with self._lock:
+            weights = self._weights
+        estimates = np.ceil(features @ weights)
+        # У непустого текста есть хотя бы один токен
+        return [int(max(estimate, 1)) if feature[-1] else 0
+                for estimate, feature in zip(estimates, features)]
+
+    def observe(self, text: str, count: int):
+        """
+        Учесть точное число токенов, известное из другого источника
+        (например, usage.completionTokens ответа модели)
+        """
+        if not text.strip():
+            return
+        self._remember({self._key(text): count})
+        self._calibrate([(text, count)])
+
+    def calibrate(self, texts: Sequence[str], counts: Sequence[int]):
+        """Добавить образцы точного подсчета и сразу пересчитать веса локальной модели"""
+        self._calibrate(list(zip(texts, counts)), force=True)
+
+    def _calibrate(self, samples: List[tuple], force: bool = False):
+        with self._lock:
+            for text, count in samples:
+                self._samples.append((text_features(text), count))
+            self._new_samples += len(samples)
+            if not self._samples or (not force and self._new_samples < self.refit_every):
+                return
+            self._new_samples = 0
+            features = np.asarray([feature for feature, _ in self._samples], dtype=np.float64)
+            targets = np.asarray([count for _, count in self._samples], dtype=np.float64)
+
+        weights, _, _, _ = np.linalg.lstsq(features, targets, rcond=None)
+        # Отрицательный вес дает абсурдные оценки на нетипичных текстах
+        weights = np.clip(weights, 0.0, None)
+        if not weights.any():
+            return
+
+        predicted = np.maximum(np.ceil(features @ weights), 1)
+        error = float(np.mean(np.abs(predicted - targets) / np.maximum(targets, 1)))
+        with self._lock:
+            self._weights = weights
+            self._calibration_error = error
+            self._stats['refits'] += 1
+            if self.remote is None:
+                # Без API в LRU лежат оценки старой модели
+                self._memo.clear()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику подсчета и калибровки"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['memo_entries'] = len(self._memo)
+            stats['calibration_samples'] = len(self._samples)
+            stats['calibration_error'] = (round(self._calibration_error, 3)
+                                          if self._calibration_error is not None else None)
+            stats['weights'] = [round(float(weight), 4) for weight in self._weights]
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = round(stats['hits'] / lookups, 3) if lookups else 0
+        stats['backend'] = 'yandex' if self.remote is not None else 'local'
+        return stats
+
+    def shutdown(self):
+        """Остановить пул потоков запросов к API"""
+        if self._runner is not None:
+            self._runner.shutdown()
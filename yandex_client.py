@@ -0,0 +1,521 @@
+"""
+HTTP-клиент для Yandex Foundation Models API
+Один пул keep-alive соединений на воркер для всех вызовов LLM
+"""
+import atexit
+import json
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from circuit_breaker import CircuitBreaker
+from completion_cache import CompletionCache, is_deterministic
+from hedging import Hedger
+from rate_limiter import RateLimiter
+from retry_policy import RetryPolicy
+from single_flight import SingleFlight
+
+
+API_HOST = "https://llm.api.cloud.yandex.net"
+COMPLETION_URL = f"{API_HOST}/foundationModels/v1/completion"
+AGENTS_URL = f"{API_HOST}/agents/v1/completions"
+TOKENIZE_URL = f"{API_HOST}/foundationModels/v1/tokenize"
+EMBEDDING_URL = f"{API_HOST}/foundationModels/v1/textEmbedding"
+
+# Вышестоящие сервисы, у каждого свой предохранитель
+UPSTREAMS = ('completion', 'agents', 'summarization', 'tokenize', 'embedding')
+
+
+class YandexClient:
+    """
+    Клиент Yandex Cloud LLM API поверх общего requests.Session.
+
+    Сессия создается лениво и пересоздается после fork(), поэтому каждый
+    воркер gunicorn получает собственный пул соединений и не платит за
+    TCP+TLS рукопожатие на каждый запрос.
+
+    Одинаковые запросы, выполняющиеся одновременно в потоках воркера,
+    объединяются single-flight слоем: к API уходит один запрос, остальные
+    получают его результат. Запросы с use_cache=False (нужен новый
+    независимый ответ, например в эксперименте с температурой) не объединяются.
+
+    Перед отправкой запрос ждет квоту модели в ограничителе частоты;
+    если очередь заполнена, вызов завершается RateLimitExceeded.
+    Сетевые ошибки и статусы 429/5xx повторяются по политике повторов,
+    каждая попытка снова проходит ограничитель частоты.
+
+    Вызовы каждого вышестоящего сервиса (completion, agents, summarization, tokenize)
+    идут через свой предохранитель: при деградации API он размыкается и
+    запросы сразу завершаются CircuitOpenError, не занимая потоки воркера.
+    Ответы из кэша отдаются и при разомкнутом предохранителе.
+
+    Для детерминированных запросов (temperature = 0) можно включить
+    хеджирование (hedge=True): если ответ задерживается дольше обычного для
+    модели, отправляется второй такой же запрос.
+    """
+
+    def __init__(self, api_key: str, pool_size: int = 10,
+                 connect_timeout: float = 5.0, read_timeout: float = 60.0,
+                 cache: Optional[CompletionCache] = None,
+                 single_flight: Optional[SingleFlight] = None,
+                 rate_limiter: Optional[RateLimiter] = None,
+                 retry_policy: Optional[RetryPolicy] = None,
+                 breakers: Optional[Dict[str, CircuitBreaker]] = None,
+                 hedger: Optional[Hedger] = None):
+        """
+        Args:
+            api_key: API-ключ Yandex Cloud
+            pool_size: максимальное число keep-alive соединений в пуле
+            connect_timeout: таймаут установки соединения (сек)
+            read_timeout: таймаут ожидания ответа по умолчанию (сек)
+            cache: кэш ответов completion (None - без кэша)
+            single_flight: объединение одинаковых запросов в полете (None - без объединения)
+            rate_limiter: ограничитель частоты запросов по моделям (None - без ограничения)
+            retry_policy: политика повторов (None - без повторов)
+            breakers: предохранители по вышестоящим сервисам (None - без предохранителей)
+            hedger: хеджирование медленных запросов (None - выключено)
+        """
+        self.api_key = api_key
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.cache = cache
+        self.single_flight = single_flight
+        self.rate_limiter = rate_limiter
+        self.retry_policy = retry_policy
+        self.breakers = breakers or {}
+        self.hedger = hedger
+
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            'requests': 0,
+            'errors': 0,
+            'total_time': 0.0
+        }
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any],
+                    cache: Optional[CompletionCache] = None) -> 'YandexClient':
+        """Создать клиент по настройкам из config.json"""
+        single_flight = None
+        if config.get('single_flight_enabled', True):
+            single_flight = SingleFlight(max_waiters=config.get('single_flight_max_waiters', 32))
+
+        rate_limiter = None
+        if config.get('rate_limit_enabled', True):
+            rate_limiter = RateLimiter.from_config(config)
+
+        retry_policy = None
+        if config.get('retry_enabled', True):
+            retry_policy = RetryPolicy.from_config(config)
+
+        breakers = None
+        if config.get('circuit_enabled', True):
+            breakers = {name: CircuitBreaker.from_config(name, config) for name in UPSTREAMS}
+
+        # Хеджирование удваивает часть запросов - включается явно
+        hedger = None
+        if config.get('hedging_enabled', False):
+            hedger = Hedger.from_config(config)
+
+        return cls(
+            api_key=config['api_key'],
+            pool_size=config.get('http_pool_size', 10),
+            connect_timeout=config.get('http_connect_timeout', 5.0),
+            read_timeout=config.get('http_read_timeout', 60.0),
+            cache=cache,
+            single_flight=single_flight,
+            rate_limiter=rate_limiter,
+            retry_policy=retry_policy,
+            breakers=breakers,
+            hedger=hedger
+        )
+
+    def _get_session(self) -> requests.Session:
+        """Вернуть сессию текущего процесса, создав ее при необходимости"""
+        pid = os.getpid()
+        if self._session is not None and self._session_pid == pid:
+            return self._session
+
+        with self._lock:
+            if self._session is None or self._session_pid != pid:
+                session = requests.Session()
+                adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.pool_size)
+                session.mount("https://", adapter)
+                session.headers.update({
+                    "Content-Type": "application/json",
+                    "Authorization": f"Api-Key {self.api_key}"
+                })
+                self._session = session
+                self._session_pid = pid
+        return self._session
+
+    def post(self, url: str, payload: Dict[str, Any],
+             timeout: Optional[float] = None,
+             rate_key: Optional[str] = None) -> requests.Response:
+        """
+        Отправить POST-запрос через пул соединений (с повторами по политике клиента)
+
+        Args:
+            url: адрес метода API
+            payload: тело запроса
+            timeout: таймаут чтения ответа (по умолчанию read_timeout)
+            rate_key: ключ квоты в ограничителе частоты (по умолчанию модель запроса)
+
+        Returns:
+            Объект ответа requests (статус не проверяется; ответ 429/5xx
+            возвращается, только если повторы не помогли)
+
+        Raises:
+            RateLimitExceeded: квота модели исчерпана и очередь ожидания заполнена
+        """
+        read_timeout = timeout if timeout is not None else self.read_timeout
+        start_time = time.time()
+        try:
+            response = self._send(url, payload, read_timeout, rate_key=rate_key)
+        except requests.exceptions.RequestException:
+            self._record(time.time() - start_time, failed=True)
+            raise
+
+        self._record(time.time() - start_time, failed=response.status_code >= 400)
+        return response
+
+    def completion(self, payload: Dict[str, Any], url: str = COMPLETION_URL,
+                   timeout: Optional[float] = None,
+                   use_cache: Optional[bool] = None,
+                   upstream: Optional[str] = None,
+                   hedge: bool = False) -> Dict[str, Any]:
+        """
+        Выполнить запрос completion и вернуть распарсенный JSON
+
+        Args:
+            payload: тело запроса
+            url: адрес метода API
+            timeout: таймаут чтения ответа
+            use_cache: True/False - принудительно использовать кэш или обойти его,
+                       None - по политике кэша (только temperature = 0).
+                       False также отключает объединение с запросами в полете
+            upstream: имя предохранителя (по умолчанию по url: completion или agents)
+            hedge: хеджировать медленный запрос (только для temperature = 0
+                   и если хеджирование включено в клиенте)
+
+        Returns:
+            Ответ API; при объединении один объект отдается всем вызовам,
+            изменять его нельзя
+
+        Raises:
+            requests.exceptions.RequestException: при сетевой ошибке или HTTP-статусе >= 400
+            RateLimitExceeded: квота модели исчерпана и очередь ожидания заполнена
+            CircuitOpenError: предохранитель сервиса разомкнут
+        """
+        cache_key = self._cache_key(payload, url, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                return cached
+
+        def send() -> requests.Response:
+            return self._guarded(
+                upstream or self._upstream_for(url),
+                lambda: self.post(url, payload, timeout=timeout)
+            )
+
+        def fetch() -> Dict[str, Any]:
+            if hedge and self.hedger is not None and is_deterministic(payload):
+                response = self.hedger.call(RateLimiter.key_for(payload), send)
+            else:
+                response = send()
+            response.raise_for_status()
+            result = response.json()
+
+            if cache_key is not None and "alternatives" in result.get("result", {}):
+                self.cache.set(cache_key, result)
+            return result
+
+        flight_key = self._flight_key(payload, url, use_cache)
+        if flight_key is None:
+            return fetch()
+        return self.single_flight.do(flight_key, fetch)
+
+    def stream_completion(self, payload: Dict[str, Any], url: str = COMPLETION_URL,
+                          timeout: Optional[float] = None,
+                          use_cache: Optional[bool] = None,
+                          upstream: Optional[str] = None) -> Iterator[str]:
+        """
+        Выполнить потоковый запрос completion (stream: true)
+
+        API присылает JSON-объекты построчно, в каждом - текст альтернативы,
+        накопленный к этому моменту. Генератор отдает только новые фрагменты.
+        Ответ из кэша или из такого же запроса в полете отдается одним фрагментом.
+
+        Yields:
+            Очередной фрагмент текста первой альтернативы
+
+        Raises:
+            requests.exceptions.RequestException: при сетевой ошибке или HTTP-статусе >= 400
+            RateLimitExceeded: квота модели исчерпана и очередь ожидания заполнена
+            CircuitOpenError: предохранитель сервиса разомкнут
+        """
+        cache_key = self._cache_key(payload, url, use_cache)
+        if cache_key is not None:
+            cached = self.cache.get(cache_key)
+            if cached is not None:
+                yield cached["result"]["alternatives"][0]["message"]["text"]
+                return
+
+        flight_key = self._flight_key(payload, url, use_cache)
+        call, is_leader = None, False
+        if flight_key is not None:
+            call, is_leader = self.single_flight.acquire(flight_key)
+
+        if call is not None and not is_leader:
+            call.done.wait()
+            if not call.aborted:
+                if call.error is not None:
+                    raise call.error
+                yield call.result["result"]["alternatives"][0]["message"]["text"]
+                return
+            # Ведущий запрос прерван (например, клиент закрыл соединение) - идем в API сами
+            call = None
+
+        payload = dict(payload)
+        payload['completionOptions'] = dict(payload.get('completionOptions', {}), stream=True)
+        read_timeout = timeout if timeout is not None else self.read_timeout
+
+        start_time = time.time()
+        failed = True
+        response = None
+        text = ""
+        try:
+            # Повторяется только установка потока: после первых фрагментов
+            # ответ уже ушел потребителю
+            # Предохранитель учитывает время до начала ответа
+            response = self._guarded(
+                upstream or self._upstream_for(url),
+                lambda: self._send(url, payload, read_timeout, stream=True)
+            )
+            response.raise_for_status()
+
+            for line in response.iter_lines():
+                if not line:
+                    continue
+                chunk = json.loads(line)
+                alternatives = chunk.get("result", {}).get("alternatives", [])
+                if not alternatives:
+                    continue
+                current = alternatives[0].get("message", {}).get("text", "")
+
+                # Обычно приходит накопленный текст, но поддерживаем и дельты
+                if current.startswith(text):
+                    delta = current[len(text):]
+                    text = current
+                else:
+                    delta = current
+                    text += current
+
+                if delta:
+                    yield delta
+            failed = False
+        except Exception as e:
+            if is_leader:
+                self.single_flight.complete(flight_key, call, error=e)
+            raise
+        except BaseException:
+            # GeneratorExit: потребитель перестал читать поток
+            if is_leader:
+                self.single_flight.abort(flight_key, call)
+            raise
+        finally:
+            if response is not None:
+                response.close()
+            self._record(time.time() - start_time, failed=failed)
+
+        result = {
+            "result": {
+                "alternatives": [
+                    {"message": {"role": "assistant", "text": text}, "status": "ALTERNATIVE_STATUS_FINAL"}
+                ]
+            }
+        }
+        if cache_key is not None:
+            self.cache.set(cache_key, result)
+        if is_leader:
+            self.single_flight.complete(flight_key, call, result=result)
+
+    def tokenize(self, model_uri: str, text: str, timeout: float = 10.0) -> int:
+        """
+        Посчитать токены текста токенизатором модели
+
+        Запросы идут через отдельный предохранитель и отдельную квоту
+        ('tokenize'), чтобы подсчет не расходовал квоту генерации.
+
+        Args:
+            model_uri: модель, чьим токенизатором считать (gpt://<каталог>/yandexgpt/latest)
+            text: текст
+            timeout: таймаут чтения ответа (сек)
+
+        Returns:
+            Число токенов
+
+        Raises:
+            requests.exceptions.RequestException: при сетевой ошибке или HTTP-статусе >= 400
+            RateLimitExceeded: квота токенизатора исчерпана
+            CircuitOpenError: предохранитель токенизатора разомкнут
+        """
+        payload = {"modelUri": model_uri, "text": text}
+        response = self._guarded(
+            'tokenize',
+            lambda: self.post(TOKENIZE_URL, payload, timeout=timeout, rate_key='tokenize')
+        )
+        response.raise_for_status()
+        return len(response.json().get("tokens", []))
+
+    def embed(self, model_uri: str, text: str, timeout: float = 10.0) -> List[float]:
+        """
+        Получить векторное представление текста
+
+        Запросы идут через отдельный предохранитель и отдельную квоту
+        ('embedding'), как и подсчет токенов.
+
+        Args:
+            model_uri: модель эмбеддингов (emb://<каталог>/text-search-doc/latest
+                       для документов, text-search-query - для запросов)
+            text: текст
+            timeout: таймаут чтения ответа (сек)
+
+        Returns:
+            Вектор
+
+        Raises:
+            requests.exceptions.RequestException: при сетевой ошибке или HTTP-статусе >= 400
+            RateLimitExceeded: квота эмбеддингов исчерпана
+            CircuitOpenError: предохранитель эмбеддингов разомкнут
+        """
+        payload = {"modelUri": model_uri, "text": text}
+        response = self._guarded(
+            'embedding',
+            lambda: self.post(EMBEDDING_URL, payload, timeout=timeout, rate_key='embedding')
+        )
+        response.raise_for_status()
+        return [float(value) for value in response.json()["embedding"]]
+
+    def _cache_key(self, payload: Dict[str, Any], url: str,
+                   use_cache: Optional[bool]) -> Optional[str]:
+        """Ключ кэша для запроса или None, если кэш для него не используется"""
+        if self.cache is None:
+            return None
+        if use_cache is None:
+            use_cache = self.cache.is_cacheable(payload)
+        elif not use_cache and self.cache.is_cacheable(payload):
+            self.cache.record_bypass()
+        if not use_cache:
+            return None
+        return self.cache.make_key(payload, url)
+
+    def _flight_key(self, payload: Dict[str, Any], url: str,
+                    use_cache: Optional[bool]) -> Optional[str]:
+        """Ключ объединения запросов в полете или None, если запрос не объединяется"""
+        if self.single_flight is None or use_cache is False:
+            return None
+        return CompletionCache.make_key(payload, url)
+
+    @staticmethod
+    def _upstream_for(url: str) -> str:
+        """Имя предохранителя по адресу метода API"""
+        return 'agents' if url == AGENTS_URL else 'completion'
+
+    def _guarded(self, upstream: str, send: Callable[[], requests.Response]) -> requests.Response:
+        """
+        Выполнить send() под предохранителем сервиса upstream.
+        Ошибкой сервиса считаются сетевые ошибки и ответы 5xx после всех повторов.
+        """
+        breaker = self.breakers.get(upstream)
+        if breaker is None:
+            return send()
+
+        breaker.before_call()
+        start_time = time.time()
+        try:
+            response = send()
+        except requests.exceptions.RequestException:
+            breaker.record(time.time() - start_time, failed=True)
+            raise
+        except BaseException:
+            # Запрос не дошел до API (например, отказ ограничителя частоты)
+            breaker.cancel()
+            raise
+
+        breaker.record(time.time() - start_time, failed=response.status_code >= 500)
+        return response
+
+    def _send(self, url: str, payload: Dict[str, Any], read_timeout: float,
+              stream: bool = False, rate_key: Optional[str] = None) -> requests.Response:
+        """Отправить запрос с повторами; каждая попытка ждет квоту модели"""
+        def attempt() -> requests.Response:
+            self._throttle(payload, rate_key)
+            return self._get_session().post(
+                url, json=payload, timeout=(self.connect_timeout, read_timeout), stream=stream
+            )
+
+        if self.retry_policy is None:
+            return attempt()
+        return self.retry_policy.call(attempt)
+
+    def _throttle(self, payload: Dict[str, Any], rate_key: Optional[str] = None):
+        """Дождаться квоты модели перед отправкой запроса"""
+        if self.rate_limiter is not None:
+            self.rate_limiter.acquire(payload, key=rate_key)
+
+    def _record(self, elapsed: float, failed: bool):
+        """Обновить счетчики запросов"""
+        with self._stats_lock:
+            self._stats['requests'] += 1
+            self._stats['total_time'] += elapsed
+            if failed:
+                self._stats['errors'] += 1
+
+    def get_stats(self) -> Dict[str, Any]:
+        """Получить статистику запросов к API"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats['avg_time'] = round(stats['total_time'] / stats['requests'], 3) if stats['requests'] else 0
+        stats['total_time'] = round(stats['total_time'], 3)
+        stats['pool_size'] = self.pool_size
+        if self.cache is not None:
+            stats['cache'] = self.cache.get_stats()
+        if self.single_flight is not None:
+            stats['single_flight'] = self.single_flight.get_stats()
+        if self.rate_limiter is not None:
+            stats['rate_limits'] = self.rate_limiter.get_stats()
+        if self.retry_policy is not None:
+            stats['retries'] = self.retry_policy.get_stats()
+        if self.breakers:
+            stats['circuits'] = {name: breaker.get_stats() for name, breaker in self.breakers.items()}
+        if self.hedger is not None:
+            stats['hedging'] = self.hedger.get_stats()
+        return stats
+
+    def close(self):
+        """Закрыть все соединения пула"""
+        if self.hedger is not None:
+            self.hedger.shutdown()
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+                self._session = None
+                self._session_pid = None
+
+
+def create_client(config: Dict[str, Any], cache: Optional[CompletionCache] = None) -> YandexClient:
+    """Создать клиент и зарегистрировать закрытие пула при завершении процесса"""
+    client = YandexClient.from_config(config, cache=cache)
+    atexit.register(client.close)
+    return client